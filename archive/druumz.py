@@ -4,7 +4,6 @@ DG_PROBS_NAME = 'group_probs'
 NUDGE_AMT_NAME = 'nudge_amt'
 
 import ast
-import copy
 import json
 import random
 from time import gmtime, strftime
@@ -13,6 +12,9 @@ import numpy as np
 import pandas as pd
 from midiutil import MIDIFile
 
+from drum_engine import PitchSampler
+from note_store import NoteStore
+
 
 class ChanceEntry:
     attributes = ['prob_hit', 'min_vol', 'max_vol', 'duration']
@@ -114,6 +116,7 @@ class ConfigFileGenerator:
 
 
 class MIDINote:
+    __slots__ = ('track', 'channel', 'pitch', 'start', 'duration', 'volume')
 
     def __init__(self, pitch=0, start=0, duration=0, volume=0, track=0, channel=0):
         self.track = track
@@ -130,6 +133,13 @@ class DrumGroup:
         self.midi_pitches = []
         self.midi_probs = []
         self.nudge_amt = 0
+        self._sampler = None
+
+    def sampler(self):
+        # Alias table over midi_pitches, built on first use; raises ValueError for a bad probability vector
+        if self._sampler is None:
+            self._sampler = PitchSampler(self.midi_pitches, self.midi_probs)
+        return self._sampler
 
 
 class MIDIFileGenerator:
@@ -155,6 +165,7 @@ class MIDIFileGenerator:
             dg.midi_pitches = ast.literal_eval(_[MIDI_POS_NAME][drum_group_name])
             dg.midi_probs = ast.literal_eval(_[DG_PROBS_NAME][drum_group_name])
             dg.nudge_amt = _[NUDGE_AMT_NAME][drum_group_name]
+            dg.sampler()
             self.drum_groups[drum_group_name] = dg
 
         # Read data from the probability matrix, as it were
@@ -173,63 +184,27 @@ class MIDIFileGenerator:
                     setattr(entry, a, row[drum_group_name + '_' + a])
 
     def generate_midi_notes_2(self):
-        _ = {}
-        for i in range(0, 2):
-            _ = {**_, **(self.generate_midi_notes_2a(i * 4))}
-        return _
+        return NoteStore.concat(self.generate_midi_notes_2a(i * 4) for i in range(0, 2))
 
     def generate_midi_notes_2a(self, base_measure):
+        # Three plays of the first measure then a fresh variation to close out the phrase.  The repeats share
+        # the first measure's notes rather than copying them
         first_measure = self.build_measure_precursor(base_measure)
-        _ = copy.deepcopy(first_measure)
-
-        for i in range(1, 4):
-            _ = {**_, **(self.duplicate(first_measure, i))}
-
         last_measure = self.build_measure_precursor(base_measure)
-        self._shift_timing(last_measure, 4)
-        _ = {**_, **last_measure}
-
-        return _
+        return first_measure.repeat(3, self.config.beats) + self.duplicate(last_measure, 4)
 
     def build_measure_precursor(self, measure_number):
-        all_notes = {}
-
-        for drum_group_name, drum_group in self.drum_groups.items():
-            notes = self.build_measure_for_dg(measure_number, drum_group_name, drum_group)
-
-            if len(notes) > 0:
-                # Drum group, measure number, and pulse key
-                group_key = drum_group_name + '_m' + str(1)
-                all_notes[group_key] = notes
-
-        return all_notes
+        return NoteStore.concat(self.build_measure_for_dg(measure_number, drum_group_name, drum_group)
+                                for drum_group_name, drum_group in self.drum_groups.items())
 
     def duplicate(self, notes, shift_amount):
-        new_notes = copy.deepcopy(notes)
-        new_notes = {k + '_s' + str(shift_amount): v for k, v in new_notes.items()}
-        self._shift_timing(new_notes, shift_amount)
-        return new_notes
-
-    def _shift_timing(self, notes, shift_amount):
-        for nl in notes.values():
-            for n in nl:
-                n.start = n.start + ((shift_amount - 1) * self.config.beats)
+        return notes.shift((shift_amount - 1) * self.config.beats)
 
     def generate_midi_notes(self):
-        all_notes = {}
-
         # TODO Generate and hold a pattern?  Let other drums revolve around a fixed point
-        for measure in range(self.config.measures):
-
-            for drum_group_name, drum_group in self.drum_groups.items():
-                notes = self.build_measure_for_dg(measure, drum_group_name, drum_group)
-
-                if len(notes) > 0:
-                    # Drum group, measure number, and pulse key
-                    group_key = drum_group_name + '_m' + str(measure)
-                    all_notes[group_key] = notes
-
-        return all_notes
+        return NoteStore.concat(self.build_measure_for_dg(measure, drum_group_name, drum_group)
+                                for measure in range(self.config.measures)
+                                for drum_group_name, drum_group in self.drum_groups.items())
 
     def build_measure_for_dg(self, measure_number, drum_group_name, drum_group):
         notes = []
@@ -239,9 +214,10 @@ class MIDIFileGenerator:
             drum_chance = self.drum_probs.get(chance_key)
 
             if random.random() <= drum_chance.prob_hit:
-                notes.append(self.build_note(drum_group, drum_chance, measure_number, pulse))
+                n = self.build_note(drum_group, drum_chance, measure_number, pulse)
+                notes.append((n.track, n.channel, n.pitch, n.start, n.duration, n.volume))
 
-        return notes
+        return NoteStore.from_records(notes)
 
     def build_note(self, drum_group, drum_chance, measure_number, pulse):
         n = MIDINote()
@@ -254,8 +230,7 @@ class MIDIFileGenerator:
 
     def choose_pitch(self, drum_group):
         # Choose which drum from set of drum groups based on stated probabilities
-        pitch_pos = np.random.choice(np.arange(0, len(drum_group.midi_probs)), p=drum_group.midi_probs)
-        return drum_group.midi_pitches[pitch_pos]
+        return int(drum_group.sampler().sample(random.random()))
 
     def generate_start_time(self, drum_group, measure_adjusted_pulse, laidback):
         # Nudge off the grid, but can't be negative after the nudge
@@ -275,10 +250,8 @@ class MIDIFileGenerator:
         midi_content = MIDIFile(1)
         midi_content.addTrackName(0, 0, strftime("%#m/%d %H:%M:%S", now))
 
-        # filtered_notes = {k: notes[k] for k in notes.keys() if any(xk in k for xk in ['g2', 'g3', 'g4'])}
-        filtered_notes = notes
-        [[midi_content.addNote(n.track, n.channel, n.pitch, n.start, n.duration, n.volume) for n in v]
-         for v in filtered_notes.values()]
+        for track, channel, pitch, start, duration, volume in notes.to_array().tolist():
+            midi_content.addNote(track, channel, pitch, start, duration, volume)
 
         with open('c:/temp/' + strftime("%Y%m%d %H%M%S", now) + '.mid', "wb+") as _:
             midi_content.writeFile(_)
@@ -37,3 +37,18 @@ def test_midi_file_generator():
     assert d.iloc[0]['g1_min_vol'] == 50.0
     assert d.iloc[1]['g2_min_vol'] == 1.0
 
+
+def test_generate_midi_notes_2(config):
+    x = druumz.MIDIFileGenerator()
+    x.config = config
+    dg = druumz.DrumGroup()
+    dg.midi_pitches, dg.midi_probs = [36], [1.0]
+    x.drum_groups = {'g1': dg}
+    x.drum_probs = {'g1' + str(p): druumz.ChanceEntry() for p in config.pulse_keys}
+    for entry in x.drum_probs.values():
+        entry.prob_hit, entry.min_vol, entry.max_vol = 1, 50, 50
+
+    # Two phrases of four measures, every pulse hit
+    starts = x.generate_midi_notes_2().to_array()['time']
+    assert len(starts) == 2 * 4 * 16
+    assert sorted(starts)[::16] == [float(m * config.beats) for m in range(8)]
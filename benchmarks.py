@@ -0,0 +1,263 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import timeit
+import weakref
+from collections import namedtuple
+
+import numpy as np
+
+import countpoint_generator as cg
+import counterpoint_check as cc
+import counterpoint_search as cs
+import drum_audio
+import drum_engine
+import groove
+from drum_config import DrumGroup
+from generation_context import GenerationContext
+from tune_collection import TuneCollection
+
+# Performance benchmarks over synthetic, in-memory inputs.  Each case is a setup function taking one parameter and
+# returning the callable to time.  Results are written as JSON so that runs from different commits can be compared:
+#
+#   python benchmarks.py -o before.json
+#   python benchmarks.py -o after.json --compare before.json
+
+Case = namedtuple('Case', ['name', 'params', 'quick_params', 'setup'])
+
+CASES = []
+
+
+def case(params, quick_params=None):
+    """Registers a benchmark; quick_params is the subset used by --quick"""
+    def register(setup):
+        CASES.append(Case(setup.__name__, params, quick_params or params[:1], setup))
+        return setup
+    return register
+
+
+def _scale():
+    return cg.ScaleManager().build_scale()
+
+
+def _cantus_firmus(scale, length, seed=0):
+    """Random walk over the middle of the scale, starting and ending on C1"""
+    walk = np.cumsum(np.random.default_rng(seed).integers(-2, 3, length))
+    positions = np.clip(scale['C1'] + walk, scale['C0'], scale['C3'])
+    positions[0] = positions[-1] = scale['C1']
+    return cg.Tune.from_positions(scale, positions)
+
+
+def _drum_groups(num_groups):
+    return [DrumGroup(f'g{g}', 1 + g % 4, (36 + g, 48 + g), (0.7, 0.3), 1 + g % 3) for g in range(num_groups)]
+
+
+def _measure(pulses, num_groups, seed=0):
+    hits = np.tile([0.0, 25, 100, 1], (pulses, num_groups, 1))
+    hits[..., drum_engine.PROB_HIT] = np.random.default_rng(seed).random((pulses, num_groups))
+    return np.arange(pulses) / (pulses / 4), hits
+
+
+@case([1_000])
+def scale_getitem(n):
+    scale = _scale()
+    sps = [scale[i % 56] for i in range(n)]
+    return lambda: [scale[scale[sp]] for sp in sps]
+
+
+@case([1_000])
+def scale_sp_to_mp(n):
+    scale = _scale()
+    sps = [scale[i % 56] for i in range(n)]
+    return lambda: [scale.mp_to_sp(scale.sp_to_mp(sp)) for sp in sps]
+
+
+@case([1, 10_000], [1, 100])
+def build_scale(n):
+    sm = cg.ScaleManager()
+    keys = [(root, scale_type) for root in sm._ALL_NOTES for scale_type in sm._SCALES]
+    return lambda: [sm.build_scale(*keys[i % len(keys)]) for i in range(n)]
+
+
+@case([10, 1_000, 100_000], [10, 1_000])
+def tune_construction(n):
+    scale = _scale()
+    sps = _cantus_firmus(scale, n).sps
+    return lambda: cg.Tune(scale, sps)
+
+
+@case([1_000, 100_000, 1_000_000], [1_000])
+def tune_collection_stats(n):
+    scale = _scale()
+    lengths = np.random.default_rng(0).integers(8, 17, n)
+    steps = np.random.default_rng(1).integers(-2, 3, lengths.sum())
+    tunes = TuneCollection(scale, np.clip(scale['C1'] + steps, 0, len(scale) - 1),
+                           np.concatenate([[0], np.cumsum(lengths)]))
+    return lambda: (tunes.ranges(), tunes.peak_sps(), tunes.step_histograms(), tunes.direction_changes(),
+                    tunes.interval_counts())
+
+
+@case([10, 100, 1_000, 10_000], [10, 100])
+def counterpoint_search(n):
+    scale = _scale()
+    tune = _cantus_firmus(scale, n)
+    return lambda: cs.search(scale, tune, max_nodes=4 * n)
+
+
+@case([1_000, 1_000_000], [1_000])
+def counterpoint_check(n):
+    scale = _scale()
+    cf = _cantus_firmus(scale, 16).positions
+    cps = np.clip(scale['C2'] + np.cumsum(np.random.default_rng(0).integers(-2, 3, (n, 16)), axis=1), 0,
+                  len(scale) - 1)
+    cfs = np.broadcast_to(cf, cps.shape)
+    return lambda: cc.check(scale, cfs, cps)
+
+
+@case([(4, 4), (16, 4), (64, 4), (16, 16), (16, 64)], [(4, 4), (16, 16)])
+def generate_measure(params):
+    pulses_beat, num_groups = params
+    groups = drum_engine.compile_drum_groups(_drum_groups(num_groups))
+    pulse_times, hits = _measure(4 * pulses_beat, num_groups)
+    rng = np.random.default_rng(0)
+    return lambda: drum_engine.generate_measure_events(groups, pulse_times, hits, pulses_beat, rng)
+
+
+@case([(8, 1_000_000), (128, 1_000_000)], [(8, 1_000)])
+def pitch_sampler(params):
+    num_pitches, n = params
+    probs = np.random.default_rng(0).random(num_pitches)
+    sampler = drum_engine.PitchSampler(np.arange(num_pitches), probs / probs.sum())
+    rng = np.random.default_rng(0)
+    return lambda: sampler.draw(rng, n)
+
+
+@case([1, 100, 1_000, 10_000], [1, 100])
+def simulate_drum_track(n):
+    groups = _drum_groups(4)
+    measures = {i: _measure(16, 4, i) for i in range(4)}
+    pattern = np.random.default_rng(0).integers(0, 4, n).tolist()
+    return lambda: drum_engine.render_track(groups, measures, pattern, 4, 4, GenerationContext(0))
+
+
+@case([100, 10_000], [100])
+def apply_groove(n):
+    groups = _drum_groups(4)
+    measures = drum_engine.generate_measures(groups, {i: _measure(16, 4, i) for i in range(4)}, 4,
+                                             GenerationContext(0))
+    pattern = np.random.default_rng(0).integers(0, 4, n).tolist()
+    events = drum_engine.stitch_measures(measures, pattern, 4).to_array()
+    g = groove.Groove(swing=0.6, feel=[0, 1, -1, 0], accents=[1.2, 0.9, 1.0, 0.9], humanize=1.0)
+    rng = np.random.default_rng(0)
+    return lambda: groove.apply_groove(events, groups, g, 4, rng)
+
+
+@case([10, 100], [10])
+def mix_audio(n):
+    # n bars at 120 bpm, every note playing a 0.3 s sample
+    groups = _drum_groups(4)
+    measures = drum_engine.generate_measures(groups, {i: _measure(16, 4, i) for i in range(4)}, 4,
+                                             GenerationContext(0))
+    events = drum_engine.stitch_measures(measures, np.random.default_rng(0).integers(0, 4, n).tolist(), 4).to_array()
+    decay = np.exp(-np.arange(13_000) / 3_000)[:, None]
+    frames = (np.random.default_rng(0).uniform(-0.3, 0.3, (13_000, 1)) * decay * 32767).astype('<i2')
+    sample = drum_audio.Sample(frames, 1 / 32768, 44_100)
+    samples = {p: sample for p in np.unique(events['pitch']).tolist()}
+    tmp = tempfile.TemporaryDirectory()
+    path = os.path.join(tmp.name, 'mix.wav')
+
+    def mix():
+        return drum_audio.mix_events(events, samples, path)
+
+    # The directory goes once the case is done with the function
+    weakref.finalize(mix, tmp.cleanup)
+    return mix
+
+
+@case([100, 1_000], [100])
+def mix_dense(n):
+    # 10 s of audio at n notes a second over 8 samples of 0.3 s; mixing must run well inside the 10 s it lasts
+    rng = np.random.default_rng(0)
+    events = np.zeros(10 * n, dtype=drum_engine.EVENT_DTYPE)
+    events['time'] = np.sort(rng.uniform(0, 20, len(events)))
+    events['pitch'] = rng.integers(36, 44, len(events))
+    events['velocity'] = rng.integers(1, 128, len(events))
+    frames = (rng.uniform(-0.1, 0.1, (13_000, 2)) * 32767).astype('<i2')
+    samples = {p: drum_audio.Sample(frames, 1 / 32768, 44_100) for p in range(36, 44)}
+    tmp = tempfile.TemporaryDirectory()
+    path = os.path.join(tmp.name, 'dense.wav')
+
+    def mix():
+        return drum_audio.mix_events(events, samples, path)
+
+    weakref.finalize(mix, tmp.cleanup)
+    return mix
+
+
+@case(['cli', 'druumz2', 'countpoint_generator'], ['cli'])
+def startup(module):
+    return lambda: subprocess.run([sys.executable, '-c', f'import {module}'], check=True)
+
+
+def run(quick=False, select=None, repeats=5):
+    """Runs every (selected) case and returns the results keyed by '<case>[<param>]'"""
+    results = {}
+    for c in CASES:
+        if select and select not in c.name:
+            continue
+        for param in (c.quick_params if quick else c.params):
+            fn = c.setup(param)
+            number, _ = timeit.Timer(fn).autorange()
+            times = [t / number for t in timeit.repeat(fn, number=number, repeat=1 if quick else repeats)]
+            results[f'{c.name}[{param}]'] = {'case': c.name, 'param': str(param), 'number': number,
+                                             'min': min(times), 'mean': sum(times) / len(times)}
+            print(f'{c.name}[{param}]: {min(times) * 1e3:.3f} ms', file=sys.stderr)
+    return results
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def compare(base, head, threshold=1.2):
+    """Ratios of head to base (minimum times) for the cases in both; returns the ones slower than the threshold"""
+    regressions = {}
+    for key in sorted(set(base['results']) & set(head['results'])):
+        ratio = head['results'][key]['min'] / base['results'][key]['min']
+        print(f'{key}: {ratio:.2f}x' + ('  REGRESSION' if ratio > threshold else ''))
+        if ratio > threshold:
+            regressions[key] = ratio
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the performance benchmarks')
+    parser.add_argument('-o', '--output', help='Write the results to this JSON file')
+    parser.add_argument('-k', '--select', help='Only run cases whose name contains this')
+    parser.add_argument('--quick', action='store_true', help='Small inputs and a single repeat')
+    parser.add_argument('--compare', help='Earlier results to compare against; exits non-zero on a regression')
+    parser.add_argument('--threshold', type=float, default=1.2)
+    args = parser.parse_args(argv)
+
+    head = {'commit': _commit(), 'python': platform.python_version(), 'numpy': np.__version__,
+            'results': run(args.quick, args.select)}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(head, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            return 1 if compare(json.load(f), head, args.threshold) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
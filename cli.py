@@ -0,0 +1,272 @@
+import argparse
+import logging
+import sys
+
+# Command line entry point.  Only the standard library is imported up front; every command imports what it needs
+# when it runs, so `--help` and short jobs don't pay for numpy, pandas or midiutil.
+#
+#   python cli.py init-workbook drums.xlsx
+#   python cli.py convert-config drums.xlsx drums.json
+#   python cli.py generate-drums drums.json -p 0 0 0 0 -o drums.mid --seed 1
+#   python cli.py generate-drums drums.xlsx -p 0 0 1 0 -o drums.mid --seed 1 --watch
+#   python cli.py generate-drums drums.json -p 0 0 0 1 -o drums.mid --swing 0.6 --feel 0 1 -1 --humanize 1
+#   python cli.py stream-drums drums.json -p 0 0 0 1 -d /dev/snd/midiC1D0 --tempo 96
+#   python cli.py render-audio drums.json -p 0 0 0 1 -k kit/ -o drums.wav --tempo 96 --pan 0 -0.3 0.4
+#   python cli.py extract-melodies melodies/ -o cantus_firmi.jsonl --max-notes 16
+#   python cli.py generate-counterpoint -i cantus_firmi.jsonl -o counterpoint.jsonl
+#   python cli.py generate-counterpoint C1 D1 F1 E1 F1 G1 A1 G1 E1 D1 C1 -o cp.mid
+#   python cli.py check-counterpoint counterpoint.jsonl -o checked.jsonl
+
+
+def init_workbook(args):
+    import druumz2
+
+    druumz2.build_default_workbook(args.path)
+    logging.info('Created %s', args.path)
+
+
+def _groove(args):
+    from groove import Groove
+
+    if args.swing != 0.5 or args.feel or args.humanize:
+        return Groove(swing=args.swing, swing_unit=args.swing_unit, feel=args.feel or 0.0, humanize=args.humanize)
+    return None
+
+
+def generate_drums(args):
+    import druumz2
+
+    groove = _groove(args)
+    if args.watch:
+        if not args.output:
+            raise SystemExit('--watch needs an --output file to keep up to date')
+        return druumz2.watch_drum_track(args.pattern, args.config, args.output, args.seed, args.interval,
+                                        groove=groove)
+
+    path = druumz2.simulate_drum_track(args.pattern, args.config, args.output, args.seed, args.workers, groove)
+    logging.info('Wrote %s', path)
+
+
+def convert_config(args):
+    import drum_config
+
+    drum_config.convert(args.src, args.dst)
+    logging.info('Converted %s to %s', args.src, args.dst)
+
+
+def stream_drums(args):
+    import asyncio
+    from itertools import cycle, islice
+
+    import drum_config
+    import drum_stream
+    import druumz2
+    from generation_context import GenerationContext
+
+    config = drum_config.load_config(args.config)
+    # Play the pattern the given number of bars (repeating as needed) or loop until interrupted
+    pattern = islice(cycle(args.pattern), args.bars) if args.bars else cycle(args.pattern)
+    if args.device:
+        sink = drum_stream.MidiByteSink(open(args.device, 'wb', buffering=0), tempo=args.tempo)
+    else:
+        sink = drum_stream.SmfFileSink(args.output, tempo=args.tempo)
+
+    stats = asyncio.run(drum_stream.stream_drum_track(config.group_table, config.measures, pattern, sink,
+                                                      druumz2.pulses_beat, druumz2.beats_measure,
+                                                      GenerationContext(args.seed), lookahead=args.lookahead))
+    logging.info('Streamed %s bars (%s messages, %s underruns)', *stats)
+    if args.device:
+        logging.info('Worst lateness %.1f ms', 1000 * sink.max_lateness)
+        sink.stream.close()
+
+
+def render_audio(args):
+    import drum_audio
+    import drum_config
+    import druumz2
+    from generation_context import GenerationContext
+
+    config = drum_config.load_config(args.config)
+    stats = drum_audio.render_audio(config.group_table, config.measures, args.pattern, druumz2.pulses_beat,
+                                    druumz2.beats_measure, GenerationContext(args.seed), args.samples, args.output,
+                                    args.tempo, _groove(args), args.pan, args.gain)
+    logging.info('Wrote %s (%.1f s, peak %.2f)', args.output, stats.frames / stats.rate, stats.peak)
+    if stats.clipped:
+        logging.warning('%s sample values clipped; try a lower --gain', stats.clipped)
+
+
+def extract_melodies(args):
+    import midi_corpus
+
+    return midi_corpus.main([args.root, '-o', args.output, '--min-notes', str(args.min_notes)] +
+                            (['--max-notes', str(args.max_notes)] if args.max_notes else []))
+
+
+def generate_counterpoint(args):
+    if args.input:
+        import counterpoint_batch
+
+        batch_args = [args.input, '-o', args.output or '-', '--n-best', str(args.n_best), '--seed', str(args.seed or 0)]
+        batch_args += ['--max-nodes', str(args.max_nodes)] if args.max_nodes is not None else []
+        return counterpoint_batch.main(batch_args + (['-w', str(args.workers)] if args.workers is not None else []))
+
+    import countpoint_generator as cg
+    import counterpoint_search as cs
+    import scratch
+    from generation_context import GenerationContext
+
+    scale = cg.ScaleManager().build_scale(args.root, args.scale_type)
+    cf_tune = cg.Tune(scale, args.sps)
+    # Each search has its own default budget, sized to its moves
+    budget = {} if args.max_nodes is None else {'max_nodes': args.max_nodes}
+    if args.voices > 1:
+        import counterpoint_voices as cv
+
+        result = cv.search(scale, cf_tune, num_voices=args.voices, beam_width=args.beam_width,
+                           time_budget=args.time_budget, rng=GenerationContext(args.seed).voice_rng(1), **budget)
+        if result.dead_end:
+            logging.warning('No voices can follow the rules past note %s of %s; writing the partial score',
+                            len(result.voices[0]), len(cf_tune))
+        elif not result.complete:
+            logging.warning('Budget ran out after %s of %s notes; writing the partial score', len(result.voices[0]),
+                            len(cf_tune))
+        for sps in result.voices:
+            print(' '.join(sps))
+        if args.output:
+            scratch.write_counterpoint(args.output, cf_tune, *(cg.Tune(scale, sps) for sps in result.voices))
+        return
+
+    result = cs.search(scale, cf_tune, n_best=args.n_best, rng=GenerationContext(args.seed).voice_rng(1), **budget)
+    if not result.lines:
+        raise SystemExit(f'No counterpoint found ({"no solution exists" if result.complete else "budget ran out"})')
+
+    for line in result.lines:
+        print(' '.join(line.sps))
+    if args.output:
+        scratch.write_counterpoint(args.output, cf_tune, cg.Tune(scale, result.lines[0].sps))
+
+
+def check_counterpoint(args):
+    import counterpoint_check
+
+    return counterpoint_check.main([args.input, '-o', args.output] +
+                                   (['--max-leap', str(args.max_leap)] if args.max_leap is not None else []))
+
+
+def _add_groove_arguments(p):
+    p.add_argument('--swing', type=float, default=0.5, help='Swing ratio; 0.5 is straight, 0.67 a triplet shuffle')
+    p.add_argument('--swing-unit', type=float, default=0.5, help='Length swung, in quarter notes')
+    p.add_argument('--feel', type=float, nargs='+',
+                   help='Lean of each drum group in units of its nudge; positive lays back, negative pushes')
+    p.add_argument('--humanize', type=float, default=0.0, help="Random jitter per note, in units of each group's nudge")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='druumz', description='Drum track and counterpoint generation')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Log progress')
+    parser.add_argument('--stats', help='Write stage timings and counters to this JSON file')
+    parser.add_argument('--profile', help='Write cProfile stats to this file')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('init-workbook', help='Write a workbook with representative default settings')
+    p.add_argument('path')
+    p.set_defaults(func=init_workbook)
+
+    p = commands.add_parser('convert-config', help='Convert a drum config between workbook, JSON, TOML and CSV')
+    p.add_argument('src')
+    p.add_argument('dst', help='.json or .toml file, or a directory (no extension) of CSVs')
+    p.set_defaults(func=convert_config)
+
+    p = commands.add_parser('generate-drums', help='Render a drum track from a drum config')
+    p.add_argument('config', help='Workbook, .json or .toml file or directory of CSVs')
+    p.add_argument('-p', '--pattern', type=int, nargs='+', default=[0],
+                   help='Measure (prob_hits_N sheet) to play in each bar')
+    p.add_argument('-o', '--output', help='MIDI file to write; time stamped in the working directory by default')
+    p.add_argument('-s', '--seed', type=int)
+    p.add_argument('-w', '--workers', type=int, default=0, help='Worker processes for measure generation')
+    p.add_argument('--watch', action='store_true',
+                   help='Keep running, re-rendering whatever changed each time the config is saved')
+    p.add_argument('--interval', type=float, default=1.0, help='Seconds between checks for changes when watching')
+    _add_groove_arguments(p)
+    p.set_defaults(func=generate_drums)
+
+    p = commands.add_parser('stream-drums', help='Stream a drum track bar by bar to a MIDI device or file')
+    p.add_argument('config', help='Workbook, .json or .toml file or directory of CSVs')
+    p.add_argument('-p', '--pattern', type=int, nargs='+', default=[0], help='Measure to play in each bar')
+    p.add_argument('-n', '--bars', type=int, help='Bars to play, repeating the pattern; loops forever by default')
+    out = p.add_mutually_exclusive_group(required=True)
+    out.add_argument('-d', '--device', help='Raw MIDI device to play to in real time, e.g. /dev/snd/midiC1D0')
+    out.add_argument('-o', '--output', help='MIDI file to stream to')
+    p.add_argument('-t', '--tempo', type=float, default=120)
+    p.add_argument('-s', '--seed', type=int)
+    p.add_argument('--lookahead', type=int, default=1, help='Bars generated ahead of playback')
+    p.set_defaults(func=stream_drums)
+
+    p = commands.add_parser('render-audio', help='Render a drum track to a WAV file from a kit of samples')
+    p.add_argument('config', help='Workbook, .json or .toml file or directory of CSVs')
+    p.add_argument('-p', '--pattern', type=int, nargs='+', default=[0], help='Measure to play in each bar')
+    p.add_argument('-k', '--samples', required=True, help='Directory holding a <pitch>.wav for every pitch played')
+    p.add_argument('-o', '--output', required=True, help='WAV file to write')
+    p.add_argument('-t', '--tempo', type=float, default=120)
+    p.add_argument('-s', '--seed', type=int)
+    p.add_argument('--pan', type=float, nargs='+', help='Position of each drum group, -1 (left) to 1 (right)')
+    p.add_argument('--gain', type=float, default=1.0)
+    _add_groove_arguments(p)
+    p.set_defaults(func=render_audio)
+
+    p = commands.add_parser('extract-melodies', help='Pull melodies out of MIDI files as cantus firmi')
+    p.add_argument('root', help='MIDI file or directory to search')
+    p.add_argument('-o', '--output', default='-', help='JSON lines file, as taken by generate-counterpoint -i')
+    p.add_argument('--min-notes', type=int, default=8)
+    p.add_argument('--max-notes', type=int, help='Cut longer melodies into phrases of this many notes')
+    p.set_defaults(func=extract_melodies)
+
+    p = commands.add_parser('generate-counterpoint', help='Write counterpoint against a cantus firmus')
+    p.add_argument('sps', nargs='*', help='Cantus firmus as scientific pitches, e.g. C1 D1 F1')
+    p.add_argument('-i', '--input', help='JSON lines file of cantus firmi to run as a batch instead')
+    p.add_argument('-o', '--output', help='MIDI file (or JSON lines output for a batch)')
+    p.add_argument('--root', default='C')
+    p.add_argument('--scale-type', default='Major')
+    p.add_argument('-s', '--seed', type=int)
+    p.add_argument('-w', '--workers', type=int, help='Worker processes for a batch')
+    p.add_argument('--n-best', type=int, default=1)
+    p.add_argument('--max-nodes', type=int,
+                   help='Search budget; by default 100,000 for one voice and a full beam at every note for more')
+    p.add_argument('--voices', type=int, default=1, help='Voices to write; more than one uses a beam search')
+    p.add_argument('--beam-width', type=int, default=64)
+    p.add_argument('--time-budget', type=float, help='Seconds allowed for a multi-voice search')
+    p.set_defaults(func=generate_counterpoint)
+
+    p = commands.add_parser('check-counterpoint', help='Score a batch of counterpoint against the rules')
+    p.add_argument('input', help="JSON lines output of generate-counterpoint -i; '-' for stdin")
+    p.add_argument('-o', '--output', default='-', help='JSON lines file with the checks added')
+    p.add_argument('--max-leap', type=int, help='Largest move allowed, in semitones; an octave (12) by default')
+    p.set_defaults(func=check_counterpoint)
+
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.func is generate_counterpoint and not (args.sps or args.input):
+        parser.error('generate-counterpoint needs a cantus firmus, or a batch of them with -i')
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    if args.stats or args.profile:
+        import instrumentation
+        instrumentation.enable(profile=bool(args.profile))
+
+    try:
+        return args.func(args) or 0
+    finally:
+        if args.stats or args.profile:
+            instrumentation.disable()
+            if args.stats:
+                instrumentation.dump_json(args.stats)
+            if args.profile:
+                instrumentation.dump_stats(args.profile)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+import argparse
+import json
+import os
+import sys
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import islice
+
+import countpoint_generator as cg
+import counterpoint_search as cs
+from generation_context import GenerationContext
+
+# Counterpoint for a whole library of cantus firmi.  Items are fanned out across a process pool in chunks and the
+# results come back in input order.  Each item draws from its own seed, derived from the batch seed and the item's
+# position in the input, so the output does not depend on the number of workers.  An item that can't be searched
+# (an unknown scale, a note outside it) gets an 'error' in its result instead of stopping the batch.
+
+CantusFirmus = namedtuple('CantusFirmus', ['root', 'scale_type', 'sps'])
+
+
+@lru_cache(maxsize=None)
+def scale_manager():
+    """One ScaleManager per process; its scales are cached too"""
+    return cg.ScaleManager()
+
+
+def generate(index, cantus_firmus, seed=0, **search_kwargs):
+    """Counterpoint for a single cantus firmus, as a JSON friendly dict"""
+    scale = scale_manager().build_scale(cantus_firmus.root, cantus_firmus.scale_type)
+    tune = cg.Tune(scale, cantus_firmus.sps)
+    rng = GenerationContext(seed).item_rng(index)
+    result = cs.search(scale, tune, rng=rng, **search_kwargs)
+    return {'index': index,
+            'root': cantus_firmus.root,
+            'scale_type': cantus_firmus.scale_type,
+            'cantus_firmus': list(cantus_firmus.sps),
+            'counterpoint': [ln.sps for ln in result.lines],
+            'costs': [ln.cost for ln in result.lines],
+            'nodes': result.nodes,
+            'complete': result.complete}
+
+
+def _generate_item(index, cantus_firmus, seed, search_kwargs):
+    """generate, with any error recorded in an otherwise empty result"""
+    try:
+        return generate(index, cantus_firmus, seed, **search_kwargs)
+    except Exception as e:
+        root, scale_type, sps = cantus_firmus
+        return {'index': index,
+                'root': root,
+                'scale_type': scale_type,
+                'cantus_firmus': list(sps),
+                'counterpoint': [],
+                'costs': [],
+                'nodes': 0,
+                'complete': False,
+                'error': f'{type(e).__name__}: {e}'}
+
+
+def _generate_chunk(start, chunk, seed, search_kwargs):
+    return [_generate_item(start + i, cf, seed, search_kwargs) for i, cf in enumerate(chunk)]
+
+
+def generate_batch(cantus_firmi, workers=None, seed=0, chunksize=16, **search_kwargs):
+    """
+    Yields the counterpoint for every cantus firmus, in input order.  The input is read lazily and only a bounded
+    number of chunks are in flight at once, so it can be an arbitrarily long stream.  Items that fail carry an
+    'error' and no counterpoint.
+
+    :param workers: Size of the process pool, defaulting to the CPU count; 0 runs everything in this process
+    :param search_kwargs: Passed through to counterpoint_search.search
+    """
+    items = iter(cantus_firmi)
+    if workers == 0:
+        for i, cf in enumerate(items):
+            yield _generate_item(i, cf, seed, search_kwargs)
+        return
+
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        start = 0
+        while True:
+            # Keep every worker busy with a chunk in reserve
+            while len(pending) < 2 * workers:
+                chunk = list(islice(items, chunksize))
+                if not chunk:
+                    break
+                pending.append(pool.submit(_generate_chunk, start, chunk, seed, search_kwargs))
+                start += len(chunk)
+
+            if not pending:
+                break
+            yield from pending.popleft().result()
+
+
+def read_cantus_firmi(lines):
+    """Parses JSON lines of the form {"root": "C", "scale_type": "Major", "sps": ["C1", "D1", ...]}"""
+    for line in lines:
+        if line.strip():
+            item = json.loads(line)
+            yield CantusFirmus(item.get('root', 'C'), item.get('scale_type', 'Major'), item['sps'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate counterpoint for a file of cantus firmi')
+    parser.add_argument('input', help="JSON lines file of cantus firmi; '-' for stdin")
+    parser.add_argument('-o', '--output', default='-', help="JSON lines output file; '-' for stdout")
+    parser.add_argument('-w', '--workers', type=int, default=None, help='Worker processes; 0 to run in-process')
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('--chunksize', type=int, default=16)
+    parser.add_argument('--n-best', type=int, default=1)
+    parser.add_argument('--max-nodes', type=int, default=100_000)
+    args = parser.parse_args(argv)
+
+    src = sys.stdin if args.input == '-' else open(args.input)
+    dst = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        results = generate_batch(read_cantus_firmi(src), args.workers, args.seed, args.chunksize,
+                                 n_best=args.n_best, max_nodes=args.max_nodes)
+        for result in results:
+            dst.write(json.dumps(result) + '\n')
+    finally:
+        if src is not sys.stdin:
+            src.close()
+        if dst is not sys.stdout:
+            dst.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+import argparse
+import json
+import sys
+from collections import namedtuple
+from itertools import islice
+
+import numpy as np
+
+import countpoint_generator as cg
+import counterpoint_search as cs
+from tune_collection import TuneCollection
+
+# Rule checking and scoring for counterpoint in bulk: any number of (cantus firmus, counterpoint) pairs over one
+# scale, held as flat arrays of scale positions plus offsets like a TuneCollection.  Every rule is worked out for
+# every note of every pair with a few lookups into the scale's RuleTable, and the per pair counts come out of one
+# reduceat, so a million candidates are checked as quickly as a handful.  Intervals come from the positions, while
+# anything about height (crossing, leaps, steps into the cadence) is measured on MIDI pitches: positions are not in
+# pitch order for every root.
+#
+#   result = check(scale, cantus_firmi, counterpoints)      # TuneCollections, or (pairs x notes) position arrays
+#   best = rank(result)[:100]
+#   pairs, notes = violations(result, PARALLEL | DISSONANCE)
+#
+#   python counterpoint_check.py counterpoint.jsonl -o checked.jsonl
+
+# Rules, as bits of the flag kept for each note.  The flag sits on the note that breaks the rule: the second note of
+# a parallel, leap or repeat and the last note of the pair for the cadence.
+PARALLEL, CROSSING, DISSONANCE, LEAP, REPEAT, CADENCE = (1 << k for k in range(6))
+RULES = ('parallel', 'crossing', 'dissonance', 'leap', 'repeat', 'cadence')
+ALL_RULES = (1 << len(RULES)) - 1
+
+# Score added per violation of each rule, in the order of RULES; on top of the line's motion cost
+DEFAULT_WEIGHTS = (100, 100, 100, 50, 20, 50)
+
+# flags: rule bits of every note, laid out like the inputs' positions.  counts: (pairs x rules) violations.
+# costs: motion cost of each counterpoint as counterpoint_search scores it.  scores: costs plus weighted counts
+CheckResult = namedtuple('CheckResult', ['flags', 'offsets', 'counts', 'costs', 'scores'])
+
+
+def check(scale, cantus_firmi, counterpoints, max_leap: int = None, above: bool = True,
+          weights=DEFAULT_WEIGHTS) -> CheckResult:
+    """
+    Checks every counterpoint against its cantus firmus:
+
+      parallel    a perfect interval (see countpoint_generator.PERFECT_INTERVALS) straight after another, as the
+                  search forbids, or octaves/unisons with both voices moving
+      crossing    the counterpoint on the wrong side of the cantus firmus
+      dissonance  a 2nd or 7th against the cantus firmus
+      leap        a move of more than max_leap semitones; an octave by default
+      repeat      a note the same as either of the two before it
+      cadence     an ending other than an octave or unison approached by step in contrary motion
+
+    :param cantus_firmi: TuneCollection, or (pairs x notes) array of scale positions; use scale.mps_to_positions for
+                         MIDI pitches
+    :param counterpoints: Same layout as cantus_firmi, one counterpoint per cantus firmus
+    :param above: Whether the counterpoint is the upper voice
+    :param weights: Score per violation of each rule
+    """
+    cf, offsets = _flat(cantus_firmi)
+    cp, cp_offsets = _flat(counterpoints)
+    if not np.array_equal(offsets, cp_offsets):
+        raise ValueError('Every counterpoint must be as long as its cantus firmus')
+    cf, cp = scale.check_positions(cf), scale.check_positions(cp)
+    max_leap = 12 if max_leap is None else max_leap
+    rules = scale.rules
+    cp_mps, cf_mps = scale.positions_to_mps(cp), scale.positions_to_mps(cf)
+
+    lengths = np.diff(offsets)
+    has_prev = np.ones(len(cp), dtype=bool)
+    has_prev[offsets[:-1]] = False
+    has_two_prev = has_prev & np.roll(has_prev, 1)
+    cp_step, cf_step = _steps(cp, offsets), _steps(cf, offsets)
+    cp_move, cf_move = _steps(cp_mps, offsets), _steps(cf_mps, offsets)
+    # Both rule lookups share one flat index into the (cp x cf) tables
+    pair_idx = cp * len(scale) + cf
+    intervals = rules.intervals.ravel()[pair_idx].astype(np.int64)
+    prev_intervals = np.where(has_prev, np.roll(intervals, 1), intervals)
+
+    parallel = rules.parallel.ravel()[prev_intervals * rules.parallel.shape[1] + intervals]
+    parallel |= (prev_intervals == 1) & (intervals == 1) & (cp_step != 0) & (cf_step != 0)
+    last = offsets[1:] - 1
+    stepwise_contrary = (np.abs(cp_move[last]) <= 2) & (np.sign(cp_move[last]) * np.sign(cf_move[last]) == -1)
+    cadence = np.zeros(len(cp), dtype=bool)
+    cadence[last] = (intervals[last] != 1) | ((lengths > 1) & ~stepwise_contrary)
+
+    # One mask per rule, in the order of RULES
+    broken = [has_prev & parallel,
+              cp_mps < cf_mps if above else cp_mps > cf_mps,
+              ~rules.consonant.ravel()[pair_idx],
+              np.abs(cp_move) > max_leap,
+              (has_prev & (cp_step == 0)) | (has_two_prev & (cp == np.roll(cp, 2))),
+              cadence]
+
+    flags = np.zeros(len(cp), dtype=np.uint8)
+    counts = np.empty((len(lengths), len(RULES)), dtype=np.int64)
+    for k, mask in enumerate(broken):
+        mask = mask.view(np.uint8)
+        flags |= mask << k
+        counts[:, k] = np.add.reduceat(mask, offsets[:-1], dtype=np.int64)
+
+    costs = np.add.reduceat(cs.move_cost(cp_step, np.sign(cf_step)) * has_prev, offsets[:-1]).astype(np.float64)
+    scores = costs + counts @ np.asarray(weights, dtype=np.float64)
+    return CheckResult(flags, offsets, counts, costs, scores)
+
+
+def _flat(tunes):
+    """Flat positions and offsets of a TuneCollection or a (pairs x notes) array"""
+    if isinstance(tunes, TuneCollection):
+        return tunes.positions.astype(np.int64), tunes.offsets
+    tunes = np.asarray(tunes, dtype=np.int64)
+    if tunes.ndim != 2 or tunes.shape[1] == 0:
+        raise ValueError(f'Expected a TuneCollection or a (pairs x notes) array; got shape {tunes.shape}')
+    return tunes.ravel(), np.arange(len(tunes) + 1, dtype=np.int64) * tunes.shape[1]
+
+
+def _steps(positions, offsets):
+    """Move into each note from the one before it in the same tune; 0 for first notes"""
+    steps = np.zeros(len(positions), dtype=np.int64)
+    steps[1:] = np.diff(positions)
+    steps[offsets[:-1]] = 0
+    return steps
+
+
+def passes(result: CheckResult, rules: int = ALL_RULES) -> np.ndarray:
+    """Mask of the pairs that break none of the rules"""
+    return ~np.logical_or.reduceat((result.flags & rules) != 0, result.offsets[:-1])
+
+
+def rank(result: CheckResult) -> np.ndarray:
+    """Pair indices, best (lowest) score first; ties keep their input order"""
+    return np.argsort(result.scores, kind='stable')
+
+
+def violations(result: CheckResult, rules: int = ALL_RULES):
+    """(pair, note within the pair) of every note breaking any of the rules"""
+    idxs = np.flatnonzero(result.flags & rules)
+    pairs = np.searchsorted(result.offsets, idxs, side='right') - 1
+    return pairs, idxs - result.offsets[pairs]
+
+
+def check_batch(items, scale_manager=None, chunk: int = 10_000, **kwargs):
+    """
+    Yields each counterpoint_batch result with a 'checks' list added: the score and rule counts of every line.
+    Items are checked chunk at a time, grouped by scale.
+    """
+    scale_manager = scale_manager or cg.ScaleManager()
+    items = iter(items)
+    while True:
+        batch = list(islice(items, chunk))
+        if not batch:
+            return
+        by_scale = {}
+        for i, item in enumerate(batch):
+            item['checks'] = [None] * len(item['counterpoint'])
+            for j in range(len(item['counterpoint'])):
+                by_scale.setdefault((item['root'], item['scale_type']), []).append((i, j))
+
+        for (root, scale_type), lines in by_scale.items():
+            scale = scale_manager.build_scale(root, scale_type)
+            cfs = TuneCollection.from_sps(scale, [batch[i]['cantus_firmus'] for i, _ in lines])
+            cps = TuneCollection.from_sps(scale, [batch[i]['counterpoint'][j] for i, j in lines])
+            result = check(scale, cfs, cps, **kwargs)
+            for (i, j), score, counts in zip(lines, result.scores.tolist(), result.counts.tolist()):
+                batch[i]['checks'][j] = {'score': score, 'violations': dict(zip(RULES, counts))}
+        yield from batch
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check and score counterpoint_batch output')
+    parser.add_argument('input', help="JSON lines output of counterpoint_batch; '-' for stdin")
+    parser.add_argument('-o', '--output', default='-', help="JSON lines output file; '-' for stdout")
+    parser.add_argument('--max-leap', type=int, help='Largest move allowed, in semitones; an octave (12) by default')
+    parser.add_argument('--chunk', type=int, default=10_000, help='Items checked at a time')
+    args = parser.parse_args(argv)
+
+    src = sys.stdin if args.input == '-' else open(args.input)
+    dst = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        items = (json.loads(line) for line in src if line.strip())
+        for item in check_batch(items, chunk=args.chunk, max_leap=args.max_leap):
+            dst.write(json.dumps(item) + '\n')
+    finally:
+        if src is not sys.stdin:
+            src.close()
+        if dst is not sys.stdout:
+            dst.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+from collections import namedtuple
+
+import numpy as np
+
+import instrumentation
+
+# Depth-first counterpoint search against a cantus firmus.  Works on scale positions throughout and applies the
+# same rules as scratch.real_cp2 did: no 2nds or 7ths against the cantus firmus, no 4th/5th straight after a
+# 4th/5th and no repeat of either of the two previous notes.  Every branch is pruned as soon as it breaks a rule,
+# can no longer reach the final note or costs more than the worst line kept so far.  The rules are looked up in the
+# scale's compiled RuleTable, so every candidate for a position is checked with a couple of array lookups.
+
+Line = namedtuple('Line', ['cost', 'sps'])
+SearchResult = namedtuple('SearchResult', ['lines', 'nodes', 'complete'])
+
+# Extra cost on top of the size of the step for contrary, oblique and similar motion to the cantus firmus
+_MOTION_PENALTY = np.array([0, 1, 3])
+
+
+def search(scale, tune, n_best=1, max_leap=4, max_nodes=100_000, start_octave=3, rng=None):
+    """
+    Finds the n_best cheapest counterpoint lines for the tune.  The line starts and ends on the starting note of
+    the tune, moved to start_octave.
+
+    :param max_leap: Largest move, in scale positions, between two consecutive notes
+    :param max_nodes: Budget of notes placed before the search gives up; bounds the running time
+    :param rng: Optional numpy Generator used to break ties between equally cheap notes
+    :return: SearchResult holding the lines found (cheapest first), the nodes visited and whether the search ran
+             to completion.  No lines on a complete search means there is no solution.
+    """
+    if not len(tune.positions):
+        raise ValueError('The cantus firmus has no notes')
+    with instrumentation.stage('counterpoint search'):
+        return _search(scale, tune, n_best, max_leap, max_nodes, start_octave, rng)
+
+
+def _search(scale, tune, n_best, max_leap, max_nodes, start_octave, rng):
+    cf = tune.positions
+    n = len(cf)
+    start = scale[scale.sp_to_note(tune.starting_sp()) + str(start_octave)]
+    if n < 3:
+        return SearchResult([Line(0, [scale[start]] * n)], 0, True)
+
+    rules = scale.rules
+    cf_dirs = np.sign(np.diff(cf))
+    line = np.full(n, start, dtype=np.int64)
+    intervals = np.zeros(n, dtype=np.int64)
+    intervals[0] = rules.intervals[start, cf[0]]
+    costs = np.zeros(n)
+
+    best = []
+    nodes = backtracks = 0
+    complete = True
+    stack = [_candidates(rules, cf, cf_dirs, line, intervals, 1, max_leap, rng)]
+
+    while stack:
+        i = len(stack)
+        options, option_costs = stack[-1]
+        if not options:
+            stack.pop()
+            backtracks += 1
+            continue
+
+        if nodes == max_nodes:
+            complete = False
+            break
+        nodes += 1
+
+        p, cost = options.pop(), costs[i - 1] + option_costs.pop()
+        if len(best) == n_best and cost >= best[-1].cost:
+            # Options are cheapest first, so nothing else at this depth can do better
+            options.clear()
+            continue
+
+        line[i], intervals[i], costs[i] = p, rules.intervals[p, cf[i]], cost
+        if i < n - 2:
+            stack.append(_candidates(rules, cf, cf_dirs, line, intervals, i + 1, max_leap, rng))
+            continue
+
+        # Close out on the final note
+        total = cost + move_cost(start - p, cf_dirs[-1])
+        if len(best) < n_best or total < best[-1].cost:
+            best.append(Line(float(total), scale.positions_to_sps(line)))
+            best.sort(key=lambda ln: ln.cost)
+            del best[n_best:]
+
+    instrumentation.count('candidates tried', nodes)
+    instrumentation.count('backtracks', backtracks)
+    return SearchResult(best, nodes, complete)
+
+
+def best_line(scale, tune, **kwargs):
+    """Cheapest counterpoint line as a list of sps.  Raises a ValueError if there is none."""
+    result = search(scale, tune, **kwargs)
+    if not result.lines:
+        reason = 'no solution exists' if result.complete else 'node budget ran out'
+        raise ValueError(f'No counterpoint found for {tune}: {reason}')
+    return result.lines[0].sps
+
+
+def move_cost(steps, cf_dir):
+    return np.abs(steps) + _MOTION_PENALTY[np.sign(steps) * cf_dir + 1]
+
+
+def _candidates(rules, cf, cf_dirs, line, intervals, i, max_leap, rng):
+    """Notes allowed at position i, and their costs, ordered so that pop() returns the cheapest"""
+    prev = line[i - 1]
+    cands = np.arange(max(0, prev - max_leap), min(len(rules.intervals) - 1, prev + max_leap) + 1)
+
+    allowed = rules.consonant[cands, cf[i]] & ~rules.parallel[intervals[i - 1], rules.intervals[cands, cf[i]]]
+    allowed &= (cands != prev) & (cands != line[max(0, i - 2)])
+    # Must still be able to get back to the final note
+    allowed &= np.abs(cands - line[-1]) <= max_leap * (len(cf) - 1 - i)
+
+    cands = cands[allowed]
+    if rng is not None:
+        cands = rng.permutation(cands)
+    cand_costs = move_cost(cands - prev, cf_dirs[i - 1])
+    order = np.argsort(-cand_costs, kind='stable')
+    return cands[order].tolist(), cand_costs[order].tolist()
@@ -0,0 +1,149 @@
+import time
+from collections import namedtuple
+from itertools import product
+
+import numpy as np
+
+import counterpoint_search as cs
+import instrumentation
+
+# Beam search for several counterpoint voices over a cantus firmus (3 or 4 part writing).  Voices are stacked above
+# the cantus firmus, lowest first, and the score is built a column at a time: every state in the beam is extended by
+# each combination of moves for its voices, the moves are checked against the previous column only and the
+# beam_width cheapest distinct states go on to the next column.  Each voice keeps to the rules of counterpoint_search
+# against the cantus firmus; on top of that, voices may not cross, clash (2nds and 7ths) or move in parallel perfect
+# intervals with one another, nor in parallel octaves with the voice next to them.  Four voices can't all sit on
+# different pitch classes without a 2nd or 7th between two of them, so voices further apart may double each other.
+# Crossing is judged on MIDI pitches, as scale positions are not in pitch order for every root.  The rules that
+# involve one voice at a time are applied to each voice's moves before they are combined, so only the surviving
+# combinations are checked pair by pair.
+
+VoicesResult = namedtuple('VoicesResult', ['voices', 'cost', 'nodes', 'complete', 'dead_end'])
+
+
+def search(scale, tune, num_voices=2, beam_width=64, max_leap=3, max_nodes=None, time_budget=None,
+           start_octaves=None, rng=None):
+    """
+    Writes num_voices lines against the tune.  Each voice starts and ends on the starting note of the tune, moved
+    to its octave.
+
+    :param beam_width: States kept per column; wider searches more of the space, narrower runs faster
+    :param max_leap: Largest move, in scale positions, of any voice between two columns
+    :param max_nodes: Budget of candidate columns checked before giving up; by default enough for a full beam at
+                      every column, beam_width * (2 * max_leap + 1) ** num_voices per column
+    :param time_budget: Seconds allowed before giving up
+    :param start_octaves: Octave of each voice, lowest first; by default one octave apart above the tune's
+    :param rng: Optional numpy Generator used to break ties between equally cheap states
+    :return: VoicesResult holding each voice as a list of sps, the cost, the nodes checked, whether the voices
+             run the whole length of the tune and whether the search stopped because no state could go on under
+             the rules (rather than for lack of budget).  Either way it returns the cheapest partial score,
+             covering the columns it got through.
+    """
+    if not len(tune.positions):
+        raise ValueError('The cantus firmus has no notes')
+    with instrumentation.stage('voice search'):
+        return _search(scale, tune, num_voices, beam_width, max_leap, max_nodes, time_budget, start_octaves, rng)
+
+
+def _search(scale, tune, num_voices, beam_width, max_leap, max_nodes, time_budget, start_octaves, rng):
+    deadline = None if time_budget is None else time.perf_counter() + time_budget
+    rules = scale.rules
+    cf = tune.positions
+    n = len(cf)
+    note = scale.sp_to_note(tune.starting_sp())
+    octave = int(tune.starting_sp()[len(note):])
+    start_octaves = start_octaves or range(octave + 1, octave + 1 + num_voices)
+    starts = np.array([scale[f'{note}{o}'] for o in start_octaves], dtype=np.int64)
+
+    mps = scale.positions_to_mps(np.arange(len(scale)))
+    cf_dirs = np.sign(np.diff(cf))
+    steps = np.arange(-max_leap, max_leap + 1)
+    move_idxs = np.array(list(product(range(len(steps)), repeat=num_voices)), dtype=np.int64)
+    pairs = [(a, b) for a in range(num_voices) for b in range(a + 1, num_voices)]
+    lower, upper = np.array(pairs, dtype=np.int64).reshape(-1, 2).T
+
+    # Beam state: positions of the current and previous column and the cost so far
+    pos, prev, cost = starts[None, :], starts[None, :], np.zeros(1)
+    history = [(np.zeros(1, dtype=np.int64), pos)]
+    if max_nodes is None:
+        max_nodes = beam_width * len(move_idxs) * (n - 1)
+    nodes = 0
+    dead_end = False
+
+    for i in range(1, n):
+        last = i == n - 1
+        size = len(pos) * (1 if last else len(move_idxs))
+        if nodes + size > max_nodes or (deadline is not None and time.perf_counter() > deadline):
+            break
+        nodes += size
+
+        if last:
+            # The final column is fixed; every state closes out on the starting notes
+            parent = np.arange(len(pos))
+            new = np.broadcast_to(starts, pos.shape)
+        else:
+            parent, new = _expand(rules, mps, cf, i, pos, prev, steps, move_idxs, lower, upper, starts, max_leap)
+
+        new_cost = cost[parent] + cs.move_cost(new - pos[parent], cf_dirs[i - 1]).sum(axis=1)
+        if not len(new_cost):
+            dead_end = True
+            break
+
+        # Cheapest first (random among equals), then drop states that repeat a cheaper one's last two columns
+        tie = rng.random(len(new_cost)) if rng is not None else np.zeros(len(new_cost))
+        order = np.lexsort((tie, new_cost))
+        _, first = np.unique(np.hstack([new, pos[parent]])[order], axis=0, return_index=True)
+        keep = order[np.sort(first)][:beam_width]
+
+        prev, pos, cost = pos[parent[keep]], new[keep], new_cost[keep]
+        history.append((parent[keep], pos))
+
+    instrumentation.count('voice states checked', nodes)
+    complete = len(history) == n
+    return VoicesResult(_trace(scale, history), float(cost[0]), nodes, complete, dead_end)
+
+
+def _expand(rules, mps, cf, i, pos, prev, steps, move_idxs, lower, upper, starts, max_leap):
+    """
+    Every column that may follow each state, checked against the state's column only.  mps holds the MIDI pitch of
+    every scale position.
+    """
+    n = len(cf)
+
+    # One voice at a time: (states x voices x steps)
+    new = pos[:, :, None] + steps
+    ok = (new >= 0) & (new < len(rules.intervals))
+    new = np.where(ok, new, 0)
+    intervals = rules.intervals[new, cf[i]]
+    prev_intervals = rules.intervals[pos, cf[i - 1]][:, :, None]
+    ok &= rules.consonant[new, cf[i]] & (mps[new] > mps[cf[i]])
+    ok &= ~rules.parallel[prev_intervals, intervals]
+    # No repeat of either of the two previous notes, and the final note must stay within reach
+    ok &= (new != pos[:, :, None]) & (new != prev[:, :, None])
+    ok &= np.abs(new - starts[:, None]) <= max_leap * (n - 1 - i)
+
+    # Combinations of the moves that passed: (states x combinations)
+    voices = np.arange(pos.shape[1])
+    combos = ok[:, voices, move_idxs].all(axis=2)
+    parent, combo = np.nonzero(combos)
+    new = new[parent[:, None], voices, move_idxs[combo]]
+
+    # Between each pair of voices: no crossing, consonant and no parallel perfect intervals, nor parallel octaves
+    # between neighbours
+    prev_intervals = rules.intervals[pos[parent][:, upper], pos[parent][:, lower]]
+    intervals = rules.intervals[new[:, upper], new[:, lower]]
+    keep = (mps[new[:, upper]] > mps[new[:, lower]]).all(axis=1)
+    keep &= rules.consonant[new[:, upper], new[:, lower]].all(axis=1)
+    octaves = (prev_intervals == 1) & (intervals == 1) & (upper - lower == 1)
+    keep &= ~(rules.parallel[prev_intervals, intervals] | octaves).any(axis=1)
+    return parent[keep], new[keep]
+
+
+def _trace(scale, history):
+    """Follows the parent links back from the cheapest state in the last column reached"""
+    columns = []
+    state = 0
+    for parent, pos in reversed(history):
+        columns.append(pos[state])
+        state = parent[state]
+    return [scale.positions_to_sps(voice) for voice in np.array(columns[::-1]).T]
@@ -1,19 +1,29 @@
 from collections import namedtuple
 
-from numpy import cumsum
+import numpy as np
 
 
 # sps - Scientific PitcheS
 # mps - MIDI PitcheS
 # notes - Only the letters
 # idxs - indexes related to an expanded list of sps or mps
-# scale - sps (as fields) and MIDI pitches as values
+# scale - sps and MIDI pitches by position, hash indexed in both directions
 
 
 def note_from_sp(sp):
     return sp[:len(sp) - 1]
 
 
+# Counterpoint rules in terms of rotating intervals (see Scale.interval): 2nds and 7ths are dissonant against the
+# cantus firmus and one perfect interval may not follow another
+FORBIDDEN_INTERVALS = (2, 7)
+PERFECT_INTERVALS = (4, 5)
+
+# Counterpoint rules compiled for a scale.  intervals, consonant and perfect are indexed [cp position, cf position];
+# parallel is indexed [previous interval, interval] and is True where the move is parallel perfect motion
+RuleTable = namedtuple('RuleTable', ['intervals', 'consonant', 'perfect', 'parallel'])
+
+
 class Scale:
 
     def __init__(self, scale_type, notes, sps, mps, root_note=None):
@@ -21,26 +31,86 @@ class Scale:
         self.scale_type = scale_type
         self.name = ('' if self.root_note is None else f'{self.root_note}_') + self.scale_type
         self.notes = notes
-        ScaleDetails = namedtuple(self.name, sps)
-        self._pitches = ScaleDetails(*mps)
+
+        # Positional storage plus hashed indexes in both directions; lookups never scan
+        self._sps = tuple(sps)
+        self._mps = tuple(mps)
+        self._sp_idxs = {sp: i for i, sp in enumerate(self._sps)}
+        self._mp_idxs = {mp: i for i, mp in enumerate(self._mps)}
+        self._mp_array = np.array(self._mps, dtype=np.int64)
+        self._note_idxs = {note: i for i, note in enumerate(self.notes)}
+        self._rules = None
+        self._by_pitch = None
+
+    def __len__(self):
+        return len(self._sps)
 
     def __str__(self):
         return self.name + ': ' + str(self.notes)
 
     def __getitem__(self, item):
         """Returns the SPN note for a positional index and vice versa"""
-        sps_idxs = self._pitches._fields
-
         # Item is an SPN if a string, otherwise we expect an in positional index
-        return sps_idxs.index(item) if isinstance(item, str) else sps_idxs.__getitem__(item)
+        return self._lookup(self._sp_idxs, item) if isinstance(item, str) else self._sps[item]
+
+    def _lookup(self, idxs, item):
+        try:
+            return idxs[item]
+        except KeyError:
+            raise ValueError(f'{item} is not in {self.name}') from None
 
     def sp_to_mp(self, sp):
         """Scientific pitch to MIDI pitch"""
-        return self._pitches[self.__getitem__(sp)]
+        return self._mps[self._lookup(self._sp_idxs, sp)]
 
     def mp_to_sp(self, mp):
         """MIDI pitch to scientific pitch"""
-        return self[self._pitches.index(mp)]
+        return self._sps[self._lookup(self._mp_idxs, mp)]
+
+    def sps_to_positions(self, sps):
+        """Scientific pitches to an array of positions in the scale"""
+        return np.fromiter((self._lookup(self._sp_idxs, sp) for sp in sps), dtype=np.int64, count=len(sps))
+
+    def positions_to_sps(self, positions):
+        """Array of positions to a list of scientific pitches"""
+        return [self._sps[p] for p in np.asarray(positions).tolist()]
+
+    def positions_to_mps(self, positions):
+        """Array of positions to an array of MIDI pitches"""
+        return self._mp_array[positions]
+
+    def _pitch_order(self):
+        # Positions sorted by MIDI pitch, and those pitches; the scale isn't always in pitch order (see ScaleManager)
+        if self._by_pitch is None:
+            order = np.argsort(self._mp_array, kind='stable')
+            self._by_pitch = (order, self._mp_array[order])
+        return self._by_pitch
+
+    def mps_to_positions(self, mps):
+        """Array of MIDI pitches to an array of positions.  Raises a ValueError for pitches not in the scale"""
+        mps = np.asarray(mps, dtype=np.int64)
+        order, pitches = self._pitch_order()
+        idxs = np.minimum(np.searchsorted(pitches, mps), len(pitches) - 1)
+        missing = pitches[idxs] != mps
+        if missing.any():
+            raise ValueError(f'{mps[missing][0]} is not in {self.name}')
+        return order[idxs]
+
+    def nearest_positions(self, mps):
+        """Array of MIDI pitches to the positions of the nearest pitches in the scale; ties go to the lower pitch"""
+        mps = np.asarray(mps, dtype=np.int64)
+        order, pitches = self._pitch_order()
+        above = np.clip(np.searchsorted(pitches, mps), 1, len(pitches) - 1)
+        below = above - 1
+        idxs = np.where(mps - pitches[below] <= pitches[above] - mps, below, above)
+        return order[idxs]
+
+    def check_positions(self, positions):
+        """Returns the positions, raising a ValueError if any fall outside the scale"""
+        positions = np.asarray(positions, dtype=np.int64)
+        if len(positions) and (positions.min() < 0 or positions.max() >= len(self)):
+            raise ValueError(f'Positions {positions.min()} to {positions.max()} run outside {self.name}')
+        return positions
 
     def sp_to_note(self, sp):
         """Scientific pitch to note.  C4 -> C"""
@@ -48,14 +118,14 @@ class Scale:
 
     def note_idx(self, note):
         """Note index in the set of notes that comprises the scale.  D -> 2"""
-        return self.notes.index(note)
+        return self._lookup(self._note_idxs, note)
 
     def sps_to_steps(self, sps):
         """
         Translate a series of sps to the number of positions b/w the notes
         ['A1', 'B1', 'D2'] -> [1. 2]
         """
-        return [self.steps(sps[i], sps[j]) for i, j in enumerate(range(1, len(sps)))]
+        return np.diff(self.sps_to_positions(sps)).tolist()
 
     def steps(self, sp1, sp2):
         """Steps between two notes.  ('B1', 'D2') -> 2"""
@@ -69,6 +139,22 @@ class Scale:
         """Flattened down to len of the notes in the scale; rotating interval"""
         return self.steps(sp1, sp2) % len(self.notes) + 1
 
+    @property
+    def rules(self) -> RuleTable:
+        """Counterpoint rule matrices over every pair of positions; compiled on first use and kept with the scale"""
+        if self._rules is None:
+            positions = np.arange(len(self))
+            num_notes = len(self.notes)
+            intervals = ((positions[:, None] - positions[None, :]) % num_notes + 1).astype(np.int8)
+            perfect_interval = np.isin(np.arange(num_notes + 1), PERFECT_INTERVALS)
+            self._rules = RuleTable(intervals,
+                                    ~np.isin(intervals, FORBIDDEN_INTERVALS),
+                                    perfect_interval[intervals],
+                                    perfect_interval[:, None] & perfect_interval[None, :])
+            for table in self._rules:
+                table.flags.writeable = False
+        return self._rules
+
 
 class ScaleManager:
     _OCTAVE_RANGE = range(0, 8)
@@ -79,16 +165,41 @@ class ScaleManager:
                'Major': (0, 2, 2, 1, 2, 2, 2),
                'Minor': (0, 2, 1, 2, 2, 1, 2)}
 
+    _MIDI_OFFSET = 24
+
     def __init__(self):
         sps = self._notes_to_sps(self._ALL_NOTES)
-        midi_offset = 24
-        mps = list(range(midi_offset, len(sps) + midi_offset))
+        mps = list(range(self._MIDI_OFFSET, len(sps) + self._MIDI_OFFSET))
         self._chromatic_scale = Scale('Chromatic', self._ALL_NOTES, sps, mps)
 
+        # Every scale is a row of this table; Scales are only built on first request and then shared
+        self._table = self._build_table()
+        self._scales = {}
+
+    @property
+    def table(self):
+        """MIDI pitches by root x scale type x degree.  Degrees beyond the end of a shorter scale are -1"""
+        return self._table
+
+    def _build_table(self):
+        num_notes = len(self._ALL_NOTES)
+        octaves = np.array(self._OCTAVE_RANGE)
+        width = max(len(steps) for steps in self._SCALES.values()) * len(octaves)
+        table = np.full((num_notes, len(self._SCALES), width), -1, dtype=np.int16)
+
+        for t, steps in enumerate(self._SCALES.values()):
+            # Chromatic index of every scale note for every root.  Notes are not carried into the next
+            # octave when they wrap, which matches how the SPN names are expanded
+            idxs = (np.arange(num_notes)[:, None] + np.cumsum(steps)) % num_notes
+            mps = self._MIDI_OFFSET + octaves[None, :, None] * num_notes + idxs[:, None, :]
+            table[:, t, :mps.shape[1] * mps.shape[2]] = mps.reshape(num_notes, -1)
+
+        return table
+
     def _idxs_to_notes(self, positions, root):
         notes = self._chromatic_scale.notes
         root_idx = notes.index(root)
-        return [notes[(root_idx + np) % len(notes)] for np in positions]
+        return [notes[(root_idx + pos) % len(notes)] for pos in positions]
 
     def _notes_to_sps(self, notes):
         """
@@ -98,25 +209,83 @@ class ScaleManager:
         """
         return [f'{n}{o}' for o in self._OCTAVE_RANGE for n in notes]
 
+    def transposed(self, scale, semitones: int):
+        """The scale of the same type, with its root moved by semitones"""
+        root = self._ALL_NOTES[(self._ALL_NOTES.index(scale.root_note or 'C') + semitones) % len(self._ALL_NOTES)]
+        return self.build_scale(root, scale.scale_type)
+
+    def nearest_scale(self, mps, scale_types=('Major', 'Minor')):
+        """
+        The scale, out of every root of the given types, that holds the most of the MIDI pitches.  Ties go to a
+        scale rooted on the last note, then on the first one.
+        """
+        mps = np.asarray(mps, dtype=np.int64)
+        num_notes = len(self._ALL_NOTES)
+        types = [list(self._SCALES).index(t) for t in scale_types]
+
+        # Which pitch classes each (root, type) holds, then how many of the notes that covers
+        rows = self._table[:, types]
+        members = np.zeros((num_notes, len(types), num_notes), dtype=bool)
+        r, t, _ = np.nonzero(rows >= 0)
+        members[r, t, rows[rows >= 0] % num_notes] = True
+        counts = members.astype(np.int64) @ np.bincount(mps % num_notes, minlength=num_notes)
+
+        roots = np.arange(num_notes)[:, None]
+        score = 4 * counts + 2 * (roots == mps[-1] % num_notes) + (roots == mps[0] % num_notes)
+        root, t = np.unravel_index(np.argmax(score), score.shape)
+        return self.build_scale(self._ALL_NOTES[root], scale_types[t])
+
     def build_scale(self, root='C', scale_type='Major'):
+        """
+        Returns the shared Scale for the root and scale type, building it from the table on first use.  With no
+        root (None or ''), the rootless chromatic scale.
+        """
+        if not root:
+            if scale_type != self._chromatic_scale.scale_type:
+                raise ValueError(f'Only the chromatic scale has no root; got {scale_type}')
+            return self._chromatic_scale
+        scale = self._scales.get((root, scale_type))
+        if scale is None:
+            scale = self._scales[(root, scale_type)] = self._scale_from_table(root, scale_type)
+        return scale
+
+    def _scale_from_table(self, root, scale_type):
         steps = self._SCALES[scale_type]
-        idxs = list(cumsum(steps))
-        notes = self._idxs_to_notes(idxs, root)
+        notes = self._idxs_to_notes(np.cumsum(steps).tolist(), root)
 
         sps = self._notes_to_sps(notes)
-        mps = [self._chromatic_scale.sp_to_mp(sp) for sp in sps]
-        return Scale(scale_type, notes, sps, mps, root)
+        row = self._table[self._ALL_NOTES.index(root), list(self._SCALES).index(scale_type)]
+        return Scale(scale_type, notes, sps, row[:len(sps)].tolist(), root)
 
 
 class Tune:
 
     def __init__(self, scale, tune_sps):
         self.scale = scale
-        self.sps = tune_sps
-        self.mps = [self.scale.sp_to_mp(sp) for sp in self.sps]
+        self._sps = list(tune_sps)
+        self.positions = self.scale.sps_to_positions(self._sps)
+        self.mps = self.scale.positions_to_mps(self.positions)
+        self._extremes = None
+
+    @classmethod
+    def from_positions(cls, scale, positions):
+        """Builds a tune straight from scale positions, skipping the SPN lookups"""
+        tune = cls.__new__(cls)
+        tune.scale = scale
+        tune._sps = None
+        tune.positions = np.asarray(positions, dtype=np.int64)
+        tune.mps = scale.positions_to_mps(tune.positions)
+        tune._extremes = None
+        return tune
+
+    @property
+    def sps(self):
+        if self._sps is None:
+            self._sps = self.scale.positions_to_sps(self.positions)
+        return self._sps
 
     def __len__(self):
-        return len(self.sps)
+        return len(self.positions)
 
     def __getitem__(self, item):
         return self.sps[item]
@@ -124,11 +293,29 @@ class Tune:
     def __str__(self):
         return str(self.sps)
 
+    def steps(self):
+        """Positions moved between consecutive notes"""
+        return np.diff(self.positions)
+
+    def intervals(self):
+        """Rotating interval between consecutive notes; same as Scale.interval"""
+        return self.steps() % len(self.scale.notes) + 1
+
+    def directions(self):
+        """-1, 0 or 1 for each move between consecutive notes"""
+        return np.sign(self.steps())
+
+    def _extreme_idxs(self):
+        # Index of the lowest and highest MIDI pitch, worked out once per tune
+        if self._extremes is None:
+            self._extremes = (int(self.mps.argmin()), int(self.mps.argmax()))
+        return self._extremes
+
     def peak_sp(self):
-        return self.scale[min(self.mps)]
+        return self.sps[self._extreme_idxs()[0]]
 
     def trough_sp(self):
-        return self.scale[max(self.mps)]
+        return self.sps[self._extreme_idxs()[1]]
 
     def starting_sp(self):
         return self.sps[0]
@@ -136,6 +323,38 @@ class Tune:
     def ending_sp(self):
         return self.sps[-1]
 
+    # Transforms.  All work on the positions and return a new Tune; TuneCollection has the batched versions
+
+    def transpose(self, steps: int):
+        """Moves every note the given number of positions (diatonic steps) up or down the scale"""
+        return Tune.from_positions(self.scale, self.scale.check_positions(self.positions + steps))
+
+    def transpose_chromatic(self, semitones: int, scale_manager):
+        """Moves every note by semitones, into the scale of the same type rooted that many semitones away"""
+        scale = scale_manager.transposed(self.scale, semitones)
+        return Tune.from_positions(scale, scale.mps_to_positions(self.mps + semitones))
+
+    def remap(self, scale, nearest: bool = False):
+        """
+        Moves the tune into another scale (another root or mode) degree for degree: the nth note of the scale in
+        an octave stays the nth note.  With nearest, each note goes to the closest pitch of the other scale
+        instead, which also works between scales with different numbers of notes.
+        """
+        if nearest:
+            return Tune.from_positions(scale, scale.nearest_positions(self.mps))
+        if len(scale.notes) != len(self.scale.notes):
+            raise ValueError(f'{self.scale.name} and {scale.name} have different numbers of notes')
+        return Tune.from_positions(scale, scale.check_positions(self.positions))
+
+    def invert(self, axis=None):
+        """Mirrors the tune about the axis (an sp or position); the starting note by default"""
+        axis = self.positions[0] if axis is None else self.scale[axis] if isinstance(axis, str) else axis
+        return Tune.from_positions(self.scale, self.scale.check_positions(2 * axis - self.positions))
+
+    def retrograde(self):
+        """The tune backwards"""
+        return Tune.from_positions(self.scale, self.positions[::-1].copy())
+
 
 # determine direction of second to last step
 # setup contrary motion on second to last step
@@ -0,0 +1,275 @@
+import os
+import struct
+import wave
+from collections import namedtuple
+
+import numpy as np
+
+import drum_engine
+import instrumentation
+
+# Offline audio rendering of drum tracks, straight from the engine's events with no MIDI round trip.  Every pitch of
+# every drum group's midi_pitch_set is played by a WAV sample, which is memory mapped rather than read, so a sample
+# kit costs next to nothing to open.  The track is mixed a fixed number of frames at a time into a stereo float
+# buffer, the notes of each sample added together in a few array operations (see Mixer), and every finished chunk
+# goes straight out to a 16 bit WAV file: memory stays flat however long the track.
+#
+#   samples = load_samples(config.group_table, 'kit/')     # kit/36.wav, kit/38.wav, ...
+#   render_audio(config.group_table, config.measures, pattern, 4, 4, GenerationContext(1), samples, 'drums.wav')
+
+# A sample's frames (frames x channels, as stored in the file), the factor taking them to [-1, 1] and frame rate
+Sample = namedtuple('Sample', ['frames', 'scale', 'rate'])
+
+AudioStats = namedtuple('AudioStats', ['frames', 'rate', 'peak', 'clipped'])
+
+CHUNK_FRAMES = 1 << 16
+
+# (format tag, bits per sample) -> numpy dtype and scale to [-1, 1]
+_WAV_FORMATS = {(1, 16): ('<i2', 1 / 32768),
+                (1, 32): ('<i4', 1 / 2147483648),
+                (3, 32): ('<f4', 1.0),
+                (3, 64): ('<f8', 1.0)}
+_EXTENSIBLE = 0xFFFE
+
+
+def read_wav(path: str) -> Sample:
+    """Memory maps the sample data of a PCM (16 or 32 bit) or float WAV file"""
+    with open(path, 'rb') as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b'RIFF' or header[8:] != b'WAVE':
+            raise ValueError(f'{path} is not a WAV file')
+        fmt = None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                raise ValueError(f'{path} has no data chunk')
+            chunk_id, size = chunk[:4], int.from_bytes(chunk[4:], 'little')
+            if chunk_id == b'data':
+                offset = f.tell()
+                break
+            if chunk_id == b'fmt ':
+                fmt = f.read(size)
+                f.seek(size & 1, os.SEEK_CUR)
+            else:
+                # Chunks are padded to an even length
+                f.seek(size + (size & 1), os.SEEK_CUR)
+        file_size = os.fstat(f.fileno()).st_size
+
+    if fmt is None or len(fmt) < 16:
+        raise ValueError(f'{path} has no format chunk ahead of its data')
+    tag, channels, rate, _, block_align, bits = struct.unpack_from('<HHIIHH', fmt)
+    if tag == _EXTENSIBLE and len(fmt) >= 26:
+        # The real format is the start of the sub format GUID
+        tag = struct.unpack_from('<H', fmt, 24)[0]
+    if (tag, bits) not in _WAV_FORMATS or channels not in (1, 2):
+        raise ValueError(f'{path}: only mono or stereo 16/32 bit PCM and float WAVs are supported '
+                         f'(format {tag}, {bits} bits, {channels} channels)')
+
+    dtype, scale = _WAV_FORMATS[(tag, bits)]
+    # Streaming writers leave the data size at its maximum; the file size is the real limit
+    num_frames = min(size, file_size - offset) // block_align
+    if num_frames == 0:
+        return Sample(np.zeros((0, channels), dtype=dtype), scale, rate)
+    return Sample(np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(num_frames, channels)), scale, rate)
+
+
+def load_samples(drum_groups, samples) -> dict:
+    """
+    The Sample for every pitch the drum groups can play.  Each file is mapped once, however many pitches share it.
+
+    :param drum_groups: Sequence of DrumGroups or their drum_engine.GroupTable
+    :param samples: Mapping of MIDI pitch to WAV path, or a directory holding one <pitch>.wav per pitch
+    """
+    # The table pads each group's pitches with its last pitch, so its unique pitches are exactly the groups'
+    pitches = np.unique(drum_engine.group_table(drum_groups).pitches).tolist()
+    if isinstance(samples, (str, os.PathLike)):
+        samples = {p: os.path.join(samples, f'{p}.wav') for p in pitches}
+    missing = [p for p in pitches if p not in samples]
+    if missing:
+        raise ValueError(f'No sample for pitches {missing}')
+
+    loaded = {}
+    by_path = {}
+    for p in pitches:
+        path = os.fspath(samples[p])
+        if path not in by_path:
+            by_path[path] = read_wav(path)
+        loaded[p] = by_path[path]
+
+    rates = {s.rate for s in loaded.values()}
+    if len(rates) > 1:
+        raise ValueError(f'Samples must share one frame rate; found {sorted(rates)}')
+    return loaded
+
+
+def mix_events(events: np.ndarray, samples: dict, path: str, tempo: float = 120, pans=None, gain: float = 1.0,
+               chunk_frames: int = CHUNK_FRAMES) -> AudioStats:
+    """
+    Mixes engine events into a stereo 16 bit WAV file.  Every note plays its pitch's sample to the end, at a level
+    of velocity / 127.
+
+    :param events: drum_engine.EVENT_DTYPE events; times in quarter notes
+    :param samples: Mapping of MIDI pitch to Sample, see load_samples
+    :param pans: Optional position of each drum group from -1 (left) to 1 (right)
+    :param gain: Master level applied to the whole mix
+    :param chunk_frames: Frames mixed and written at a time
+    :return: Frames written, their rate, the peak level and the number of sample values clipped
+    """
+    with wave.open(path, 'wb') as out:
+        mixer = Mixer(out, samples, tempo, pans, gain, chunk_frames)
+        mixer.add(events)
+        return mixer.close()
+
+
+# A note waiting to be mixed: start frame, kit entry and left/right level
+_NOTE_DTYPE = np.dtype([('start', np.int64), ('sample', np.int64), ('level', np.float64, (2,))])
+
+
+class Mixer:
+    """
+    Overlap-add mixing into an open wave writer, fed events as they are generated.  Each note is added to the
+    buffer whole, in the chunk it starts in; whatever of it runs past the chunk is carried into the next one.  So
+    the buffer is one chunk plus the longest sample, and only notes waiting to start are held: memory stays flat
+    however long the track.
+
+    Within a chunk, the notes of each sample are dealt round robin into lanes in which no two of them overlap, and
+    every lane is added in a single operation through a view of the buffer with one row per start frame.  The work
+    per chunk is a handful of array operations per sample and lane, however many notes there are.
+    """
+
+    def __init__(self, out, samples: dict, tempo: float = 120, pans=None, gain: float = 1.0,
+                 chunk_frames: int = CHUNK_FRAMES):
+        if chunk_frames < 1:
+            raise ValueError(f'chunk_frames must be at least 1, got {chunk_frames}')
+        self.out = out
+        self.rate = next(iter(samples.values())).rate if samples else 44100
+        self.frames_quarter = 60 / tempo * self.rate
+        self.pans = None if pans is None else np.asarray(pans, dtype=np.float64)
+        self.gain = gain
+        self.chunk_frames = chunk_frames
+
+        # One entry per distinct sample, so every note indexes straight into the kit
+        kit = list({id(s): s for s in samples.values()}.values())
+        kit_idx = {id(s): i for i, s in enumerate(kit)}
+        self.lookup = np.full(128, -1, dtype=np.int64)
+        for p, s in samples.items():
+            self.lookup[p] = kit_idx[id(s)]
+        # Channels first, so a note's frames are (channels x frames) to scale by its levels
+        self.planar = [s.frames.T for s in kit]
+        self.scales = np.array([s.scale for s in kit], dtype=np.float64)
+        self.lengths = np.array([len(s.frames) for s in kit], dtype=np.int64)
+        longest = int(self.lengths.max()) if len(kit) else 0
+
+        # Accumulating in float64 keeps the sum independent of the order notes are added in, and so of chunk_frames
+        self.buffer = np.zeros((2, chunk_frames + longest), dtype=np.float64)
+        self.scratch = np.empty((2, chunk_frames), dtype=np.float64)
+        self.pcm = np.empty((chunk_frames, 2), dtype='<i2')
+        self.queue = np.empty(0, dtype=_NOTE_DTYPE)
+        self.written = 0
+        self.end = 0
+        self.peak, self.clipped = 0.0, 0
+
+        out.setnchannels(2)
+        out.setsampwidth(2)
+        out.setframerate(self.rate)
+
+    def add(self, events: np.ndarray):
+        """Queues engine events.  None of them may start in a frame already written out"""
+        sample_idx = self.lookup[events['pitch']]
+        if (sample_idx < 0).any():
+            raise ValueError(f'No sample for pitches {sorted(set(events["pitch"][sample_idx < 0].tolist()))}')
+        notes = np.empty(len(events), dtype=_NOTE_DTYPE)
+        notes['start'] = np.rint(events['time'] * self.frames_quarter)
+        notes['sample'] = sample_idx
+        if len(notes) and notes['start'].min() < self.written:
+            raise ValueError(f'Note at frame {notes["start"].min()} arrived after frame {self.written} was written')
+
+        # Left and right levels of every note
+        level = events['velocity'] / 127 * self.gain * self.scales[sample_idx]
+        pan = np.zeros(len(events)) if self.pans is None else self.pans[events['group']]
+        notes['level'] = np.stack([level * np.minimum(1, 1 - pan), level * np.minimum(1, 1 + pan)], axis=1)
+
+        self.end = max(self.end, int((notes['start'] + self.lengths[sample_idx]).max(initial=0)))
+        queue = np.concatenate([self.queue, notes])
+        self.queue = queue[np.argsort(queue['start'], kind='stable')]
+
+    def flush(self, until: int):
+        """Writes out every whole chunk that ends by frame until"""
+        while self.written + self.chunk_frames <= min(until, self.end):
+            self._write(self.chunk_frames)
+
+    def close(self) -> AudioStats:
+        """Writes out everything still sounding; returns frames written, their rate, the peak level and clips"""
+        while self.written < self.end:
+            self._write(min(self.chunk_frames, self.end - self.written))
+        instrumentation.count('audio frames', self.written)
+        return AudioStats(self.written, self.rate, self.peak, self.clipped)
+
+    def _write(self, n):
+        lo = self.written
+        with instrumentation.stage('mix'):
+            first = np.searchsorted(self.queue['start'], lo + n)
+            self._mix(self.queue[:first], lo)
+            self.queue = self.queue[first:]
+
+        with instrumentation.stage('write'):
+            scratch = np.abs(self.buffer[:, :n], out=self.scratch[:, :n])
+            self.peak = max(self.peak, float(scratch.max()))
+            self.clipped += int(np.count_nonzero(scratch > 1))
+            np.multiply(self.buffer[:, :n], 32767, out=scratch)
+            np.clip(np.rint(scratch, out=scratch), -32768, 32767, out=scratch)
+            frames = self.pcm[:n]
+            frames[:] = scratch.T
+            self.out.writeframes(frames.tobytes())
+
+        # Carry the tails of the notes still sounding to the front of the buffer
+        self.buffer[:, :-n] = self.buffer[:, n:]
+        self.buffer[:, -n:] = 0
+        self.written += n
+
+    def _mix(self, notes, lo):
+        """Adds the notes, all starting in the chunk at frame lo, to the buffer"""
+        for k in np.unique(notes['sample']).tolist():
+            group = notes[notes['sample'] == k]
+            frames, length = self.planar[k], self.lengths[k]
+            if length == 0:
+                continue
+            # Rows of this view are the sample's length of buffer starting at each frame; both channels at once
+            step, row = self.buffer.strides[1], self.buffer.strides[0]
+            view = np.lib.stride_tricks.as_strided(self.buffer, (self.buffer.shape[1] - length + 1, 2, length),
+                                                   (step, row, step))
+            # Sorted by start and all of one length, note i has always ended by the time note i + lanes starts
+            starts = group['start'] - lo
+            lanes = int((np.arange(len(starts)) - np.searchsorted(starts, starts - length, side='right')).max()) + 1
+            for lane in range(lanes):
+                view[starts[lane::lanes]] += group['level'][lane::lanes, :, None] * frames
+
+
+def render_audio(drum_groups, measures, pattern, pulses_beat: int, beats_measure: int, context, samples, path: str,
+                 tempo: float = 120, groove=None, pans=None, gain: float = 1.0,
+                 chunk_frames: int = CHUNK_FRAMES) -> AudioStats:
+    """
+    Renders the drum track to a WAV file.  The notes are the ones drum_engine.render_track would write to a MIDI
+    file for the same context and groove.  They are generated, grooved and mixed a bar at a time, each bar written
+    out once the next one is queued, so memory does not grow with the length of the track.  The groove may move a
+    note less than a bar earlier than its place in the pattern.
+
+    :param drum_groups: Sequence of DrumGroups or their drum_engine.GroupTable (see drum_config.DrumConfig)
+    :param samples: Mapping of MIDI pitch to Sample (see load_samples), or what load_samples takes
+    """
+    table = drum_engine.group_table(drum_groups)
+    if not (isinstance(samples, dict) and all(isinstance(s, Sample) for s in samples.values())):
+        samples = load_samples(table, samples)
+
+    with instrumentation.stage('measure generation'):
+        used = {i: measures[i] for i in sorted(set(pattern))}
+        measure_events = drum_engine.generate_measures(table, used, pulses_beat, context)
+    bars = drum_engine.bar_events(table, measure_events, pattern, beats_measure, groove, context.groove_rng())
+
+    with wave.open(path, 'wb') as out:
+        mixer = Mixer(out, samples, tempo, pans, gain, chunk_frames)
+        for b, events in enumerate(bars):
+            mixer.add(events)
+            # Notes still to come land in this bar or later
+            mixer.flush(int(b * beats_measure * mixer.frames_quarter))
+        return mixer.close()
@@ -0,0 +1,279 @@
+import ast
+import csv
+import json
+import os
+import tempfile
+from collections import namedtuple
+
+import numpy as np
+
+import drum_engine
+import instrumentation
+
+DrumGroup = namedtuple('DrumGroup',
+                       ['name', 'track', 'midi_pitch_set', 'prob_pitch', 'nudge'],
+                       defaults=(0,))
+
+DrumChance = namedtuple('DrumChance',
+                        ['prob_hit', 'min_vol', 'max_vol', 'duration'],
+                        defaults=(0, 25, 100, 1))
+
+MIDI_MAP_SHEET = 'midi_map'
+HITS_SHEET = 'prob_hits'
+
+# Everything needed to generate from a workbook.  measures maps the suffix of each prob_hits_N sheet to a
+# (pulse times, (pulses x groups x fields) hits array) pair.  group_table is the drum groups compiled for sampling
+# (see drum_engine.GroupTable), built once when the config is loaded; pass it to the engine in place of drum_groups
+DrumConfig = namedtuple('DrumConfig', ['drum_tracks', 'drum_groups', 'measures', 'group_table'], defaults=(None,))
+
+# Bump when the layout of the cache file changes
+_CACHE_VERSION = 1
+
+# Native, pandas free formats.  JSON and TOML hold one document:
+#
+#   drum_groups: [{name, track, midi_pitch_set: [...], prob_pitch: [...], nudge}, ...]
+#   measures:    {"<id>": {pulse_times: [...], prob_hit: [[...]], min_vol: [[...]], max_vol: [[...]], duration: [[...]]}}
+#
+# where each DrumChance field is a (pulses x groups) matrix.  CSV is a directory holding midi_map.csv (pitch sets
+# and probabilities space separated) and one prob_hits_<id>.csv per measure laid out like the workbook sheets: the
+# pulse time, then the DrumChance fields of each drum group in turn.
+_WORKBOOK_EXTENSIONS = ('.xlsx', '.xlsm', '.xls')
+
+
+def load_workbook(path: str, use_cache: bool = True, cache_path: str = None) -> DrumConfig:
+    """
+    Loads the drum groups and every hits sheet of a workbook.  The workbook is opened once and the result is
+    compiled into an .npz cache next to it; while the workbook is unchanged (same path, mtime and size), later
+    loads come straight from the cache without touching pandas or openpyxl.
+    """
+    cache_path = cache_path or path + '.npz'
+    key = _cache_key(path)
+
+    if use_cache and os.path.exists(cache_path):
+        try:
+            with np.load(cache_path, allow_pickle=False) as cached:
+                if cached['key'].tolist() == key:
+                    config = _from_arrays(cached)
+                    instrumentation.count('workbook cache hits')
+                    return config
+        except Exception:
+            # A truncated or damaged cache is no worse than a stale one: read the workbook and write it afresh
+            instrumentation.count('workbook cache errors')
+
+    config = read_workbook(path)
+    if use_cache:
+        _write_cache(cache_path, key, config)
+    return config
+
+
+def _write_cache(cache_path, key, config):
+    """Writes the cache to a temporary file beside it and moves it into place, so readers never see half a file"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(cache_path)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, key=np.array(key), **_to_arrays(config))
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def read_workbook(path: str) -> DrumConfig:
+    """Parses the midi map and all prob_hits_N sheets out of a single open of the workbook"""
+    import pandas as pd
+
+    sheets = pd.read_excel(path, sheet_name=None, index_col=0)
+
+    drum_groups = [DrumGroup(row.name,
+                             int(row.track),
+                             tuple(ast.literal_eval(row.midi_pitch_set)),
+                             tuple(ast.literal_eval(row.prob_pitch)),
+                             int(row.nudge))
+                   for row in sheets[MIDI_MAP_SHEET].itertuples()]
+
+    measures = {}
+    for sheet_name, drum_hits in sheets.items():
+        prefix, _, suffix = sheet_name.rpartition('_')
+        if prefix == HITS_SHEET and suffix.isdigit():
+            measures[int(suffix)] = (drum_hits.index.to_numpy(dtype=np.float64),
+                                     drum_engine.hit_array(drum_hits, len(drum_groups)))
+
+    return _validate(DrumConfig({dg.track for dg in drum_groups}, drum_groups, measures))
+
+
+def _cache_key(path):
+    stat = os.stat(path)
+    return [str(_CACHE_VERSION), os.path.abspath(path), str(stat.st_mtime_ns), str(stat.st_size)]
+
+
+def _to_arrays(config):
+    groups = config.drum_groups
+    arrays = {'group_names': np.array([dg.name for dg in groups]),
+              'group_tracks': np.array([dg.track for dg in groups]),
+              'group_nudges': np.array([dg.nudge for dg in groups]),
+              'group_sizes': np.array([len(dg.midi_pitch_set) for dg in groups]),
+              'group_pitches': np.array([p for dg in groups for p in dg.midi_pitch_set]),
+              'group_probs': np.array([p for dg in groups for p in dg.prob_pitch], dtype=np.float64),
+              'measure_ids': np.array(sorted(config.measures), dtype=np.int64)}
+    for i, (pulse_times, hits) in config.measures.items():
+        arrays[f'pulses_{i}'] = pulse_times
+        arrays[f'hits_{i}'] = hits
+    return arrays
+
+
+def _from_arrays(arrays):
+    bounds = np.cumsum(arrays['group_sizes']).tolist()
+    pitches = np.split(arrays['group_pitches'], bounds[:-1])
+    probs = np.split(arrays['group_probs'], bounds[:-1])
+
+    drum_groups = [DrumGroup(name, track, tuple(pitch_set.tolist()), tuple(prob_pitch.tolist()), nudge)
+                   for name, track, pitch_set, prob_pitch, nudge in zip(arrays['group_names'].tolist(),
+                                                                        arrays['group_tracks'].tolist(),
+                                                                        pitches, probs,
+                                                                        arrays['group_nudges'].tolist())]
+    measures = {i: (arrays[f'pulses_{i}'], arrays[f'hits_{i}']) for i in arrays['measure_ids'].tolist()}
+    return _validate(DrumConfig({dg.track for dg in drum_groups}, drum_groups, measures))
+
+
+def load_config(path: str) -> DrumConfig:
+    """Loads a drum config from a workbook, a .json or .toml file or a directory of CSVs"""
+    if os.path.isdir(path):
+        return load_csv(path)
+
+    ext = os.path.splitext(path)[1].lower()
+    if ext in _WORKBOOK_EXTENSIONS:
+        return load_workbook(path)
+    if ext == '.json':
+        return load_json(path)
+    if ext == '.toml':
+        return load_toml(path)
+    raise ValueError(f'Unsupported drum config format: {path}')
+
+
+def save_config(config: DrumConfig, path: str):
+    """Writes a drum config as .json, .toml or, for an existing directory or a path with no extension, CSVs"""
+    ext = os.path.splitext(path)[1].lower()
+    if os.path.isdir(path) or not ext:
+        save_csv(config, path)
+    elif ext == '.json':
+        save_json(config, path)
+    elif ext == '.toml':
+        save_toml(config, path)
+    else:
+        raise ValueError(f'Unsupported drum config format: {path}')
+
+
+def convert(src: str, dst: str) -> DrumConfig:
+    """Converts between any of the supported formats, e.g. an existing workbook to JSON"""
+    config = load_config(src)
+    save_config(config, dst)
+    return config
+
+
+def load_json(path: str) -> DrumConfig:
+    with open(path) as f:
+        return from_document(json.load(f))
+
+
+def save_json(config: DrumConfig, path: str):
+    with open(path, 'w') as f:
+        json.dump(to_document(config), f)
+
+
+def load_toml(path: str) -> DrumConfig:
+    try:
+        import tomllib
+    except ModuleNotFoundError:  # Python < 3.11
+        import tomli as tomllib
+
+    with open(path, 'rb') as f:
+        return from_document(tomllib.load(f))
+
+
+def save_toml(config: DrumConfig, path: str):
+    # The document is only lists, numbers and strings, so JSON literals double as TOML values
+    doc = to_document(config)
+    lines = []
+    for dg in doc['drum_groups']:
+        lines.append('[[drum_groups]]')
+        lines.extend(f'{k} = {json.dumps(v)}' for k, v in dg.items())
+        lines.append('')
+    for i, measure in doc['measures'].items():
+        lines.append(f'[measures.{json.dumps(i)}]')
+        lines.extend(f'{k} = {json.dumps(v)}' for k, v in measure.items())
+        lines.append('')
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines))
+
+
+def load_csv(path: str) -> DrumConfig:
+    with open(os.path.join(path, MIDI_MAP_SHEET + '.csv'), newline='') as f:
+        drum_groups = [DrumGroup(row['name'],
+                                 int(row['track']),
+                                 tuple(int(p) for p in row['midi_pitch_set'].split()),
+                                 tuple(float(p) for p in row['prob_pitch'].split()),
+                                 int(row['nudge']))
+                       for row in csv.DictReader(f)]
+
+    measures = {}
+    for name in os.listdir(path):
+        prefix, _, suffix = os.path.splitext(name)[0].rpartition('_')
+        if prefix == HITS_SHEET and suffix.isdigit() and name.endswith('.csv'):
+            values = np.loadtxt(os.path.join(path, name), delimiter=',', skiprows=1, ndmin=2)
+            measures[int(suffix)] = (values[:, 0].copy(), drum_engine.hit_array(values[:, 1:], len(drum_groups)))
+
+    return _validate(DrumConfig({dg.track for dg in drum_groups}, drum_groups, measures))
+
+
+def save_csv(config: DrumConfig, path: str):
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, MIDI_MAP_SHEET + '.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(DrumGroup._fields)
+        for dg in config.drum_groups:
+            writer.writerow([dg.name, dg.track, ' '.join(map(str, dg.midi_pitch_set)),
+                             ' '.join(map(str, dg.prob_pitch)), dg.nudge])
+
+    header = ['time'] + [f'{dg.name}_{field}' for dg in config.drum_groups for field in DrumChance._fields]
+    for i, (pulse_times, hits) in config.measures.items():
+        values = np.column_stack([pulse_times, hits.reshape(len(hits), -1)])
+        np.savetxt(os.path.join(path, f'{HITS_SHEET}_{i}.csv'), values, delimiter=',', header=','.join(header),
+                   comments='', fmt='%.10g')
+
+
+def to_document(config: DrumConfig) -> dict:
+    """Plain dict (JSON/TOML) form of a config"""
+    return {'drum_groups': [dg._asdict() | {'midi_pitch_set': list(dg.midi_pitch_set),
+                                            'prob_pitch': list(dg.prob_pitch)}
+                            for dg in config.drum_groups],
+            'measures': {str(i): {'pulse_times': pulse_times.tolist()} |
+                                 {field: hits[..., f].tolist() for f, field in enumerate(DrumChance._fields)}
+                         for i, (pulse_times, hits) in sorted(config.measures.items())}}
+
+
+def from_document(doc: dict) -> DrumConfig:
+    drum_groups = [DrumGroup(dg['name'], int(dg['track']), tuple(int(p) for p in dg['midi_pitch_set']),
+                             tuple(float(p) for p in dg['prob_pitch']), int(dg.get('nudge', 0)))
+                   for dg in doc['drum_groups']]
+
+    measures = {}
+    for i, measure in doc.get('measures', {}).items():
+        pulse_times = np.asarray(measure['pulse_times'], dtype=np.float64)
+        shape = (len(pulse_times), len(drum_groups))
+        hits = np.stack([np.broadcast_to(np.asarray(measure.get(field, default), dtype=np.float64), shape)
+                         for field, default in zip(DrumChance._fields, DrumChance._field_defaults.values())],
+                        axis=-1)
+        measures[int(i)] = (pulse_times, hits)
+
+    return _validate(DrumConfig({dg.track for dg in drum_groups}, drum_groups, measures))
+
+
+def _validate(config: DrumConfig) -> DrumConfig:
+    """Checks the config and compiles its drum groups into group_table"""
+    for i, (pulse_times, hits) in config.measures.items():
+        if hits.shape != (len(pulse_times), len(config.drum_groups), len(DrumChance._fields)):
+            raise ValueError(f'Measure {i} hits have shape {hits.shape}; expected '
+                             f'{(len(pulse_times), len(config.drum_groups), len(DrumChance._fields))}')
+    # Bad pitch sets and probability vectors fail here, when the config is loaded, rather than part way through a
+    # render; the tables are then reused by every render of the config
+    return config._replace(group_table=drum_engine.compile_drum_groups(config.drum_groups))
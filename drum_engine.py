@@ -0,0 +1,376 @@
+import hashlib
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from typing import Sequence
+
+import numpy as np
+
+import instrumentation
+import smf
+from groove import apply_groove
+from note_store import NoteStore
+
+# Field positions within the trailing axis of a hit array; mirrors the order of drum_config.DrumChance
+PROB_HIT, MIN_VOL, MAX_VOL, DURATION = range(4)
+NUM_CHANCE_FIELDS = 4
+
+# One row per drum hit.  Times and durations are in quarter notes, same as MIDIFile.addNote; group is the position of
+# the drum group the hit was drawn for
+EVENT_DTYPE = np.dtype([('track', np.int16),
+                        ('time', np.float64),
+                        ('pitch', np.uint8),
+                        ('velocity', np.uint8),
+                        ('duration', np.float64),
+                        ('group', np.int16)])
+
+# Pitch sets are sampled through Walker alias tables (see PitchSampler), padded to the widest set with the last
+# pitch.  sizes holds the real size of each group's set
+GroupTable = namedtuple('GroupTable', ['tracks', 'nudges', 'pitches', 'sizes', 'keep_probs', 'aliases'])
+
+# Slack allowed in the sum of a pitch probability vector before it is rejected
+_PROB_TOLERANCE = 1e-6
+
+
+def compile_drum_groups(drum_groups: Sequence) -> GroupTable:
+    """
+    Flattens the drum groups into padded arrays so that every group can be sampled at once.  Raises a ValueError
+    for a group whose pitch probabilities don't make a distribution.
+    """
+    width = max((len(dg.prob_pitch) for dg in drum_groups), default=1)
+    pitches = np.zeros((len(drum_groups), width), dtype=np.uint8)
+    keep_probs = np.ones((len(drum_groups), width), dtype=np.float64)
+    aliases = np.zeros((len(drum_groups), width), dtype=np.int64)
+
+    for i, dg in enumerate(drum_groups):
+        n = len(dg.prob_pitch)
+        if len(dg.midi_pitch_set) != n:
+            raise ValueError(f'Drum group {dg.name} has {len(dg.midi_pitch_set)} pitches but {n} probabilities')
+        keep_probs[i, :n], aliases[i, :n] = alias_table(dg.prob_pitch, dg.name)
+        pitches[i, :n] = dg.midi_pitch_set
+        pitches[i, n:] = dg.midi_pitch_set[-1]
+
+    tracks = np.array([dg.track - 1 for dg in drum_groups], dtype=np.int16)
+    nudges = np.array([dg.nudge for dg in drum_groups], dtype=np.int64)
+    sizes = np.array([len(dg.prob_pitch) for dg in drum_groups], dtype=np.int64)
+    return GroupTable(tracks, nudges, pitches, sizes, keep_probs, aliases)
+
+
+def group_table(drum_groups) -> GroupTable:
+    """The GroupTable for the drum groups: a table passes straight through, anything else is compiled"""
+    return drum_groups if isinstance(drum_groups, GroupTable) else compile_drum_groups(drum_groups)
+
+
+def num_tracks(table: GroupTable) -> int:
+    """Tracks in a file holding every group's notes: up to the highest group track, plus the tempo track"""
+    return int(table.tracks.max()) + 2 if len(table.tracks) else 1
+
+
+def alias_table(probabilities, name=None):
+    """
+    Walker/Vose alias table for a probability vector: column k is kept with probability keep_probs[k] and
+    otherwise gives way to aliases[k].  Raises a ValueError unless the probabilities are finite, non-negative and
+    add up to 1.
+    """
+    probs = np.asarray(probabilities, dtype=np.float64)
+    label = 'Pitch probabilities' if name is None else f'Pitch probabilities of {name}'
+    if probs.ndim != 1 or len(probs) == 0:
+        raise ValueError(f'{label} must be a non-empty sequence')
+    if not np.isfinite(probs).all() or (probs < 0).any():
+        raise ValueError(f'{label} must be finite and non-negative: {probs.tolist()}')
+    if abs(probs.sum() - 1) > _PROB_TOLERANCE:
+        raise ValueError(f'{label} add up to {probs.sum()}, not 1')
+
+    n = len(probs)
+    scaled = probs * n / probs.sum()
+    keep_probs = np.ones(n)
+    aliases = np.arange(n)
+    small = [k for k in range(n) if scaled[k] < 1]
+    large = [k for k in range(n) if scaled[k] >= 1]
+    while small and large:
+        s, g = small.pop(), large.pop()
+        keep_probs[s], aliases[s] = scaled[s], g
+        scaled[g] -= 1 - scaled[s]
+        (small if scaled[g] < 1 else large).append(g)
+    # Whatever is left over is 1 up to rounding
+    return keep_probs, aliases
+
+
+def _alias_sample(table: GroupTable, group_idx, u):
+    """
+    Pitch positions drawn with one uniform each: the whole part of u * size picks a column of the group's alias
+    table and the fraction decides between the column and its alias.
+    """
+    sizes = table.sizes[group_idx]
+    scaled = u * sizes
+    column = np.minimum(scaled.astype(np.int64), sizes - 1)
+    keep = scaled - column < table.keep_probs[group_idx, column]
+    return np.where(keep, column, table.aliases[group_idx, column])
+
+
+class PitchSampler:
+    """
+    A pitch set compiled for sampling: each draw costs the same however many pitches there are, and any number
+    can be drawn in one call.  The probabilities are checked once, when the sampler is built.
+    """
+
+    __slots__ = ('pitches', 'keep_probs', 'aliases')
+
+    def __init__(self, pitches, probabilities, name=None):
+        if len(pitches) != len(probabilities):
+            raise ValueError(f'{len(pitches)} pitches but {len(probabilities)} probabilities')
+        self.pitches = np.asarray(pitches)
+        self.keep_probs, self.aliases = alias_table(probabilities, name)
+
+    def sample(self, u):
+        """Pitches for uniforms in [0, 1): one for a scalar, an array for an array"""
+        u = np.asarray(u, dtype=np.float64)
+        scaled = u * len(self.pitches)
+        column = np.minimum(scaled.astype(np.int64), len(self.pitches) - 1)
+        positions = np.where(scaled - column < self.keep_probs[column], column, self.aliases[column])
+        return self.pitches[positions]
+
+    def draw(self, rng, size=None):
+        """size pitches (a single one by default) drawn with the numpy Generator"""
+        return self.sample(rng.random(size))
+
+
+def hit_array(drum_hits, num_groups: int) -> np.ndarray:
+    """Reshapes a prob_hits sheet (pulses x (groups * fields)) into a (pulses x groups x fields) array"""
+    values = np.asarray(drum_hits, dtype=np.float64)
+    return values.reshape(values.shape[0], num_groups, NUM_CHANCE_FIELDS)
+
+
+def generate_measure_events(drum_groups, pulse_times, hits: np.ndarray, pulses_beat: int, rng=None) -> np.ndarray:
+    """
+    Draws every hit, pitch, nudge and velocity of a measure in a handful of array operations.
+
+    :param drum_groups: Sequence of DrumGroups or a GroupTable already built by compile_drum_groups
+    :param pulse_times: Start time (in quarter notes) of each pulse in the measure
+    :param hits: (pulses x groups x fields) array as built by hit_array
+    :param pulses_beat: Pulses per beat; used to size the note durations
+    :param rng: Source of randomness; a Generator for the whole measure, a sequence of Generators (one per drum
+                group, see GenerationContext.group_rngs) or a fresh, unseeded generator if not supplied
+    :return: Events ordered by pulse, then by drum group (EVENT_DTYPE)
+    """
+    return _measure_events(drum_groups, pulse_times, hits, pulses_beat, rng)[0]
+
+
+def _measure_events(drum_groups, pulse_times, hits, pulses_beat, rng):
+    """generate_measure_events, plus the pulse each event was drawn on"""
+    table = group_table(drum_groups)
+    pulse_times = np.asarray(pulse_times, dtype=np.float64)
+
+    # One uniform per pulse and group for each of: hit, nudge, pitch and velocity
+    u_hit, u_nudge, u_pitch, u_vol = _uniforms(rng, *hits.shape[:2])
+
+    # Core random check which drives the drum hits; nonzero keeps the pulse-major ordering
+    hit_mask = u_hit <= hits[..., PROB_HIT]
+    pulse_idx, group_idx = np.nonzero(hit_mask)
+    chances = hits[pulse_idx, group_idx]
+    num_hits = len(pulse_idx)
+
+    # Nudge off the grid by a whole number of hundredths in [-nudge, nudge)
+    nudge_amt = table.nudges[group_idx]
+    nudge = (np.floor(u_nudge[hit_mask] * 2 * nudge_amt) - nudge_amt) * 0.01
+
+    # Choose which drum from the set of drum groups based on stated probabilities
+    pitch_pos = _alias_sample(table, group_idx, u_pitch[hit_mask])
+
+    # Range bound velocity, inclusive of both ends
+    min_vol = chances[:, MIN_VOL]
+    max_vol = chances[:, MAX_VOL]
+    velocity = min_vol + np.floor(u_vol[hit_mask] * (max_vol - min_vol + 1))
+
+    events = np.empty(num_hits, dtype=EVENT_DTYPE)
+    events['track'] = table.tracks[group_idx]
+    events['time'] = np.maximum(0, pulse_times[pulse_idx] + nudge)
+    events['pitch'] = table.pitches[group_idx, pitch_pos]
+    events['velocity'] = velocity
+    events['duration'] = chances[:, DURATION] / pulses_beat - nudge
+    events['group'] = group_idx
+    return events, pulse_idx
+
+
+def _uniforms(rng, num_pulses, num_groups):
+    """(4 x pulses x groups) uniforms.  With one generator per group, each group's column only uses its own"""
+    if rng is None or isinstance(rng, np.random.Generator):
+        rng = np.random.default_rng() if rng is None else rng
+        return rng.random((4, num_pulses, num_groups))
+    return np.stack([g.random((4, num_pulses)) for g in rng], axis=-1)
+
+
+def generate_measures(drum_groups, measures, pulses_beat: int, context, workers: int = 0):
+    """
+    Generates the events of every measure, each from its own per group streams of the GenerationContext.
+    The result is the same however many worker processes are used.
+
+    :param drum_groups: Sequence of DrumGroups or their GroupTable (see drum_config.DrumConfig.group_table)
+    :param measures: Mapping of measure id to (pulse times, hits array), as held by drum_config.DrumConfig
+    :param workers: Worker processes; 0 generates in this process
+    :return: Mapping of measure id to events
+    """
+    table = group_table(drum_groups)
+    ids = sorted(measures)
+    jobs = [(table, *measures[i], pulses_beat, context.group_rngs(i, len(table.tracks))) for i in ids]
+
+    if workers == 0:
+        events = {i: generate_measure_events(*job) for i, job in zip(ids, jobs)}
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            events = dict(zip(ids, pool.map(generate_measure_events, *zip(*jobs))))
+
+    instrumentation.count('hits drawn', sum(len(e) for e in events.values()))
+    return events
+
+
+def stitch_measures(measures: Sequence[np.ndarray], pattern: Sequence[int], beats_measure: int) -> NoteStore:
+    """
+    Lays the measures end to end as dictated by the pattern; each entry of the pattern indexes into measures.
+    Each unique measure is held once, along with every point in the pattern it is played at.
+    """
+    pattern = np.asarray(pattern, dtype=np.int64)
+    starts = np.arange(len(pattern)) * beats_measure
+    return NoteStore.concat((NoteStore(measures[p], starts[pattern == p]) for p in np.unique(pattern).tolist()),
+                            dtype=EVENT_DTYPE)
+
+
+def render_track(drum_groups, measures, pattern: Sequence[int], pulses_beat: int, beats_measure: int, context,
+                 track_names=None, workers: int = 0, groove=None) -> bytes:
+    """
+    Generates the measures the pattern uses, stitches them together and encodes the result as a Standard MIDI File.
+    Notes for a drum group land on track (group track - 1).
+
+    :param drum_groups: Sequence of DrumGroups or, to skip compiling them again, their GroupTable
+    :param groove: Optional groove.Groove applied to the whole track, drawing on the context's groove stream
+    """
+    table = group_table(drum_groups)
+    with instrumentation.stage('measure generation'):
+        used = {i: measures[i] for i in sorted(set(pattern))}
+        measure_events = generate_measures(table, used, pulses_beat, context, workers)
+
+    return encode_track(table, measure_events, pattern, beats_measure, track_names, groove,
+                        context.groove_rng())
+
+
+def track_events(drum_groups, measure_events, pattern: Sequence[int], beats_measure: int, groove=None,
+                 rng=None) -> np.ndarray:
+    """
+    Every event of the track, laid out flat bar after bar as dictated by the pattern, with the groove (if any)
+    applied.  The same events as bar_events yields for the same rng.
+    """
+    with instrumentation.stage('assembly'):
+        ids, bar_ids = np.unique(np.asarray(pattern, dtype=np.int64), return_inverse=True)
+        if not len(ids):
+            return np.empty(0, dtype=EVENT_DTYPE)
+        # Each distinct measure once, then every bar picks its measure's run out of them
+        held = [measure_events[i] for i in ids.tolist()]
+        held_sizes = np.array([len(m) for m in held], dtype=np.int64)
+        sizes, firsts = held_sizes[bar_ids], (np.cumsum(held_sizes) - held_sizes)[bar_ids]
+        skip = np.repeat(np.cumsum(sizes) - sizes - firsts, sizes)
+        events = np.concatenate(held)[np.arange(len(skip)) - skip]
+        events['time'] += np.repeat(np.arange(len(bar_ids)) * beats_measure, sizes)
+
+    if groove is not None:
+        with instrumentation.stage('groove'):
+            events = apply_groove(events, drum_groups, groove, beats_measure, rng)
+    return events
+
+
+def bar_events(drum_groups, measure_events, pattern: Sequence[int], beats_measure: int, groove=None, rng=None):
+    """
+    Yields the events of the track a bar at a time, with the groove (if any) applied.  The jitter is drawn from rng
+    bar by bar in the order track_events draws it for the whole track, so the events are the same.
+    """
+    if groove is not None and groove.humanize and rng is None:
+        rng = np.random.default_rng()
+    for b, p in enumerate(pattern):
+        events = measure_events[p].copy()
+        events['time'] += b * beats_measure
+        yield events if groove is None else apply_groove(events, drum_groups, groove, beats_measure, rng)
+
+
+def encode_track(drum_groups, measure_events, pattern: Sequence[int], beats_measure: int, track_names=None,
+                 groove=None, rng=None) -> bytes:
+    """
+    Stitches generated measures together as dictated by the pattern and encodes them as a Standard MIDI File, with
+    the groove (if any) applied to the whole track
+    """
+    table = group_table(drum_groups)
+    events = track_events(table, measure_events, pattern, beats_measure, groove, rng)
+    with instrumentation.stage('assembly'):
+        notes = smf.to_ticks(events)
+
+    with instrumentation.stage('encode'):
+        return smf.encode(notes, num_tracks(table), track_names=track_names)
+
+
+class IncrementalRenderer:
+    """
+    render_track for repeated renders of a changing config, e.g. while someone edits the workbook.  The events of
+    every (measure, drum group) pair are kept along with a fingerprint of what they were drawn from: the group's
+    compiled row, its column of the measure's hits and its position.  A render only draws the pairs whose fingerprint
+    changed, so the cost follows the size of the edit rather than the size of the song.  Each group draws from its
+    own stream of the GenerationContext, so the output is the same as a full render_track.
+    """
+
+    def __init__(self, pulses_beat: int, beats_measure: int, context):
+        self.pulses_beat = pulses_beat
+        self.beats_measure = beats_measure
+        self.context = context
+        # (measure id, group position) -> (fingerprint, events, pulse of each event)
+        self._groups = {}
+        # measure id -> (fingerprints of its groups, merged events)
+        self._measures = {}
+
+    def render(self, drum_groups, measures, pattern: Sequence[int], track_names=None, groove=None) -> bytes:
+        """:param drum_groups: Sequence of DrumGroups or their GroupTable, as for render_track"""
+        table = group_table(drum_groups)
+        with instrumentation.stage('measure generation'):
+            used = sorted(set(pattern))
+            measure_events = {m: self._measure(table, m, *measures[m]) for m in used}
+
+        # Forget measures (and groups) that are no longer played so the cache tracks the current config
+        self._measures = {m: self._measures[m] for m in used}
+        self._groups = {k: v for k, v in self._groups.items()
+                        if k[0] in self._measures and k[1] < len(table.tracks)}
+        return encode_track(table, measure_events, pattern, self.beats_measure, track_names, groove,
+                            self.context.groove_rng())
+
+    def _measure(self, table, m, pulse_times, hits):
+        pulse_times = np.asarray(pulse_times, dtype=np.float64)
+        fingerprints = tuple(_fingerprint(table, g, pulse_times, hits[:, g], self.pulses_beat)
+                             for g in range(len(table.tracks)))
+
+        cached = self._measures.get(m)
+        if cached is not None and cached[0] == fingerprints:
+            return cached[1]
+
+        drawn = 0
+        parts = []
+        for g, fingerprint in enumerate(fingerprints):
+            entry = self._groups.get((m, g))
+            if entry is None or entry[0] != fingerprint:
+                sub_table = GroupTable(*(column[g:g + 1] for column in table))
+                events, pulse_idx = _measure_events(sub_table, pulse_times, hits[:, g:g + 1], self.pulses_beat,
+                                                    [self.context.group_rng(m, g)])
+                events['group'] = g
+                entry = self._groups[(m, g)] = (fingerprint, events, pulse_idx)
+                drawn += 1
+            parts.append(entry)
+        instrumentation.count('groups drawn', drawn)
+
+        # Back into generate_measure_events order: by pulse, then by drum group
+        events = np.concatenate([e for _, e, _ in parts])
+        pulse_idx = np.concatenate([p for _, _, p in parts])
+        group_idx = np.repeat(np.arange(len(parts)), [len(e) for _, e, _ in parts])
+        events = events[np.lexsort((group_idx, pulse_idx))]
+        self._measures[m] = (fingerprints, events)
+        return events
+
+
+def _fingerprint(table, position, pulse_times, group_hits, pulses_beat):
+    row = tuple(column[position].tolist() for column in table)
+    h = hashlib.blake2b(repr((row, position, pulses_beat)).encode(), digest_size=16)
+    h.update(pulse_times.tobytes())
+    h.update(np.ascontiguousarray(group_hits, dtype=np.float64).tobytes())
+    return h.digest()
@@ -0,0 +1,208 @@
+import asyncio
+import contextlib
+from collections import namedtuple
+
+import numpy as np
+
+import drum_engine
+import instrumentation
+import smf
+
+# Streaming drum generation.  Rather than rendering a whole track before anything is written, bars are generated
+# one at a time on a worker thread while the event loop hands earlier bars to a sink.  At most `lookahead` bars
+# are ever waiting for the sink, so memory stays flat however long the pattern (which may be an endless iterator,
+# e.g. itertools.cycle) runs.
+#
+#   sink = MidiByteSink(open('/dev/snd/midiC1D0', 'wb', buffering=0), tempo=120)
+#   asyncio.run(stream_drum_track(config.group_table, config.measures, cycle([0, 0, 1]), sink, 4, 4, context))
+
+# One bar's worth of MIDI messages.  times are absolute, in quarter notes, one per row of messages, which holds the
+# status, pitch and velocity bytes.  NoteOffs that fall beyond the end of a bar are carried into the next block.
+Block = namedtuple('Block', ['bar', 'start', 'times', 'messages'])
+
+StreamStats = namedtuple('StreamStats', ['bars', 'messages', 'underruns'])
+
+_END = object()
+
+
+def bar_messages(events, start: float, channel: int = 0):
+    """
+    NoteOn/NoteOff messages for a measure of engine events (see drum_engine.EVENT_DTYPE) played from start.  As in
+    smf.encode, every note lasts at least a tick, so its NoteOff can't sort ahead of its own NoteOn.
+    """
+    n = len(events)
+    durations = np.maximum(1 / smf.TICKS_PER_QUARTER, events['duration'])
+    times = np.concatenate([events['time'], events['time'] + durations]) + start
+    messages = np.empty((2 * n, 3), dtype=np.uint8)
+    messages[:, 0] = np.repeat(np.array([smf.NOTE_ON, smf.NOTE_OFF], dtype=np.uint8) | channel, n)
+    messages[:, 1] = np.tile(events['pitch'], 2)
+    messages[:, 2] = np.concatenate([events['velocity'], np.zeros(n, dtype=np.uint8)])
+    return times, messages
+
+
+async def stream_drum_track(drum_groups, measures, pattern, sink, pulses_beat: int, beats_measure: int, context,
+                            lookahead: int = 1, channel: int = 0) -> StreamStats:
+    """
+    Plays the pattern into the sink bar by bar.  Bar N + 1 is generated while bar N is being consumed; each
+    measure id is drawn from the same streams of the GenerationContext as drum_engine.render_track uses, so a
+    seed gives the same notes whether the track is streamed or rendered to a file.
+
+    :param drum_groups: Sequence of DrumGroups or their drum_engine.GroupTable (see drum_config.DrumConfig)
+    :param measures: Mapping of measure id to (pulse times, hits array), as held by drum_config.DrumConfig
+    :param pattern: Iterable of measure ids, one per bar; may be endless
+    :param sink: Object with async write(block) and close() methods, e.g. MidiByteSink, SmfFileSink or MemorySink
+    :param lookahead: Number of generated bars allowed to queue up ahead of the sink
+    :return: Bars and messages written and the number of times the sink was kept waiting for a bar
+    """
+    if lookahead < 1:
+        raise ValueError(f'lookahead must be at least 1, got {lookahead}')
+
+    table = drum_engine.group_table(drum_groups)
+    queue = asyncio.Queue(maxsize=lookahead)
+    producer = asyncio.create_task(_produce(queue, table, measures, pattern, pulses_beat, beats_measure, context,
+                                            channel))
+    bars = num_messages = underruns = 0
+    try:
+        while True:
+            # An empty queue past the first bar means generation fell behind the sink
+            if bars and queue.empty():
+                underruns += 1
+            block = await queue.get()
+            if block is _END:
+                break
+            if isinstance(block, BaseException):
+                raise block
+
+            with instrumentation.stage('sink'):
+                await sink.write(block)
+            bars += 1
+            num_messages += len(block.messages)
+    finally:
+        producer.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await producer
+        await sink.close()
+
+    instrumentation.count('stream underruns', underruns)
+    return StreamStats(bars, num_messages, underruns)
+
+
+async def _produce(queue, table, measures, pattern, pulses_beat, beats_measure, context, channel):
+    try:
+        cache = {}
+        pending_times, pending_messages = np.empty(0), np.empty((0, 3), dtype=np.uint8)
+        pattern = iter(pattern)
+        m = next(pattern, _END)
+        bar = 0
+        while m is not _END:
+            # Each unique measure is only drawn once; the generation runs off the event loop
+            if m not in cache:
+                with instrumentation.stage('measure generation'):
+                    cache[m] = await asyncio.to_thread(drum_engine.generate_measure_events, table, *measures[m],
+                                                       pulses_beat, context.group_rngs(m, len(table.tracks)))
+
+            start = bar * beats_measure
+            times, messages = bar_messages(cache[m], start, channel)
+            times = np.concatenate([pending_times, times])
+            messages = np.concatenate([pending_messages, messages])
+
+            # NoteOffs sort first on a shared time (0x80 < 0x90); carried over messages stay ahead of new ones
+            order = np.lexsort((messages[:, 0], times))
+            times, messages = times[order], messages[order]
+
+            m = next(pattern, _END)
+            cut = len(times) if m is _END else np.searchsorted(times, start + beats_measure)
+            pending_times, pending_messages = times[cut:], messages[cut:]
+            await queue.put(Block(bar, start, times[:cut], messages[:cut]))
+            bar += 1
+        await queue.put(_END)
+    except Exception as e:
+        await queue.put(e)
+
+
+class MidiByteSink:
+    """
+    Writes raw MIDI messages (no delta times) to a byte stream: a MIDI device opened as a file, an asyncio
+    StreamWriter or anything else with write().  With a tempo, every message is held back until it is due in real
+    time, counted from the start of the first block; max_lateness is the furthest behind schedule (in seconds)
+    any message went out.
+    """
+
+    def __init__(self, stream, tempo: float = None):
+        self.stream = stream
+        self.seconds_per_quarter = 60 / tempo if tempo else None
+        self.max_lateness = 0.0
+        self._origin = None
+
+    async def write(self, block: Block):
+        if self.seconds_per_quarter is None:
+            await self._send(block.messages.tobytes())
+            return
+
+        loop = asyncio.get_running_loop()
+        if self._origin is None:
+            self._origin = loop.time() - block.start * self.seconds_per_quarter
+
+        # Messages sharing a time go out together
+        times, firsts = np.unique(block.times, return_index=True)
+        bounds = np.append(firsts, len(block.times)).tolist()
+        for due, lo, hi in zip((self._origin + times * self.seconds_per_quarter).tolist(), bounds, bounds[1:]):
+            delay = due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                self.max_lateness = max(self.max_lateness, -delay)
+            await self._send(block.messages[lo:hi].tobytes())
+
+    async def _send(self, data):
+        self.stream.write(data)
+        if hasattr(self.stream, 'drain'):
+            await self.stream.drain()
+
+    async def close(self):
+        if hasattr(self.stream, 'flush'):
+            self.stream.flush()
+
+
+class SmfFileSink:
+    """
+    Streams a format 0 Standard MIDI File, all drum tracks merged into one.  The track length is patched in on
+    close, so nothing but the current block is held in memory.
+    """
+
+    def __init__(self, path: str, ticks_per_quarter: int = smf.TICKS_PER_QUARTER, tempo: float = 120):
+        self.ticks_per_quarter = ticks_per_quarter
+        self._f = open(path, 'wb')
+        self._f.write(b'MThd' + (6).to_bytes(4, 'big') + (0).to_bytes(2, 'big') + (1).to_bytes(2, 'big') +
+                      ticks_per_quarter.to_bytes(2, 'big'))
+        self._f.write(b'MTrk' + bytes(4))
+        self._length = self._f.write(b'\x00\xff\x51\x03' + int(round(60_000_000 / tempo)).to_bytes(3, 'big'))
+        self._tick = 0
+
+    async def write(self, block: Block):
+        ticks = np.rint(block.times * self.ticks_per_quarter).astype(np.int64)
+        self._length += self._f.write(smf.encode_messages(np.diff(ticks, prepend=self._tick), block.messages))
+        if len(ticks):
+            self._tick = int(ticks[-1])
+
+    async def close(self):
+        if self._f.closed:
+            return
+        self._length += self._f.write(b'\x00\xff\x2f\x00')
+        self._f.seek(18)
+        self._f.write(self._length.to_bytes(4, 'big'))
+        self._f.close()
+
+
+class MemorySink:
+    """Keeps every block in memory; for tests"""
+
+    def __init__(self):
+        self.blocks = []
+        self.closed = False
+
+    async def write(self, block: Block):
+        self.blocks.append(block)
+
+    async def close(self):
+        self.closed = True
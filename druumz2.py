@@ -1,26 +1,21 @@
+import ast
 import logging
-from collections import namedtuple
-
-import numpy as np
-import pandas as pd
-
-logging.basicConfig(level=logging.INFO)
-
-DrumGroup = namedtuple('DrumGroup',
-                       ['name', 'track', 'midi_pitch_set', 'prob_pitch', 'nudge'],
-                       defaults=(0,))
-# DrumGroup.__new__.__defaults__ = (0,)
-
-DrumChance = namedtuple('DrumChance',
-                        ['prob_hit', 'min_vol', 'max_vol', 'duration'],
-                        defaults=(0, 25, 100, 1))
-# DrumChance.__new__.__defaults__ = (0, 25, 100, 1)
+import os
+import time
+from itertools import chain
+from time import gmtime, strftime
+from typing import List, Tuple, TYPE_CHECKING
 
-MIDI_MAP_SHEET = 'midi_map'
-HITS_SHEET = 'prob_hits'
+import drum_config
+import drum_engine
+import instrumentation
+from drum_config import DrumGroup, DrumChance, MIDI_MAP_SHEET, HITS_SHEET
+from generation_context import GenerationContext
 
-# TODO Parameterize
-WRITE_PATH = r'c:\temp\sample.xlsx'
+# pandas and midiutil are only imported by the code paths that need them; importing this module does no work
+if TYPE_CHECKING:
+    import pandas as pd
+    from midiutil import MIDIFile
 
 # TODO Externalize
 pulses_beat = 4
@@ -28,9 +23,9 @@ beats_measure = 4
 measures_sim = 1
 
 
-def build_default_workbook(path=WRITE_PATH):
+def build_default_workbook(path: str):
     """Builds a default workbook containing empty but representative settings"""
-    writer = pd.ExcelWriter(path, engine='xlsxwriter')
+    import pandas as pd
 
     num_drum_groups = 4
 
@@ -40,8 +35,6 @@ def build_default_workbook(path=WRITE_PATH):
            DrumGroup('hat', 2, (44,), (1.0,), 1),
            DrumGroup('ride', 2, (49, 51), (0.5, 0.5), 2)]
 
-    pd.DataFrame(dgs[:num_drum_groups]).to_excel(writer, sheet_name=MIDI_MAP_SHEET)
-
     # Determine index markers for the measure(s)
     total_beats = pulses_beat * beats_measure * measures_sim
     pbx = [idx / pulses_beat for idx in range(total_beats)]
@@ -54,27 +47,14 @@ def build_default_workbook(path=WRITE_PATH):
     # 3. expanding that into an appropriately sized DataFrame (for serialization through pandas)
     default_matrix = pd.DataFrame([row] * len(pbx), index=pbx, columns=col_headers)
 
-    default_matrix.to_excel(writer, sheet_name=HITS_SHEET + '_0')
-    writer.save()
-
-
-build_default_workbook()
-
-#######################################################################################################################
-
-from midiutil import MIDIFile
-from time import gmtime, strftime
-from typing import List, Tuple
-import random
-import ast
-
-# TODO Parameterize
-READ_PATH = r'c:\temp\sample6.xlsx'
-
-now = gmtime()
+    with pd.ExcelWriter(path, engine='xlsxwriter') as writer:
+        pd.DataFrame(dgs[:num_drum_groups]).to_excel(writer, sheet_name=MIDI_MAP_SHEET)
+        default_matrix.to_excel(writer, sheet_name=HITS_SHEET + '_0')
 
 
 def read_drum_groups(path: str, sheet_name: str = MIDI_MAP_SHEET):
+    import pandas as pd
+
     # Drum groups carry the drum group config information
     drum_groups = list()
 
@@ -96,99 +76,129 @@ def read_drum_groups(path: str, sheet_name: str = MIDI_MAP_SHEET):
 
 def read_drum_hits(path: str, sheet_name: str):
     """Reads drum hit probabilities from workbook"""
+    import pandas as pd
+
     drum_hits = pd.read_excel(path, sheet_name=sheet_name, index_col=0)
-    logging.info("Drum hits shape: " + str(drum_hits.shape))
+    logging.info("Drum hits shape: %s", drum_hits.shape)
     return drum_hits
 
 
-def log_midi_evts(midi_container: MIDIFile, tracks: Tuple[int] = (1,), evtname: str = 'NoteOn'):
+def log_midi_evts(midi_container: 'MIDIFile', tracks: Tuple[int] = (1,), evtname: str = 'NoteOn'):
     """Logs out MIDI NoteOn information"""
+    log_events = logging.getLogger().isEnabledFor(logging.INFO)
     for t in tracks:
-        note_on_evts = [evt for evt in midi_container.tracks[t].eventList if evt.evtname == evtname]
-        if not note_on_evts:
-            logging.warning(f"No {evtname} events for track {t}")
+        note_on_evts = (evt for evt in midi_container.tracks[t].eventList if evt.evtname == evtname)
+        first = next(note_on_evts, None)
+        if first is None:
+            logging.warning("No %s events for track %s", evtname, t)
             break
 
-        if logging.getLogger().isEnabledFor(logging.INFO):
-            [logging.info(evt.__dict__) for evt in note_on_evts]
+        # Only walk the rest of the events when they are actually going to be logged
+        if log_events:
+            for evt in chain([first], note_on_evts):
+                logging.info(evt.__dict__)
 
 
-def generate_measure(num_tracks: int, drum_groups: List[DrumGroup], drum_hits: pd.DataFrame) -> MIDIFile:
+def generate_measure(num_tracks: int, drum_groups: List[DrumGroup], drum_hits: 'pd.DataFrame') -> 'MIDIFile':
     """
     Core function that generates a measure of drum hits.  Places contents in what is effectively a
     temporary container
     """
-    midi_measure = MIDIFile(numTracks=num_tracks)
-
-    for row in drum_hits.itertuples():
-        time = row.Index
-
-        for i, drum_group in enumerate(drum_groups):
-            # Slice the drum group out of the set of groups
-            # Offset of 1 to adjust for presence of pandas Index column
-            l_bound = i * len(DrumChance._fields) + 1
-            drum_chance = DrumChance(*row[l_bound:l_bound + len(DrumChance._fields)])
+    # Draw the whole measure in one go, then hand the events over to the container
+    hits = drum_engine.hit_array(drum_hits, len(drum_groups))
+    events = drum_engine.generate_measure_events(drum_groups, drum_hits.index, hits, pulses_beat)
+    return events_to_midi(num_tracks, events)
 
-            # Core random check which drives the drum hit
-            if random.random() <= drum_chance.prob_hit:
-                nudge = random.randrange(-1 * drum_group.nudge, drum_group.nudge) * 0.01
 
-                # Choose which drum from set of drum groups based on stated probabilities
-                pitch_pos = np.random.choice(np.arange(0, len(drum_group.prob_pitch)), p=drum_group.prob_pitch)
+def events_to_midi(num_tracks: int, events) -> 'MIDIFile':
+    """Adds engine events (see drum_engine.EVENT_DTYPE) to a fresh MIDI container"""
+    from midiutil import MIDIFile
 
-                midi_measure.addNote(track=drum_group.track - 1,
-                                     channel=0,
-                                     pitch=drum_group.midi_pitch_set[pitch_pos],
-                                     time=max(0, time + nudge),
-                                     duration=(drum_chance.duration / pulses_beat) - nudge,
-                                     volume=random.randint(drum_chance.min_vol, drum_chance.max_vol))
+    midi_measure = MIDIFile(numTracks=num_tracks)
+    for evt in events.tolist():
+        track, time, pitch, volume, duration, _ = evt
+        midi_measure.addNote(track=track, channel=0, pitch=pitch, time=time, duration=duration, volume=volume)
     return midi_measure
 
 
-def simulate_drum_track(pattern: List[int]):
-    """Stitches together a series of drum patterns into a MIDI file for use elsewhere."""
-    drum_track_idxs, drum_groups = read_drum_groups(READ_PATH)
-    num_tracks = max(drum_track_idxs) + 1
+def simulate_drum_track(pattern: List[int], read_path: str, write_path: str = None, seed=None,
+                        workers: int = 0, groove=None) -> str:
+    """
+    Stitches together a series of drum patterns into a MIDI file for use elsewhere.  The same seed always gives
+    the same file, whether the measures are generated serially or across worker processes.
+
+    :param read_path: Workbook (or JSON/TOML file or CSV directory, see drum_config) holding the drum groups and
+                      the hits of every measure in the pattern
+    :param write_path: MIDI file to write; defaults to a time stamped file in the working directory
+    :param groove: Optional groove.Groove applied to the whole track
+    :return: The path written to
+    """
+    now = gmtime()
+    write_path = write_path or strftime("%Y%m%d %H%M%S", now) + '.mid'
+
+    # One pass over the config (or the compiled cache of a workbook) for the drum groups and every measure
+    with instrumentation.stage('workbook load'):
+        config = drum_config.load_config(read_path)
 
-    # Generate the core measures to work with
-    measures = list()
     # Note, there must be a worksheet defined for each unique measure generated.  The suffix of the worksheet name
     # must match the identifier in the pattern list.
-    num_unique_measures = max(pattern) + 1
-    for i in range(num_unique_measures):
-        worksheet_name = HITS_SHEET + '_' + str(i)
-        drum_hits = read_drum_hits(READ_PATH, worksheet_name)
-        measure = generate_measure(num_tracks, drum_groups, drum_hits)
-        measures.append(measure)
-
-    # Setup final MIDI container for the file that will be written to disk
-    midi_file = MIDIFile(num_tracks)
-    for idx in drum_track_idxs:
-        # Pull the details of the track name from the name of the drum group and augment with date time info
-        track_name = ', '.join([dg.name for dg in drum_groups if dg.track == idx] + [strftime("%m%d %H%M", now)])
-        midi_file.addTrackName(idx, 0, track_name)
-
-    # Assemble the final set from the individual patterns
-    # Each 'p' in the pattern reflects the measure identifier to use in the pattern
-    for i, p in enumerate(pattern):
-        mx = measures[p]
-        measure_tick = mx.ticks_per_quarternote * beats_measure * i
-        # Transfer the NoteOn events from measure container to the final container as defined by the measure pattern.
-        # Adjust the timing to account for the measure.  Effectively an in place operation.
-        # for idx in range(1, len(mx.tracks)):
-        for idx, track in enumerate(mx.tracks):
-            for evt in filter(lambda e: e.evtname == 'NoteOn', track.eventList):
-                midi_file.addNote(track=idx,
-                                  channel=0,
-                                  pitch=evt.pitch,
-                                  time=mx.tick_to_quarter(measure_tick + evt.tick),
-                                  duration=mx.tick_to_quarter(evt.duration),
-                                  volume=evt.volume)
-
-    with open('c:/temp/' + strftime("%Y%m%d %H%M%S", now) + '.mid', "wb+") as f:
-        midi_file.writeFile(f)
-        f.close()
-
-
-starting_pattern = [0]
-simulate_drum_track(starting_pattern)
+    context = GenerationContext(seed)
+    logging.info("Generating %s measures with seed %s", len(set(pattern)), context.seed)
+
+    content = drum_engine.render_track(config.group_table, config.measures, pattern, pulses_beat, beats_measure,
+                                       context, _track_names(config, now), workers, groove)
+
+    with instrumentation.stage('write'), open(write_path, "wb+") as f:
+        f.write(content)
+    return write_path
+
+
+def watch_drum_track(pattern: List[int], read_path: str, write_path: str, seed=None, interval: float = 1.0,
+                     stop=None, groove=None):
+    """
+    Re-renders the drum track every time the config changes, until stop() (if given) returns True.  Only the
+    measures and drum groups whose settings changed are drawn again (see drum_engine.IncrementalRenderer); with a
+    fixed seed each render matches what simulate_drum_track would write for the same config.
+
+    :param interval: Seconds between checks of the config's modification time
+    """
+    context = GenerationContext(seed)
+    renderer = drum_engine.IncrementalRenderer(pulses_beat, beats_measure, context)
+    now = gmtime()
+    logging.info("Watching %s with seed %s", read_path, context.seed)
+
+    last = None
+    while stop is None or not stop():
+        signature = _signature(read_path)
+        if signature != last:
+            last = signature
+            try:
+                with instrumentation.stage('workbook load'):
+                    config = drum_config.load_config(read_path)
+                content = renderer.render(config.group_table, config.measures, pattern, _track_names(config, now),
+                                          groove)
+            except Exception:
+                # Most likely caught half way through a save; the next change will trigger another attempt
+                logging.exception("Could not render %s", read_path)
+            else:
+                with instrumentation.stage('write'), open(write_path, "wb+") as f:
+                    f.write(content)
+                logging.info("Wrote %s", write_path)
+        time.sleep(interval)
+
+
+def _signature(path):
+    """Changes whenever the config file (or any file of a CSV directory) is modified"""
+    paths = [os.path.join(path, name) for name in sorted(os.listdir(path))] if os.path.isdir(path) else [path]
+    try:
+        stats = [os.stat(p) for p in paths]
+    except FileNotFoundError:
+        return None
+    return [(p, st.st_mtime_ns, st.st_size) for p, st in zip(paths, stats)]
+
+
+def _track_names(config, now):
+    # Track names come from the drum groups on the track, augmented with date time info
+    return {idx - 1: ', '.join([dg.name for dg in config.drum_groups if dg.track == idx] +
+                               [strftime("%m%d %H%M", now)])
+            for idx in config.drum_tracks}
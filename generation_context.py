@@ -0,0 +1,49 @@
+import numpy as np
+
+# Reproducible, independent random streams for generation.  The streams form a fixed SeedSequence spawn tree:
+#
+#   root ─┬─ measures ── measure m ── drum group g
+#         ├─ voices ──── voice v
+#         ├─ items ───── item i
+#         └─ groove
+#
+# Every node is derived from the root seed and its position in the tree alone, so a stream is the same whichever
+# process asks for it and in whatever order.  That lets measures, voices or batch items be generated in parallel and
+# still match a serial run byte for byte.
+
+_MEASURES, _VOICES, _ITEMS, _GROOVE = range(4)
+
+
+class GenerationContext:
+
+    def __init__(self, seed=None):
+        self._root = np.random.SeedSequence(seed)
+
+    @property
+    def seed(self):
+        """Root entropy; pass it back in to reproduce a run that was started without a seed"""
+        return self._root.entropy
+
+    def _seed_sequence(self, *path):
+        # Same as following .spawn() down the tree, without having to spawn every sibling on the way
+        return np.random.SeedSequence(self._root.entropy, spawn_key=self._root.spawn_key + path)
+
+    def measure_rng(self, measure: int) -> np.random.Generator:
+        return np.random.default_rng(self._seed_sequence(_MEASURES, measure))
+
+    def group_rng(self, measure: int, group: int) -> np.random.Generator:
+        return np.random.default_rng(self._seed_sequence(_MEASURES, measure, group))
+
+    def group_rngs(self, measure: int, num_groups: int):
+        """One generator per drum group for the measure"""
+        return [self.group_rng(measure, g) for g in range(num_groups)]
+
+    def voice_rng(self, voice: int) -> np.random.Generator:
+        return np.random.default_rng(self._seed_sequence(_VOICES, voice))
+
+    def item_rng(self, index: int) -> np.random.Generator:
+        return np.random.default_rng(self._seed_sequence(_ITEMS, index))
+
+    def groove_rng(self) -> np.random.Generator:
+        """Jitter applied to a whole track after the measures are drawn (see groove.apply_groove)"""
+        return np.random.default_rng(self._seed_sequence(_GROOVE))
@@ -0,0 +1,94 @@
+from collections import namedtuple
+
+import numpy as np
+
+# Groove and humanization for a whole rendered track at once.  The engine draws each unique measure once and plays
+# it wherever the pattern asks for it, so any feel drawn along with the measure comes back identically every time.
+# A Groove is applied afterwards, to the flat events of the whole track (see drum_engine.EVENT_DTYPE), and each of
+# its parts is a single array operation over every event:
+#
+#   swing      Ratio of the first to the second note of each pair of swing units: 0.5 is straight, 2/3 a triplet
+#              shuffle.  swing_unit is the length of one unit in quarter notes (0.5 swings eighths)
+#   feel       Per group lean, in units of the group's nudge (hundredths of a quarter note): positive sits back
+#              (laid back), negative pushes ahead of the beat
+#   templates  Timing offsets in quarter notes for evenly spaced slots of the bar, e.g. a recorded drummer's
+#              micro timing; one row for every group or one row per group
+#   accents    Velocity multipliers for evenly spaced slots of the bar, laid out like templates
+#   humanize   Random jitter of up to +/- (humanize * nudge) hundredths per note, drawn afresh for every bar played
+#
+#   events = apply_groove(events, config.drum_groups, Groove(swing=0.6, feel=[0, 1, -1], humanize=1), 4, rng)
+
+Groove = namedtuple('Groove', ['swing', 'swing_unit', 'feel', 'templates', 'accents', 'humanize'],
+                    defaults=(0.5, 0.5, 0.0, None, None, 0.0))
+
+
+def swing_times(times, ratio: float = 0.5, unit: float = 0.5) -> np.ndarray:
+    """
+    Moves the second unit of every pair so that the first takes ratio of the pair.  Times in between are stretched
+    to suit, so the mapping is continuous and keeps the order of notes nudged off the grid.
+    """
+    if not 0 < ratio < 1:
+        raise ValueError(f'Swing ratio must be between 0 and 1, got {ratio}')
+    if unit <= 0:
+        raise ValueError(f'Swing unit must be positive, got {unit}')
+    times = np.asarray(times, dtype=np.float64)
+    period = 2 * unit
+    start = np.floor(times / period) * period
+    into = times - start
+    split = ratio * period
+    return start + np.where(into < unit, into * (split / unit), split + (into - unit) * ((period - split) / unit))
+
+
+def bar_slots(times, beats_measure: int, num_slots: int) -> np.ndarray:
+    """The nearest of num_slots evenly spaced points in the bar for each time; half way rounds up"""
+    # A bar is a whole number of slots, so the bar line can wait for the integer modulo
+    return np.floor(times * (num_slots / beats_measure) + 0.5).astype(np.int64) % num_slots
+
+
+def apply_groove(events: np.ndarray, drum_groups, groove: Groove, beats_measure: int, rng=None) -> np.ndarray:
+    """
+    The events with the groove applied; the events passed in are left as they are.  Slots for templates and
+    accents are picked from each note's time before anything moves, so notes keep their place in the bar.
+
+    :param events: drum_engine.EVENT_DTYPE events with times measured from the start of a bar
+    :param drum_groups: The groups the events' group field refers to, or their drum_engine.GroupTable; their nudge
+                        scales feel and humanize
+    :param rng: numpy Generator for the jitter (see GenerationContext.groove_rng); a fresh one if not supplied
+    """
+    events = events.copy()
+    group = events['group'].astype(np.int64)
+    nudges = np.asarray(drum_groups.nudges if hasattr(drum_groups, 'nudges') else [dg.nudge for dg in drum_groups],
+                        dtype=np.float64)
+    times = events['time']
+    ends = times + np.maximum(0, events['duration'])
+
+    offset = np.broadcast_to(np.asarray(groove.feel, dtype=np.float64), len(nudges))[group] * nudges[group] * 0.01
+    if groove.templates is not None:
+        offset = offset + _slot_values(groove.templates, group, times, beats_measure, len(nudges))
+    if groove.humanize:
+        rng = np.random.default_rng() if rng is None else rng
+        offset = offset + (2 * rng.random(len(events)) - 1) * groove.humanize * nudges[group] * 0.01
+
+    if groove.accents is not None:
+        scale = _slot_values(groove.accents, group, times, beats_measure, len(nudges))
+        events['velocity'] = np.clip(np.rint(events['velocity'] * scale), 1, 127)
+
+    # The whole note moves; swing stretches its length along with the bar
+    if groove.swing != 0.5:
+        times = swing_times(times, groove.swing, groove.swing_unit)
+        ends = swing_times(ends, groove.swing, groove.swing_unit)
+    events['time'] = np.maximum(0, times + offset)
+    events['duration'] = np.maximum(0, ends + offset - events['time'])
+    return events
+
+
+def _slot_values(table, group, times, beats_measure, num_groups):
+    """Per note value from a (slots) or (groups x slots) table"""
+    table = np.asarray(table, dtype=np.float64)
+    if table.ndim == 1:
+        table = table[None, :]
+    if table.ndim != 2 or table.shape[0] not in (1, num_groups) or table.shape[1] == 0:
+        raise ValueError(f'Groove tables need one row for all groups or one row per group ({num_groups}); '
+                         f'got shape {table.shape}')
+    table = np.broadcast_to(table, (num_groups, table.shape[1]))
+    return table[group, bar_slots(times, beats_measure, table.shape[1])]
@@ -0,0 +1,84 @@
+import cProfile
+import json
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+
+# Stage timers and counters for generation runs.  Disabled by default, in which case stage() hands back a shared
+# no-op context manager and count() returns straight away, so the calls can stay in place in production code.
+# Hot loops should add up locally and count() once at the end rather than per iteration.
+#
+#   instrumentation.enable()
+#   ... run ...
+#   instrumentation.dump_json('run.json')
+
+_NULL_STAGE = nullcontext()
+
+
+class Instrumentation:
+
+    def __init__(self):
+        self.enabled = False
+        self._profiler = None
+        self.reset()
+
+    def reset(self):
+        self.timings = defaultdict(float)
+        self.calls = Counter()
+        self.counters = Counter()
+
+    def enable(self, profile: bool = False):
+        """Starts collecting; with profile, a cProfile.Profile runs alongside the timers too"""
+        self.enabled = True
+        if profile:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def disable(self):
+        self.enabled = False
+        if self._profiler is not None:
+            self._profiler.disable()
+
+    def stage(self, name: str):
+        """Context manager timing a stage; stages may nest and repeat, times add up"""
+        return self._timed(name) if self.enabled else _NULL_STAGE
+
+    @contextmanager
+    def _timed(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] += time.perf_counter() - start
+            self.calls[name] += 1
+
+    def count(self, name: str, amount: int = 1):
+        if self.enabled:
+            self.counters[name] += amount
+
+    def report(self) -> dict:
+        return {'stages': {name: {'seconds': secs, 'calls': self.calls[name]} for name, secs in self.timings.items()},
+                'counters': dict(self.counters)}
+
+    def dump_json(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+    def dump_stats(self, path: str):
+        """Writes the cProfile data (pstats / snakeviz / gprof2dot compatible); needs enable(profile=True)"""
+        if self._profiler is None:
+            raise ValueError('Profiling was not enabled')
+        self._profiler.dump_stats(path)
+
+
+# Module level instance and shortcuts, in the manner of the logging module
+instruments = Instrumentation()
+
+enable = instruments.enable
+disable = instruments.disable
+reset = instruments.reset
+stage = instruments.stage
+count = instruments.count
+report = instruments.report
+dump_json = instruments.dump_json
+dump_stats = instruments.dump_stats
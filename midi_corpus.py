@@ -0,0 +1,105 @@
+import argparse
+import json
+import logging
+import os
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+import countpoint_generator as cg
+import smf
+
+# Melodies out of existing MIDI files, e.g. as cantus firmi for counterpoint_batch.  Files are found and read one
+# at a time, so a directory of any size streams through in constant memory.  Each track gives one monophonic line
+# (the highest note at every onset), which is fitted to the nearest ScaleManager scale and snapped onto it.
+#
+#   python midi_corpus.py melodies/ -o cantus_firmi.jsonl --max-notes 16
+#   python counterpoint_batch.py cantus_firmi.jsonl -o counterpoint.jsonl
+
+MidiLine = namedtuple('MidiLine', ['path', 'track', 'tune'])
+
+MIDI_EXTENSIONS = ('.mid', '.midi', '.smf')
+
+
+def find_midi_files(root: str):
+    """Yields the MIDI files under root (or root itself, if it is a file) in a stable order"""
+    if not os.path.isdir(root):
+        yield root
+        return
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith(MIDI_EXTENSIONS):
+                yield os.path.join(dirpath, name)
+
+
+def melody_lines(notes):
+    """
+    The top line of each track: notes are ordered by onset and only the highest of any that start together is
+    kept.
+
+    :param notes: smf.NOTE_DTYPE array, as returned by smf.read
+    :return: List of (track, MIDI pitches), one per track with notes
+    """
+    notes = notes[np.lexsort((-notes['pitch'].astype(np.int64), notes['tick'], notes['track']))]
+    first = np.ones(len(notes), dtype=bool)
+    first[1:] = (notes['track'][1:] != notes['track'][:-1]) | (notes['tick'][1:] != notes['tick'][:-1])
+    notes = notes[first]
+
+    tracks, starts = np.unique(notes['track'], return_index=True)
+    return list(zip(tracks.tolist(), np.split(notes['pitch'].astype(np.int64), starts[1:])))
+
+
+def read_tunes(root: str, scale_manager=None, scale_types=('Major', 'Minor'), min_notes: int = 8,
+               max_notes: int = None, skip_channels=(9,)):
+    """
+    Yields a MidiLine for every melody in the MIDI files under root.  Files that can't be read are logged and
+    skipped.
+
+    :param scale_types: Types of scale the lines are fitted to; see ScaleManager.nearest_scale
+    :param min_notes: Shortest line (or phrase) kept
+    :param max_notes: Lines longer than this are cut into consecutive phrases of (at most) this length, all in the
+                      scale fitted to the whole line
+    """
+    scale_manager = scale_manager or cg.ScaleManager()
+    for path in find_midi_files(root):
+        try:
+            with open(path, 'rb') as f:
+                notes, _ = smf.read(f.read(), skip_channels)
+        except (OSError, ValueError, IndexError) as e:
+            logging.warning('Skipping %s: %s', path, e)
+            continue
+
+        for track, pitches in melody_lines(notes):
+            if len(pitches) < min_notes:
+                continue
+            scale = scale_manager.nearest_scale(pitches, scale_types)
+            positions = scale.nearest_positions(pitches)
+            pieces = 1 if max_notes is None else -(-len(positions) // max_notes)
+            for phrase in np.array_split(positions, pieces):
+                if len(phrase) >= min_notes:
+                    yield MidiLine(path, track, cg.Tune.from_positions(scale, phrase))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Extract melodies from MIDI files as JSON lines of cantus firmi')
+    parser.add_argument('root', help='MIDI file or directory to search')
+    parser.add_argument('-o', '--output', default='-', help="JSON lines output file; '-' for stdout")
+    parser.add_argument('--min-notes', type=int, default=8)
+    parser.add_argument('--max-notes', type=int, help='Cut longer melodies into phrases of this many notes')
+    args = parser.parse_args(argv)
+
+    dst = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        for line in read_tunes(args.root, min_notes=args.min_notes, max_notes=args.max_notes):
+            scale = line.tune.scale
+            dst.write(json.dumps({'root': scale.root_note, 'scale_type': scale.scale_type, 'sps': line.tune.sps,
+                                  'path': line.path, 'track': line.track}) + '\n')
+    finally:
+        if dst is not sys.stdout:
+            dst.close()
+
+
+if __name__ == '__main__':
+    main()
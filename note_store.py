@@ -0,0 +1,86 @@
+from typing import Iterable
+
+import numpy as np
+
+# Columnar storage for notes.  A store is a list of segments, each one a structured array of notes (any dtype with
+# a 'time' field) and the offsets at which that block of notes is placed.  Repeating or shifting a store only
+# touches the offsets, so a phrase played hundreds of times is still held once.  Nothing is copied until
+# to_array() lays the notes out flat.  Every store knows its dtype, so that even an empty one lays out as the notes
+# it would have held.
+
+NOTE_DTYPE = np.dtype([('track', np.int16),
+                       ('channel', np.uint8),
+                       ('pitch', np.uint8),
+                       ('time', np.float64),
+                       ('duration', np.float64),
+                       ('velocity', np.uint8)])
+
+
+class NoteStore:
+    __slots__ = ('_segments', 'dtype')
+
+    def __init__(self, notes: np.ndarray = None, offsets=(0.0,), dtype=None):
+        """dtype defaults to the notes' own, or NOTE_DTYPE when there are none"""
+        self._segments = [] if notes is None else [(self._freeze(notes), np.asarray(offsets, dtype=np.float64))]
+        self.dtype = np.dtype(dtype if dtype is not None else NOTE_DTYPE if notes is None else notes.dtype)
+
+    @classmethod
+    def from_records(cls, records, dtype=NOTE_DTYPE):
+        """Builds a store from tuples laid out as per the dtype"""
+        return cls(np.array(list(records), dtype=dtype))
+
+    @classmethod
+    def concat(cls, stores: Iterable['NoteStore'], dtype=None):
+        """dtype is that of the first segment; dtype, or that of the first store, only applies to an empty result"""
+        stores = list(stores)
+        segments = [seg for s in stores for seg in s._segments]
+        if segments:
+            dtype = segments[0][0].dtype
+        elif dtype is None and stores:
+            dtype = stores[0].dtype
+        store = cls(dtype=dtype)
+        store._segments = segments
+        return store
+
+    @staticmethod
+    def _freeze(notes):
+        # Segments are shared between stores, so nobody gets to write to them
+        notes = notes.view()
+        notes.flags.writeable = False
+        return notes
+
+    def __len__(self):
+        return sum(len(notes) * len(offsets) for notes, offsets in self._segments)
+
+    def __add__(self, other):
+        return NoteStore.concat([self, other])
+
+    def __iter__(self):
+        return iter(self.to_array())
+
+    def shift(self, amount: float) -> 'NoteStore':
+        """Same notes, moved by amount"""
+        return self._with_offsets(lambda offsets: offsets + amount)
+
+    def repeat(self, times: int, offset: float) -> 'NoteStore':
+        """The notes played times times, each repetition offset further along than the last"""
+        steps = np.arange(times) * offset
+        return self._with_offsets(lambda offsets: np.add.outer(steps, offsets).ravel())
+
+    def _with_offsets(self, fn):
+        store = NoteStore(dtype=self.dtype)
+        store._segments = [(notes, fn(offsets)) for notes, offsets in self._segments]
+        return store
+
+    def to_array(self) -> np.ndarray:
+        """Lays every note out flat; segment by segment, then offset by offset"""
+        if not self._segments:
+            return np.empty(0, dtype=self.dtype)
+
+        flat = []
+        for notes, offsets in self._segments:
+            block = np.empty((len(offsets), len(notes)), dtype=notes.dtype)
+            block[...] = notes
+            block['time'] += offsets[:, None]
+            flat.append(block.ravel())
+        return np.concatenate(flat)
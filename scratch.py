@@ -1,8 +1,11 @@
 import logging
 
-from midiutil import MIDIFile
+import numpy as np
 
 import countpoint_generator as cg
+import counterpoint_search as cs
+import smf
+from generation_context import GenerationContext
 
 
 def simple_trace(scale, sps, starting_note='C3'):
@@ -15,15 +18,8 @@ def simple_trace(scale, sps, starting_note='C3'):
 
 
 def interval_in_notes(scale, bottom_note, top_note):
-    # Double the scale to handle the effective wraparound of intervals
-    t_notes = scale.notes * 2
-
-    # Calc the bottom index
-    bottom_idx = t_notes.index(bottom_note)
-
-    # Ensure the top index occurs after the bottom index
-    # Calculate the interval; add one to bring it into music notation
-    return (t_notes.index(top_note, bottom_idx) - bottom_idx) + 1
+    # Wrap around to the top note at or above the bottom one; add one to bring it into music notation
+    return (scale.note_idx(top_note) - scale.note_idx(bottom_note)) % len(scale.notes) + 1
 
 
 def real_cp1(scale, sps):
@@ -48,74 +44,35 @@ def real_cp1(scale, sps):
     return result
 
 
-import random
-import numpy as np
-
-
-def real_cp2(scale, tune):
-    logging.basicConfig(level=logging.DEBUG)
-
-    cf_steps = scale.sps_to_steps(tune.sps)
-    cf_directions = [np.sign(s) for s in cf_steps]
-    starting_note = scale.sp_to_note(tune.starting_sp()) + '3'
-
-    result = []
-    prev_interval = 0
-
-    for i in range(len(tune)):
-        if i == 0 or i == len(tune) - 1:
-            result.append(starting_note)
-            logging.info('starting' if i == 0 else 'ending')
-        else:
-            step_size = direction = cf_directions[i - 1] * -1
-            logging.debug(f'step_size: {step_size}')
-
-            while True:
-
-                prop_sp = scale.shift_note(result[i - 1], step_size)
-                prop_interval = scale.interval(tune[i], prop_sp)
-                override_draw = random.random()
-                logging.debug(f'{prop_sp, prop_interval, override_draw}')
-
-                # If the previous and proposed intervals are in the 4/5 range
-                # with a chance of an override, go again
-                # If the proposed interval is a 2 or 7, always go again
-                # If the proposed note matches other notes, go again
-
-                a = (prev_interval in [4, 5] and prop_interval in [4, 5])
-                b = prop_interval in [2, 7]
-                c = prop_sp in [result[i - k] for k in [1, 2]]
-                logging.debug(f'decision: {a}, {b}, {c}')
-
-                if a or b or c:
-                    logging.info(f'go again')
-                    step_size += direction
-                    logging.debug(f'step_size: {step_size}')
-                else:
-                    logging.info('accepted proposal')
-                    result.append(prop_sp)
-                    prev_interval = prop_interval
-                    break
-
-    return result
-
+def real_cp2(scale, tune, rng=None):
+    # Bounded depth-first search; backtracks instead of widening the step until something fits
+    result = cs.search(scale, tune, rng=rng)
+    logging.info('searched %s nodes, complete: %s', result.nodes, result.complete)
+    if not result.lines:
+        raise ValueError(f'No counterpoint found for {tune}')
+    return result.lines[0].sps
 
-sm = cg.ScaleManager()
-cp_scale = sm.build_scale()
 
-midi_content = MIDIFile(2)
-midi_content.addTrackName(0, 0, 'cantus firmus')
-midi_content.addTrackName(1, 0, 'counterpoint')
+def write_counterpoint(path, cf_tune, *cp_tunes):
+    """Writes the cantus firmus and each counterpoint voice as a track, the counterpoint a sixteenth behind"""
+    tunes = [cf_tune, *cp_tunes]
+    notes = np.zeros(sum(len(t) for t in tunes), dtype=smf.NOTE_DTYPE)
+    notes['track'] = np.repeat(np.arange(len(tunes)), [len(t) for t in tunes])
+    notes['tick'] = np.concatenate([np.arange(len(t)) + (0.25 if v else 0) for v, t in enumerate(tunes)]) * \
+        smf.TICKS_PER_QUARTER
+    notes['pitch'] = np.concatenate([t.mps for t in tunes])
+    notes['velocity'] = 100
+    notes['duration'] = smf.TICKS_PER_QUARTER
 
-cf_tune = cg.Tune(cp_scale, ['C1', 'D1', 'F1', 'E1', 'F1', 'G1', 'A1', 'G1', 'E1', 'D1', 'C1'])
-cp_tune = cg.Tune(cp_scale, real_cp2(cp_scale, cf_tune))
+    names = ['counterpoint'] if len(cp_tunes) == 1 else [f'voice {v + 1}' for v in range(len(cp_tunes))]
+    with open(path, "wb+") as f:
+        f.write(smf.encode(notes, len(tunes), track_names=['cantus firmus'] + names))
 
-for i, v in enumerate(cf_tune.mps):
-    midi_content.addNote(0, 0, v, i, 1, 100)
 
-for i, v in enumerate(cp_tune.mps):
-    midi_content.addNote(1, 0, v, i + 0.25, 1, 100)
+if __name__ == '__main__':
+    sm = cg.ScaleManager()
+    cp_scale = sm.build_scale()
 
-with open('c:/temp/test.mid', "wb+") as f:
-    midi_content.writeFile(f)
-    midi_content.close()
+    cf_tune = cg.Tune(cp_scale, ['C1', 'D1', 'F1', 'E1', 'F1', 'G1', 'A1', 'G1', 'E1', 'D1', 'C1'])
+    cp_tune = cg.Tune(cp_scale, real_cp2(cp_scale, cf_tune, GenerationContext(0).voice_rng(1)))
+    write_counterpoint('test.mid', cf_tune, cp_tune)
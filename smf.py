@@ -0,0 +1,233 @@
+import numpy as np
+
+import instrumentation
+
+# Minimal Standard MIDI File (format 1) writer for flat note arrays.  All tracks are sorted and encoded in one
+# pass: every note becomes a NoteOn/NoteOff pair at least a tick apart, the pairs are ordered by (track, tick)
+# with NoteOffs first on a shared tick, and the delta times are variable length encoded with array operations.
+# read() goes the other way, for files from anywhere.
+
+NOTE_DTYPE = np.dtype([('track', np.int16),
+                       ('tick', np.int64),
+                       ('pitch', np.uint8),
+                       ('velocity', np.uint8),
+                       ('duration', np.int64)])
+
+TICKS_PER_QUARTER = 960
+
+NOTE_OFF = 0x80
+NOTE_ON = 0x90
+_END_OF_TRACK = b'\x00\xff\x2f\x00'
+# Delta times are variable length quantities of at most 4 bytes
+_MAX_DELTA = 1 << 28
+
+
+def to_ticks(events, ticks_per_quarter: int = TICKS_PER_QUARTER) -> np.ndarray:
+    """Converts engine events (times in quarter notes, see drum_engine.EVENT_DTYPE) to NOTE_DTYPE"""
+    notes = np.empty(len(events), dtype=NOTE_DTYPE)
+    notes['track'] = events['track']
+    notes['tick'] = np.rint(events['time'] * ticks_per_quarter)
+    notes['pitch'] = events['pitch']
+    notes['velocity'] = events['velocity']
+    notes['duration'] = np.maximum(0, np.rint(events['duration'] * ticks_per_quarter))
+    return notes
+
+
+def encode(notes: np.ndarray, num_tracks: int, ticks_per_quarter: int = TICKS_PER_QUARTER, track_names=None,
+           tempo: float = 120, channel: int = 0, buffer=None):
+    """
+    Encodes the notes as a format 1 Standard MIDI File: a tempo track followed by num_tracks note tracks.
+
+    :param notes: NOTE_DTYPE array, in any order
+    :param track_names: Optional names for the note tracks; a sequence or a dict keyed by track
+    :param buffer: Optional preallocated writable buffer (bytearray, memoryview, numpy array, ...) to encode into
+    :return: The encoded bytes, or the number of bytes written when a buffer is supplied
+    """
+    names = track_names or {}
+    names = names if isinstance(names, dict) else dict(enumerate(names))
+    notes = np.asarray(notes, dtype=NOTE_DTYPE)
+
+    body, bounds = _encode_events(notes, num_tracks, channel)
+    instrumentation.count('events emitted', 2 * len(notes))
+
+    usec_per_quarter = int(round(60_000_000 / tempo))
+    chunks = [_track_chunk(b'\x00\xff\x51\x03' + usec_per_quarter.to_bytes(3, 'big'), b'')]
+    for t in range(num_tracks):
+        name = str(names[t]).encode('utf-8') if t in names else b''
+        header = b'\x00\xff\x03' + _vlq(len(name)) + name if name else b''
+        chunks.append(_track_chunk(header, body[bounds[t]:bounds[t + 1]]))
+
+    head = b'MThd' + (6).to_bytes(4, 'big') + (1).to_bytes(2, 'big') + \
+        (num_tracks + 1).to_bytes(2, 'big') + ticks_per_quarter.to_bytes(2, 'big')
+    size = len(head) + sum(len(part) for chunk in chunks for part in chunk)
+
+    out = np.empty(size, dtype=np.uint8) if buffer is None else np.frombuffer(buffer, dtype=np.uint8, count=size)
+    pos = _put(out, 0, head)
+    for chunk in chunks:
+        for part in chunk:
+            pos = _put(out, pos, part)
+    return out.tobytes() if buffer is None else size
+
+
+def read(data, skip_channels=(9,)):
+    """
+    Decodes the notes of a Standard MIDI File (format 0, 1 or 2); the counterpart of encode.  NoteOns are paired
+    with the next NoteOff (or zero velocity NoteOn) of the same channel and pitch on the same track; notes still
+    sounding at the end of a track end there.
+
+    :param data: The file's bytes
+    :param skip_channels: Channels (0 based) to leave out; by default the General MIDI percussion channel
+    :return: NOTE_DTYPE array ordered by track, then by when each note ended, and the file's ticks per quarter
+    """
+    data = memoryview(data)
+    if bytes(data[:4]) != b'MThd':
+        raise ValueError('Not a Standard MIDI File')
+    header_len = int.from_bytes(data[4:8], 'big')
+    num_tracks = int.from_bytes(data[10:12], 'big')
+    division = int.from_bytes(data[12:14], 'big')
+    if division & 0x8000:
+        raise ValueError('SMPTE time division is not supported')
+
+    rows = []
+    pos = 8 + header_len
+    for track in range(num_tracks):
+        if bytes(data[pos:pos + 4]) != b'MTrk':
+            raise ValueError(f'Missing track chunk {track} at byte {pos}')
+        end = pos + 8 + int.from_bytes(data[pos + 4:pos + 8], 'big')
+        rows.extend(_read_track(data[pos + 8:end], track, skip_channels))
+        pos = end
+
+    return np.array(rows, dtype=NOTE_DTYPE), division
+
+
+def _read_track(data, track, skip_channels):
+    rows = []
+    sounding = {}
+    tick = pos = status = 0
+    while pos < len(data):
+        delta, pos = _read_vlq(data, pos)
+        tick += delta
+        byte = data[pos]
+        if byte == 0xFF:
+            # Meta event: type, length, data
+            length, pos = _read_vlq(data, pos + 2)
+            pos += length
+            continue
+        if byte in (0xF0, 0xF7):
+            length, pos = _read_vlq(data, pos + 1)
+            pos += length
+            status = 0
+            continue
+
+        if byte & 0x80:
+            status = byte
+            pos += 1
+        elif not status:
+            raise ValueError(f'Data byte without a status at byte {pos} of track {track}')
+        kind, channel = status & 0xF0, status & 0x0F
+        if kind in (0xC0, 0xD0):
+            pos += 1
+            continue
+        pitch, velocity = data[pos], data[pos + 1]
+        pos += 2
+        if kind not in (NOTE_OFF, NOTE_ON) or channel in skip_channels:
+            continue
+
+        key = (channel, pitch)
+        if kind == NOTE_ON and velocity:
+            sounding.setdefault(key, []).append((tick, velocity))
+        elif sounding.get(key):
+            start, on_velocity = sounding[key].pop(0)
+            rows.append((track, start, pitch, on_velocity, tick - start))
+
+    for (_, pitch), notes in sounding.items():
+        rows.extend((track, start, pitch, velocity, tick - start) for start, velocity in notes)
+    return rows
+
+
+def _read_vlq(data, pos):
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, pos
+
+
+def _encode_events(notes, num_tracks, channel):
+    """
+    Byte encoding of every NoteOn/NoteOff across all tracks, laid out track by track.
+    Returns the bytes and the offset at which each track starts.
+    """
+    n = len(notes)
+    tracks = np.concatenate([notes['track'], notes['track']]).astype(np.int64)
+    # A zero length note would have its NoteOff sorted ahead of its own NoteOn and be left sounding, so it lasts a tick
+    ticks = np.concatenate([notes['tick'], notes['tick'] + np.maximum(1, notes['duration'])])
+    kinds = np.repeat([1, 0], n)
+    statuses = np.repeat(np.array([NOTE_ON, NOTE_OFF], dtype=np.uint8) | channel, n)
+    pitches = np.concatenate([notes['pitch'], notes['pitch']])
+    velocities = np.concatenate([notes['velocity'], np.zeros(n, dtype=np.uint8)])
+
+    # One sort for everything; NoteOffs go first on a shared tick so that repeated hits don't cut each other off
+    order = np.lexsort((np.arange(2 * n), kinds, ticks, tracks))
+    tracks, ticks = tracks[order], ticks[order]
+
+    # Delta times restart at zero at the top of every track
+    track_starts = np.searchsorted(tracks, np.arange(num_tracks + 1))
+    prev = np.concatenate([[0], ticks[:-1]])
+    prev[track_starts[track_starts < len(ticks)]] = 0
+    deltas = ticks - prev
+
+    body, offsets = _pack(deltas, np.column_stack([statuses, pitches, velocities])[order])
+    return body, offsets[track_starts]
+
+
+def encode_messages(deltas, messages) -> np.ndarray:
+    """
+    Track chunk bytes for a run of channel messages: each delta time (in ticks, variable length encoded) followed
+    by its 3 byte message.
+
+    :param deltas: Ticks since the previous message
+    :param messages: (messages x 3) uint8 array of status, data 1 and data 2 bytes
+    """
+    return _pack(np.asarray(deltas, dtype=np.int64), np.asarray(messages, dtype=np.uint8))[0]
+
+
+def _pack(deltas, messages):
+    """Encoded bytes and the offset at which each message (delta time included) starts, plus the end"""
+    if len(deltas) and deltas.max() >= _MAX_DELTA:
+        raise ValueError(f'Delta time of {deltas.max()} ticks is past the largest a MIDI file holds ({_MAX_DELTA - 1})')
+    # Variable length quantities; 7 bits per byte, continuation bit on all but the last
+    num_bytes = 1 + (deltas >= 1 << 7) + (deltas >= 1 << 14) + (deltas >= 1 << 21)
+    offsets = np.concatenate([[0], np.cumsum(num_bytes + 3)])
+    body = np.empty(offsets[-1], dtype=np.uint8)
+    for k in range(4):
+        has = num_bytes > k
+        shift = 7 * (num_bytes[has] - 1 - k)
+        last = num_bytes[has] - 1 == k
+        body[offsets[:-1][has] + k] = ((deltas[has] >> shift) & 0x7F) | np.where(last, 0, 0x80)
+
+    msg = offsets[:-1] + num_bytes
+    for k in range(3):
+        body[msg + k] = messages[:, k]
+    return body, offsets
+
+
+def _track_chunk(header, events):
+    data_len = len(header) + len(events) + len(_END_OF_TRACK)
+    return b'MTrk' + data_len.to_bytes(4, 'big'), header, events, _END_OF_TRACK
+
+
+def _put(out, pos, data):
+    data = np.frombuffer(data, dtype=np.uint8) if isinstance(data, bytes) else data
+    out[pos:pos + len(data)] = data
+    return pos + len(data)
+
+
+def _vlq(value):
+    out = [value & 0x7F]
+    while value > 0x7F:
+        value >>= 7
+        out.append((value & 0x7F) | 0x80)
+    return bytes(reversed(out))
@@ -0,0 +1,24 @@
+import json
+
+import benchmarks
+
+
+def test_cases_build():
+    # Every case must set up and run once on its quick inputs
+    for c in benchmarks.CASES:
+        for param in c.quick_params:
+            c.setup(param)()
+
+
+def test_main_compare(tmp_path, capsys):
+    base = tmp_path / 'base.json'
+    assert benchmarks.main(['--quick', '-k', 'build_scale', '-o', str(base)]) == 0
+    results = json.loads(base.read_text())
+    assert set(results['results']) == {'build_scale[1]', 'build_scale[100]'}
+
+    # Pretend the base run was far faster so that the comparison flags it
+    for r in results['results'].values():
+        r['min'] /= 100
+    base.write_text(json.dumps(results))
+    assert benchmarks.main(['--quick', '-k', 'build_scale', '--compare', str(base)]) == 1
+    assert 'REGRESSION' in capsys.readouterr().out
@@ -0,0 +1,130 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import cli
+
+# Wall clock budget for `import cli`, including interpreter start up
+STARTUP_BUDGET = 0.5
+
+
+def _loaded_modules(statement):
+    code = f'{statement}; import sys; print(sorted(m for m in ("numpy", "pandas", "midiutil") if m in sys.modules))'
+    return subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout.strip()
+
+
+def test_imports_are_lazy():
+    assert _loaded_modules('import cli') == '[]'
+    assert _loaded_modules('import druumz2, scratch') == "['numpy']"
+
+
+def test_startup_budget():
+    def start():
+        t = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'import cli; cli.build_parser()'], check=True)
+        return time.perf_counter() - t
+    assert min(start() for _ in range(3)) < STARTUP_BUDGET
+
+
+def test_generate_drums(tmp_path, monkeypatch):
+    pytest.importorskip('xlsxwriter')
+    import druumz2
+    # Track names carry the time of the run
+    monkeypatch.setattr(druumz2, 'gmtime', lambda: time.gmtime(0))
+    workbook, stats = str(tmp_path / 'drums.xlsx'), str(tmp_path / 'stats.json')
+    assert cli.main(['init-workbook', workbook]) == 0
+
+    outputs = [str(tmp_path / f'drums_{i}.mid') for i in range(2)]
+    for out in outputs:
+        assert cli.main(['--stats', stats, 'generate-drums', workbook, '-p', '0', '0', '-o', out, '-s', '7']) == 0
+    assert open(outputs[0], 'rb').read() == open(outputs[1], 'rb').read()
+    assert '"workbook load"' in open(stats).read()
+
+
+def test_stream_drums(tmp_path):
+    pytest.importorskip('xlsxwriter')
+    workbook, out = str(tmp_path / 'drums.xlsx'), str(tmp_path / 'stream.mid')
+    assert cli.main(['init-workbook', workbook]) == 0
+    assert cli.main(['stream-drums', workbook, '-n', '4', '-o', out, '-s', '7', '--tempo', '90']) == 0
+    assert open(out, 'rb').read(4) == b'MThd'
+
+
+def test_generate_counterpoint(tmp_path, capsys):
+    out = str(tmp_path / 'cp.mid')
+    assert cli.main(['generate-counterpoint', 'C1', 'D1', 'F1', 'E1', 'D1', 'C1', '--n-best', '2', '-o', out]) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 2 and lines[0].startswith('C3')
+    assert open(out, 'rb').read(4) == b'MThd'
+
+
+def test_generate_counterpoint_no_cantus_firmus(capsys):
+    with pytest.raises(SystemExit) as e:
+        cli.main(['generate-counterpoint', '--n-best', '2'])
+    assert e.value.code == 2 and 'needs a cantus firmus' in capsys.readouterr().err
+
+
+def test_watch_drums(tmp_path):
+    import drum_config
+    import druumz2
+    config_path, out = str(tmp_path / 'drums.json'), str(tmp_path / 'watch.mid')
+    doc = {'drum_groups': [{'name': 'kick', 'track': 1, 'midi_pitch_set': [36], 'prob_pitch': [1.0]}],
+           'measures': {'0': {'pulse_times': [0, 1, 2, 3], 'prob_hit': [[1.0], [0.0], [1.0], [0.0]]}}}
+    drum_config.save_json(drum_config.from_document(doc), config_path)
+
+    sizes = []
+
+    def stop():
+        if os.path.exists(out):
+            sizes.append(os.path.getsize(out))
+            os.remove(out)
+            # Save an edit; the next check picks it up
+            doc['measures']['0']['prob_hit'] = [[1.0]] * 4
+            drum_config.save_json(drum_config.from_document(doc), config_path)
+            os.utime(config_path, ns=(0, len(sizes)))
+        return len(sizes) == 2
+
+    druumz2.watch_drum_track([0, 0], config_path, out, seed=1, interval=0, stop=stop)
+    assert sizes[1] > sizes[0]
+
+
+def test_check_counterpoint(tmp_path):
+    import json
+    src, batch, checked = tmp_path / 'cf.jsonl', str(tmp_path / 'cp.jsonl'), str(tmp_path / 'checked.jsonl')
+    src.write_text(json.dumps({'root': 'C', 'scale_type': 'Major', 'sps': ['C1', 'D1', 'F1', 'E1', 'D1', 'C1']}))
+    assert cli.main(['generate-counterpoint', '-i', str(src), '-o', batch, '-w', '0']) == 0
+    assert cli.main(['check-counterpoint', batch, '-o', checked, '--max-leap', '7']) == 0
+    assert 'violations' in json.loads(open(checked).read())['checks'][0]
+
+
+def test_generate_counterpoint_voices(tmp_path, capsys, caplog):
+    out = str(tmp_path / 'voices.mid')
+    cf = ['C1', 'D1', 'F1', 'E1', 'F1', 'G1', 'A1', 'G1', 'E1', 'D1', 'C1']
+    assert cli.main(['generate-counterpoint', *cf, '--voices', '3', '-o', out]) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 3 and all(len(line.split()) == len(cf) for line in lines)
+    assert not caplog.text
+    assert open(out, 'rb').read(4) == b'MThd'
+
+
+def test_generate_counterpoint_voices_dead_end(caplog):
+    # No voice can leap from above C2 to above A3 in one move
+    assert cli.main(['generate-counterpoint', 'C1', 'D1', 'A3', 'D1', 'C1', '--voices', '2']) == 0
+    assert 'No voices can follow the rules past note 2 of 5' in caplog.text
+    assert 'Budget' not in caplog.text
+
+
+def test_render_audio(tmp_path):
+    import drum_config
+    from testing_helpers import read_output, write_wav
+    config_path, out = str(tmp_path / 'drums.json'), str(tmp_path / 'drums.wav')
+    doc = {'drum_groups': [{'name': 'kick', 'track': 1, 'midi_pitch_set': [36], 'prob_pitch': [1.0], 'nudge': 2}],
+           'measures': {'0': {'pulse_times': [0, 1, 2, 3], 'prob_hit': [[1.0], [0.0], [1.0], [0.0]]}}}
+    drum_config.save_json(drum_config.from_document(doc), config_path)
+    write_wav(tmp_path / '36.wav', [0.5, 0.25])
+
+    assert cli.main(['render-audio', config_path, '-p', '0', '0', '-k', str(tmp_path), '-o', out, '-s', '3',
+                     '--swing', '0.6', '--humanize', '1']) == 0
+    assert (read_output(out) != 0).any()
@@ -0,0 +1,41 @@
+import json
+
+import counterpoint_batch as cb
+
+CANTUS_FIRMI = [cb.CantusFirmus('C', 'Major', ['C1', 'D1', 'F1', 'E1', 'F1', 'G1', 'A1', 'G1', 'E1', 'D1', 'C1']),
+                cb.CantusFirmus('D', 'Minor', ['D1', 'F1', 'E1', 'D1', 'G1', 'F1', 'A1', 'G1', 'F1', 'E1', 'D1']),
+                cb.CantusFirmus('G', 'Major', ['G1', 'A1', 'G1', 'B1', 'C1', 'B1', 'A1', 'G1'])] * 3
+
+
+def test_generate_batch_in_order():
+    results = list(cb.generate_batch(CANTUS_FIRMI, workers=0, n_best=2))
+    assert [r['index'] for r in results] == list(range(len(CANTUS_FIRMI)))
+    assert [r['root'] for r in results] == [cf.root for cf in CANTUS_FIRMI]
+    assert all(len(r['counterpoint']) == 2 for r in results)
+
+
+def test_generate_batch_reproducible():
+    serial = list(cb.generate_batch(CANTUS_FIRMI, workers=0, seed=5))
+    parallel = list(cb.generate_batch(CANTUS_FIRMI, workers=2, seed=5, chunksize=2))
+    assert serial == parallel
+
+
+def test_main(tmp_path):
+    src = tmp_path / 'cf.jsonl'
+    src.write_text('\n'.join(json.dumps(cf._asdict()) for cf in CANTUS_FIRMI[:2]))
+    dst = tmp_path / 'cp.jsonl'
+    cb.main([str(src), '-o', str(dst), '-w', '0'])
+    results = [json.loads(line) for line in dst.read_text().splitlines()]
+    assert [r['cantus_firmus'] for r in results] == [cf.sps for cf in CANTUS_FIRMI[:2]]
+
+
+def test_generate_batch_errors():
+    bad = [cb.CantusFirmus('C', 'Lydian', ['C1', 'D1', 'C1']), cb.CantusFirmus('C', 'Major', ['C1', 'Cs1', 'C1'])]
+    items = [CANTUS_FIRMI[0], *bad, CANTUS_FIRMI[1]]
+    for workers in (0, 2):
+        results = list(cb.generate_batch(items, workers=workers, chunksize=1))
+        assert [r['index'] for r in results] == [0, 1, 2, 3]
+        assert [('error' in r) for r in results] == [False, True, True, False]
+        assert results[1]['counterpoint'] == [] and 'Lydian' in results[1]['error']
+        assert 'Cs1' in results[2]['error']
+        assert results[3]['counterpoint']
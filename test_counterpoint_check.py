@@ -0,0 +1,123 @@
+import json
+
+import numpy as np
+import pytest
+
+import counterpoint_batch as cb
+import counterpoint_check as cc
+import counterpoint_search as cs
+import countpoint_generator as cg
+from tune_collection import TuneCollection
+
+CF = ['C1', 'D1', 'F1', 'E1', 'F1', 'G1', 'A1', 'G1', 'E1', 'D1', 'C1']
+
+
+@pytest.fixture(scope='module')
+def scale():
+    return cg.ScaleManager().build_scale()
+
+
+def positions(scale, *tunes):
+    return np.array([scale.sps_to_positions(t) for t in tunes])
+
+
+def test_search_output_passes(scale):
+    result = cs.search(scale, cg.Tune(scale, CF), n_best=3)
+    cps = positions(scale, *(ln.sps for ln in result.lines))
+    checked = cc.check(scale, positions(scale, *[CF] * len(cps)), cps, weights=np.zeros(len(cc.RULES)))
+
+    # Apart from the cadence the search doesn't insist on, its lines keep every rule it applies
+    assert passes_except(checked, cc.CADENCE).all()
+    # Same motion costs as the search gives them
+    assert checked.costs.tolist() == [ln.cost for ln in result.lines]
+
+
+def passes_except(result, rules):
+    return cc.passes(result, cc.ALL_RULES & ~rules)
+
+
+def test_rules(scale):
+    cf = ['C1', 'D1', 'E1', 'D1', 'C1']
+    lines = {
+        'good': ['C2', 'A1', 'G1', 'B1', 'C2'],
+        # G over C then A over D: fifths in a row
+        'parallel': ['G1', 'A1', 'G1', 'B1', 'C2'],
+        'octaves': ['C2', 'D2', 'G1', 'B1', 'C2'],
+        'crossing': ['C2', 'B0', 'G1', 'B1', 'C2'],
+        # F over E is a 2nd
+        'dissonance': ['C2', 'B1', 'F1', 'B1', 'C2'],
+        'leap': ['C2', 'B1', 'G1', 'B2', 'C3'],
+        'repeat': ['C2', 'B1', 'B1', 'B1', 'C2'],
+        'cadence': ['C2', 'B1', 'G1', 'A1', 'G1'],
+    }
+    result = cc.check(scale, positions(scale, *[cf] * len(lines)), positions(scale, *lines.values()))
+    counts = dict(zip(lines, result.counts.tolist()))
+
+    assert counts['good'] == [0] * len(cc.RULES)
+    for name in cc.RULES:
+        assert counts[name][cc.RULES.index(name)] > 0, name
+    assert counts['octaves'][cc.RULES.index('parallel')] == 1
+    assert counts['repeat'][cc.RULES.index('repeat')] == 2
+    assert cc.passes(result).tolist() == [True] + [False] * (len(lines) - 1)
+    assert cc.rank(result)[0] == 0
+
+    pairs, notes = cc.violations(result, cc.DISSONANCE)
+    assert list(zip(pairs.tolist(), notes.tolist())) == [(4, 2)]
+    pairs, notes = cc.violations(result, cc.CROSSING)
+    assert (3, 1) in zip(pairs.tolist(), notes.tolist())
+
+
+def test_rules_pitch_order():
+    # G major positions run G A B C D E F#: C1 sits below B1 and G2 is 20 semitones above B1
+    scale = cg.ScaleManager().build_scale('G', 'Major')
+    cf = ['G1', 'A1', 'B1', 'A1', 'G1']
+    lines = {'crossing': ['D2', 'C1', 'D2', 'B1', 'G2'], 'good': ['G2', 'C2', 'D2', 'Fs2', 'G2']}
+    result = cc.check(scale, positions(scale, *[cf] * len(lines)), positions(scale, *lines.values()))
+    counts = dict(zip(lines, (dict(zip(cc.RULES, c)) for c in result.counts.tolist())))
+
+    assert counts['crossing']['crossing'] == 1
+    assert counts['crossing']['leap'] == 2
+    assert counts['good'] == dict.fromkeys(cc.RULES, 0)
+
+    result = cc.check(scale, positions(scale, cf), positions(scale, lines['crossing']), max_leap=24)
+    assert result.counts[0, cc.RULES.index('leap')] == 0
+
+
+def test_ragged_collections(scale):
+    cfs = TuneCollection.from_sps(scale, [CF, ['E1', 'D1', 'C1'], ['C1']])
+    cps = TuneCollection.from_sps(scale, [['C2', 'B1', 'A1', 'G1', 'A1', 'B1', 'C2', 'B1', 'G1', 'B1', 'C2'],
+                                          ['G1', 'B1', 'C2'], ['C2']])
+    result = cc.check(scale, cfs, cps)
+    assert result.counts.shape == (3, len(cc.RULES))
+    # Rules never reach across from one pair into the next
+    assert result.flags[cfs.offsets[1:-1]].tolist() == [0, 0]
+    assert cc.passes(result).tolist()[1:] == [True, True]
+
+    with pytest.raises(ValueError):
+        cc.check(scale, cfs, TuneCollection.from_sps(scale, [CF, ['G1', 'B1'], ['C2']]))
+    with pytest.raises(ValueError):
+        cc.check(scale, positions(scale, CF), positions(scale, CF) + 100)
+
+
+def test_matches_batch(scale):
+    rng = np.random.default_rng(0)
+    cps = np.clip(scale['C2'] + np.cumsum(rng.integers(-2, 3, (500, 11)), axis=1), 0, len(scale) - 1)
+    cfs = np.tile(scale.sps_to_positions(CF), (500, 1))
+    batch = cc.check(scale, cfs, cps)
+    # Checking pairs one at a time gives the same answers
+    for i in rng.choice(500, 20, replace=False):
+        single = cc.check(scale, cfs[i:i + 1], cps[i:i + 1])
+        assert single.counts[0].tolist() == batch.counts[i].tolist()
+        assert single.scores[0] == batch.scores[i]
+
+
+def test_main(tmp_path):
+    src, mid, dst = tmp_path / 'cf.jsonl', tmp_path / 'cp.jsonl', tmp_path / 'checked.jsonl'
+    src.write_text(json.dumps({'root': 'C', 'scale_type': 'Major', 'sps': CF}) + '\n' +
+                   json.dumps({'root': 'G', 'scale_type': 'Major', 'sps': ['G1', 'A1', 'B1', 'A1', 'G1']}))
+    cb.main([str(src), '-o', str(mid), '-w', '0', '--n-best', '2'])
+    cc.main([str(mid), '-o', str(dst), '--chunk', '1'])
+    results = [json.loads(line) for line in dst.read_text().splitlines()]
+    assert [len(r['checks']) for r in results] == [len(r['counterpoint']) for r in results]
+    assert set(results[0]['checks'][0]['violations']) == set(cc.RULES)
+    assert results[0]['checks'][0]['score'] >= results[0]['costs'][0]
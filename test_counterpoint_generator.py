@@ -45,3 +45,76 @@ def test_tune():
     t = cg.Tune(s, sps)
     assert t.peak_sp() == 'C1'
     assert t.trough_sp() == 'A1'
+
+
+def test_pitch_lookups():
+    import countpoint_generator as cg
+    s = cg.ScaleManager().build_scale('D', 'Minor')
+    assert s.mp_to_sp(s.sp_to_mp('F3')) == 'F3'
+    assert s.sp_to_mp('D0') == 26
+    with pytest.raises(ValueError):
+        _ = s.sp_to_mp('Fs3')
+    with pytest.raises(ValueError):
+        _ = s.mp_to_sp(27)
+
+
+def test_build_scale_cached():
+    import countpoint_generator as cg
+    sm = cg.ScaleManager()
+    s = sm.build_scale('D', 'Minor')
+    assert sm.build_scale('D', 'Minor') is s
+    assert sm.table.shape == (12, 3, 88)
+    assert sm.table[2, 2, :7].tolist() == [s.sp_to_mp(sp) for sp in ['D0', 'E0', 'F0', 'G0', 'A0', 'As0', 'C0']]
+    with pytest.raises(KeyError):
+        sm.build_scale('D', 'Dorian')
+
+
+def test_tune_arrays():
+    import countpoint_generator as cg
+    s = cg.ScaleManager().build_scale()
+    t = cg.Tune(s, ['C1', 'D1', 'F1', 'E1', 'E1', 'C2'])
+    assert t.positions.tolist() == [7, 8, 10, 9, 9, 14]
+    assert t.mps.tolist() == [36, 38, 41, 40, 40, 48]
+    assert t.steps().tolist() == s.sps_to_steps(t.sps) == [1, 2, -1, 0, 5]
+    assert t.intervals().tolist() == [2, 3, 7, 1, 6]
+    assert t.directions().tolist() == [1, 1, -1, 0, 1]
+
+    u = cg.Tune.from_positions(s, t.positions)
+    assert u.sps == t.sps
+    assert u.trough_sp() == 'C2'
+
+
+def test_rule_table():
+    import countpoint_generator as cg
+    s = cg.ScaleManager().build_scale('A', 'Minor')
+    rules = s.rules
+    assert s.rules is rules
+    assert rules.intervals.shape == (len(s), len(s))
+    for cf, cp in [('C2', 'D3'), ('A1', 'E2'), ('G3', 'A1')]:
+        assert rules.intervals[s[cp], s[cf]] == s.interval(cf, cp)
+    assert not rules.consonant[s['D3'], s['C2']] and rules.consonant[s['E3'], s['C2']]
+    assert rules.perfect[s['E2'], s['A1']]
+    assert rules.parallel[5, 4] and not rules.parallel[5, 3]
+
+
+def test_tune_transforms():
+    import countpoint_generator as cg
+    sm = cg.ScaleManager()
+    s = sm.build_scale()
+    t = cg.Tune(s, ['C1', 'D1', 'F1', 'E1', 'C1'])
+    assert t.transpose(2).sps == ['E1', 'F1', 'A1', 'G1', 'E1']
+    assert t.invert().sps == ['C1', 'B0', 'G0', 'A0', 'C1']
+    assert t.invert('E1').positions.tolist() == (2 * s['E1'] - t.positions).tolist()
+    assert t.retrograde().sps == ['C1', 'E1', 'F1', 'D1', 'C1']
+    with pytest.raises(ValueError):
+        t.transpose(-10)
+
+    d = t.transpose_chromatic(2, sm)
+    assert d.scale is sm.build_scale('D') and d.sps == ['D1', 'E1', 'G1', 'Fs1', 'D1']
+    assert (d.mps - t.mps).tolist() == [2] * 5
+
+    minor = sm.build_scale('A', 'Minor')
+    assert t.remap(minor).sps == ['A1', 'B1', 'D1', 'C1', 'A1']
+    assert t.remap(sm.build_scale('C', 'Minor'), nearest=True).sps == ['C1', 'D1', 'F1', 'Ds1', 'C1']
+    with pytest.raises(ValueError):
+        t.remap(sm.build_scale('C', 'Chromatic'))
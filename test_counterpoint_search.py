@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+import countpoint_generator as cg
+import counterpoint_search as cs
+
+
+@pytest.fixture
+def scale():
+    return cg.ScaleManager().build_scale()
+
+
+@pytest.fixture
+def tune(scale):
+    return cg.Tune(scale, ['C1', 'D1', 'F1', 'E1', 'F1', 'G1', 'A1', 'G1', 'E1', 'D1', 'C1'])
+
+
+def test_search_rules(scale, tune):
+    result = cs.search(scale, tune, n_best=5)
+    assert result.complete
+    assert len(result.lines) == 5
+    assert [ln.cost for ln in result.lines] == sorted(ln.cost for ln in result.lines)
+
+    for line in result.lines:
+        assert line.sps[0] == line.sps[-1] == 'C3'
+        intervals = [scale.interval(cf, cp) for cf, cp in zip(tune.sps, line.sps)]
+        assert not set(intervals[1:-1]) & {2, 7}
+        assert all(not (a in (4, 5) and b in (4, 5)) for a, b in zip(intervals, intervals[1:-1]))
+        assert all(line.sps[i] not in line.sps[i - 2:i] for i in range(2, len(line.sps) - 1))
+
+
+def test_search_budget(scale):
+    positions = np.clip(14 + np.cumsum(np.random.default_rng(0).integers(-2, 3, 500)), 7, 30)
+    result = cs.search(scale, cg.Tune.from_positions(scale, positions), max_nodes=2000)
+    assert result.nodes <= 2000
+    assert not result.complete
+
+
+def test_no_solution(scale, tune):
+    result = cs.search(scale, tune, max_leap=1)
+    assert result.complete and not result.lines
+    with pytest.raises(ValueError):
+        cs.best_line(scale, tune, max_leap=1)
+
+
+def test_empty_cantus_firmus(scale):
+    with pytest.raises(ValueError, match='no notes'):
+        cs.search(scale, cg.Tune(scale, []))
+
+
+def test_seeded_ties(scale, tune):
+    a = cs.best_line(scale, tune, rng=np.random.default_rng(3))
+    b = cs.best_line(scale, tune, rng=np.random.default_rng(3))
+    assert a == b
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+import countpoint_generator as cg
+import counterpoint_voices as cv
+
+
+@pytest.fixture
+def scale():
+    return cg.ScaleManager().build_scale()
+
+
+@pytest.fixture
+def tune(scale):
+    return cg.Tune(scale, ['C1', 'D1', 'F1', 'E1', 'F1', 'G1', 'A1', 'G1', 'E1', 'D1', 'C1'])
+
+
+@pytest.mark.parametrize('num_voices', [2, 3])
+def test_search_rules(scale, tune, num_voices):
+    result = cv.search(scale, tune, num_voices=num_voices)
+    assert result.complete
+    assert len(result.voices) == num_voices
+    assert [v[0] for v in result.voices] == [v[-1] for v in result.voices] == ['C2', 'C3', 'C4'][:num_voices]
+
+    columns = np.array([[scale[sp] for sp in voice] for voice in [tune.sps] + result.voices]).T
+    rules = scale.rules
+    for prev, col in zip(columns[:-2], columns[1:-1]):
+        # Stacked without crossing, consonant throughout
+        assert (np.diff(scale.positions_to_mps(col)) > 0).all()
+        for a in range(len(col)):
+            for b in range(a + 1, len(col)):
+                assert rules.consonant[col[b], col[a]]
+                assert not rules.parallel[rules.intervals[prev[b], prev[a]], rules.intervals[col[b], col[a]]]
+                if a and b == a + 1:
+                    assert not rules.intervals[prev[b], prev[a]] == rules.intervals[col[b], col[a]] == 1
+
+
+def test_search_four_voices(scale, tune):
+    result = cv.search(scale, tune, num_voices=4)
+    assert result.complete
+    assert [v[0] for v in result.voices] == ['C2', 'C3', 'C4', 'C5']
+
+
+def test_search_pitch_order():
+    # Positions of G major run G A B C D E F#, so C sits below B in pitch despite its higher position
+    scale = cg.ScaleManager().build_scale('G', 'Major')
+    tune = cg.Tune(scale, ['G1', 'A1', 'B1', 'A1', 'C1', 'B1', 'A1', 'G1'])
+    result = cv.search(scale, tune, num_voices=3)
+    assert result.complete
+
+    columns = np.array([scale.sps_to_positions(voice) for voice in [tune.sps] + result.voices]).T
+    assert (np.diff(scale.positions_to_mps(columns), axis=1) > 0).all()
+
+
+def test_search_seeded(scale, tune):
+    a = cv.search(scale, tune, num_voices=3, beam_width=8, rng=np.random.default_rng(4))
+    b = cv.search(scale, tune, num_voices=3, beam_width=8, rng=np.random.default_rng(4))
+    assert a == b
+
+
+def test_search_budget(scale):
+    positions = np.clip(14 + np.cumsum(np.random.default_rng(0).integers(-2, 3, 300)), 7, 30)
+    tune = cg.Tune.from_positions(scale, positions)
+
+    result = cv.search(scale, tune, num_voices=3, max_nodes=50_000)
+    assert result.nodes <= 50_000
+    assert not result.complete and not result.dead_end
+    assert 1 < len(result.voices[0]) < len(tune)
+
+    result = cv.search(scale, tune, num_voices=3, time_budget=0)
+    assert not result.complete and len(result.voices[0]) == 1
+
+
+def test_search_dead_end(scale, tune):
+    # Moving a step at a time and never repeating, the voices soon run out of legal columns
+    result = cv.search(scale, tune, num_voices=2, max_leap=1)
+    assert not result.complete and result.dead_end
+    assert len(result.voices[0]) < len(tune)
+
+
+def test_search_empty_cantus_firmus(scale):
+    with pytest.raises(ValueError, match='no notes'):
+        cv.search(scale, cg.Tune(scale, []))
@@ -0,0 +1,143 @@
+import numpy as np
+import pytest
+
+import drum_audio as da
+import drum_engine as de
+from drum_config import DrumGroup
+from generation_context import GenerationContext
+from testing_helpers import RATE, events, read_output, write_float_wav, write_wav
+
+
+@pytest.fixture
+def kit(tmp_path):
+    write_wav(tmp_path / '36.wav', [1.0, 0.5, 0.25, 0.125])
+    write_wav(tmp_path / '44.wav', [[0.5, -0.5], [0.25, -0.25]])
+    return tmp_path
+
+
+@pytest.fixture
+def drum_groups():
+    return [DrumGroup('kick', 1, (36,), (1.0,), 0), DrumGroup('hat', 2, (44,), (1.0,), 0)]
+
+
+def test_read_wav(kit, tmp_path):
+    sample = da.read_wav(str(kit / '44.wav'))
+    assert isinstance(sample.frames, np.memmap) and sample.frames.shape == (2, 2) and sample.rate == RATE
+    assert np.allclose(sample.frames * sample.scale, [[0.5, -0.5], [0.25, -0.25]], atol=1e-4)
+
+    write_float_wav(tmp_path / 'float.wav', [0.5, -1.0, 0.25])
+    sample = da.read_wav(str(tmp_path / 'float.wav'))
+    assert sample.frames[:, 0].tolist() == [0.5, -1.0, 0.25] and sample.scale == 1.0
+
+    (tmp_path / 'bad.wav').write_bytes(b'RIFF\x04\x00\x00\x00AVI ')
+    with pytest.raises(ValueError):
+        da.read_wav(str(tmp_path / 'bad.wav'))
+
+
+def test_load_samples(kit, drum_groups, tmp_path):
+    samples = da.load_samples(drum_groups, str(kit))
+    assert sorted(samples) == [36, 44]
+    # One mapping per file however many pitches share it
+    shared = da.load_samples(drum_groups, {36: kit / '36.wav', 44: kit / '36.wav'})
+    assert shared[36] is shared[44]
+
+    with pytest.raises(ValueError, match='44'):
+        da.load_samples(drum_groups, {36: kit / '36.wav'})
+    write_wav(tmp_path / 'fast.wav', [1.0], rate=2 * RATE)
+    with pytest.raises(ValueError):
+        da.load_samples(drum_groups, {36: kit / '36.wav', 44: tmp_path / 'fast.wav'})
+
+
+@pytest.mark.parametrize('chunk_frames', [1, 3, 4096])
+def test_mix_events(kit, drum_groups, tmp_path, chunk_frames):
+    samples = da.load_samples(drum_groups, str(kit))
+    # At 60 bpm a quarter note is a second: RATE frames
+    e = events([0, 2 / RATE, 1], [36, 36, 44], [127, 127, 127], [0, 0, 1])
+    stats = da.mix_events(e, samples, str(tmp_path / 'out.wav'), tempo=60, pans=[-1, 0],
+                          chunk_frames=chunk_frames)
+    out = read_output(tmp_path / 'out.wav')
+    assert stats.frames == len(out) == RATE + 2 and stats.rate == RATE
+
+    # The kick is panned hard left; its two hits overlap and add, clipping where they go past full scale
+    assert np.allclose(out[:6, 0], [1.0, 0.5, 1.0, 0.625, 0.25, 0.125], atol=1e-3)
+    assert np.allclose(out[:RATE, 1], 0)
+    assert np.allclose(out[RATE:], [[0.5, -0.5], [0.25, -0.25]], atol=1e-3)
+    assert stats.clipped == 1 and stats.peak == pytest.approx(1.25, abs=1e-3)
+
+
+def test_mix_events_velocity_and_gain(kit, drum_groups, tmp_path):
+    samples = da.load_samples(drum_groups, str(kit))
+    da.mix_events(events([0], [36], [64], [0]), samples, str(tmp_path / 'out.wav'), gain=0.5)
+    out = read_output(tmp_path / 'out.wav')
+    assert np.allclose(out[:, 0], np.array([1.0, 0.5, 0.25, 0.125]) * 64 / 127 * 0.5, atol=1e-3)
+    assert np.allclose(out[:, 0], out[:, 1])
+
+    with pytest.raises(ValueError):
+        da.mix_events(events([0], [40], [64], [0]), samples, str(tmp_path / 'out.wav'))
+
+
+def test_render_audio(kit, drum_groups, tmp_path, monkeypatch):
+    measures = {0: (np.arange(8) / 2, np.tile([0.5, 25, 100, 1], (8, 2, 1)))}
+    paths = [str(tmp_path / f'{i}.wav') for i in range(2)]
+    stats = [da.render_audio(drum_groups, measures, [0, 0, 0], 2, 4, GenerationContext(4), str(kit), p, tempo=240,
+                             chunk_frames=chunk) for p, chunk in zip(paths, [512, 1 << 16])]
+    assert stats[0] == stats[1]
+    assert open(paths[0], 'rb').read() == open(paths[1], 'rb').read()
+
+    # Mixed as it is generated, each bar written out once the next is queued
+    written = []
+    add = da.Mixer.add
+    monkeypatch.setattr(da.Mixer, 'add', lambda self, e: written.append(self.written) or add(self, e))
+    da.render_audio(drum_groups, measures, [0] * 8, 2, 4, GenerationContext(4), str(kit), paths[0], tempo=240,
+                    chunk_frames=512)
+    assert len(written) == 8 and written == sorted(written) and written[-1] > 0
+
+    # One note per event of the matching MIDI render, each at its start frame
+    measure_events = de.generate_measures(drum_groups, measures, 2, GenerationContext(4))
+    e = de.track_events(drum_groups, measure_events, [0, 0, 0], 4)
+    da.render_audio(drum_groups, measures, [0, 0, 0], 2, 4, GenerationContext(4), str(kit), paths[0], tempo=240,
+                    chunk_frames=512)
+    out = read_output(paths[0])
+    starts = np.rint(e['time'] * 0.25 * RATE).astype(int)
+    assert len(out) == max(starts.max() + 4, 1)
+    assert (np.abs(out[starts]).sum(axis=1) > 0).all()
+
+
+def test_mix_events_dense(kit, drum_groups, tmp_path):
+    import time
+    samples = da.load_samples(drum_groups, str(kit))
+    # 4 s at 60 bpm, far more notes than the samples are long so that many of them overlap
+    rng = np.random.default_rng(0)
+    e = events(np.sort(rng.uniform(0, 4, 4000)), rng.choice([36, 44], 4000), rng.integers(1, 128, 4000),
+               rng.integers(0, 2, 4000))
+    t = time.perf_counter()
+    da.mix_events(e, samples, str(tmp_path / 'out.wav'), tempo=60, pans=[-0.5, 0.5], gain=0.01, chunk_frames=1000)
+    # Well inside the 4 s it lasts
+    assert time.perf_counter() - t < 1
+
+    # Against each note added in one at a time
+    expected = np.zeros((4 * RATE + 4, 2))
+    for note in e:
+        sample = samples[int(note['pitch'])]
+        pan = [-0.5, 0.5][note['group']]
+        start = int(np.rint(note['time'] * RATE))
+        level = note['velocity'] / 127 * 0.01 * sample.scale * np.array([min(1, 1 - pan), min(1, 1 + pan)])
+        expected[start:start + len(sample.frames)] += sample.frames * level
+    out = read_output(tmp_path / 'out.wav')
+    assert np.abs(out - expected[:len(out)]).max() < 1e-4
+
+
+def test_render_audio_groove(kit, drum_groups, tmp_path):
+    from groove import Groove
+    measures = {0: (np.arange(8) / 2, np.tile([0.5, 25, 100, 1], (8, 2, 1))), 1: (np.arange(4), np.ones((4, 2, 4)))}
+    g = Groove(swing=0.6, feel=[1, -1], humanize=1.0)
+    pattern = [0, 1, 0, 0, 1]
+    samples = da.load_samples(drum_groups, str(kit))
+    da.render_audio(drum_groups, measures, pattern, 2, 4, GenerationContext(6), samples, str(tmp_path / 'bars.wav'),
+                    groove=g, chunk_frames=100)
+
+    # The same as grooving and mixing the whole track at once
+    measure_events = de.generate_measures(drum_groups, measures, 2, GenerationContext(6))
+    e = de.track_events(drum_groups, measure_events, pattern, 4, g, GenerationContext(6).groove_rng())
+    da.mix_events(e, samples, str(tmp_path / 'whole.wav'))
+    assert (tmp_path / 'bars.wav').read_bytes() == (tmp_path / 'whole.wav').read_bytes()
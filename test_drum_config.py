@@ -0,0 +1,118 @@
+import os
+
+import pandas as pd
+import pytest
+
+import drum_config as dc
+
+
+@pytest.fixture
+def workbook(tmp_path):
+    path = str(tmp_path / 'drums.xlsx')
+    groups = [dc.DrumGroup('kick', 1, (36, 52), (0.5, 0.5), 1),
+              dc.DrumGroup('hat', 2, (44,), (1.0,), 2)]
+    with pd.ExcelWriter(path) as writer:
+        pd.DataFrame(groups).to_excel(writer, sheet_name=dc.MIDI_MAP_SHEET)
+        for i, prob_hit in enumerate([0.25, 0.75]):
+            row = dc.DrumChance(prob_hit)
+            pd.DataFrame([row * 2] * 16, index=[p / 4 for p in range(16)],
+                         columns=dc.DrumChance._fields * 2).to_excel(writer, sheet_name=f'{dc.HITS_SHEET}_{i}')
+    return path
+
+
+def test_read_workbook(workbook):
+    config = dc.read_workbook(workbook)
+    assert config.drum_tracks == {1, 2}
+    assert config.drum_groups[0] == dc.DrumGroup('kick', 1, (36, 52), (0.5, 0.5), 1)
+    assert sorted(config.measures) == [0, 1]
+    pulse_times, hits = config.measures[1]
+    assert pulse_times[:3].tolist() == [0, 0.25, 0.5]
+    assert hits.shape == (16, 2, 4)
+    assert hits[0, 1].tolist() == [0.75, 25, 100, 1]
+
+
+def test_load_workbook_cached(workbook, monkeypatch):
+    config = dc.load_workbook(workbook)
+    assert os.path.exists(workbook + '.npz')
+
+    # A second load must not go anywhere near pandas
+    monkeypatch.setattr(pd, 'read_excel', None)
+    cached = dc.load_workbook(workbook)
+    assert cached.drum_groups == config.drum_groups
+    assert cached.drum_tracks == config.drum_tracks
+    assert all((cached.measures[i][1] == config.measures[i][1]).all() for i in config.measures)
+
+
+def test_load_workbook_stale_cache(workbook, monkeypatch):
+    dc.load_workbook(workbook)
+    stat = os.stat(workbook)
+    os.utime(workbook, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    calls = []
+    read_workbook = dc.read_workbook
+    monkeypatch.setattr(dc, 'read_workbook', lambda path: calls.append(path) or read_workbook(path))
+    dc.load_workbook(workbook)
+    assert calls == [workbook]
+
+
+@pytest.mark.parametrize('damage', [b'', b'PK\x03\x04 not really a zip'])
+def test_load_workbook_damaged_cache(workbook, tmp_path, damage):
+    config = dc.load_workbook(workbook)
+    with open(workbook + '.npz', 'wb') as f:
+        f.write(damage)
+
+    # Read from the workbook again and the cache rebuilt in place, leaving no temporary files behind
+    assert dc.load_workbook(workbook).drum_groups == config.drum_groups
+    assert sorted(os.listdir(tmp_path)) == ['drums.xlsx', 'drums.xlsx.npz']
+    assert dc.load_workbook(workbook).drum_groups == config.drum_groups
+
+
+@pytest.mark.parametrize('dst', ['drums.json', 'drums.toml', 'csv'])
+def test_convert_round_trip(workbook, tmp_path, dst):
+    config = dc.convert(workbook, str(tmp_path / dst))
+    loaded = dc.load_config(str(tmp_path / dst))
+    assert loaded.drum_groups == config.drum_groups
+    assert loaded.drum_tracks == config.drum_tracks
+    for i, (pulse_times, hits) in config.measures.items():
+        assert (loaded.measures[i][0] == pulse_times).all()
+        assert (loaded.measures[i][1] == hits).all()
+
+
+def test_save_config_unknown_format(workbook, tmp_path):
+    config = dc.load_config(workbook)
+    with pytest.raises(ValueError, match='Unsupported'):
+        dc.save_config(config, str(tmp_path / 'out.xlsx'))
+    assert not os.path.exists(tmp_path / 'out.xlsx')
+
+    # An existing directory takes CSVs whatever its name
+    os.mkdir(tmp_path / 'kit.v2')
+    dc.save_config(config, str(tmp_path / 'kit.v2'))
+    assert dc.load_config(str(tmp_path / 'kit.v2')).drum_groups == config.drum_groups
+
+
+def test_json_defaults_and_validation(tmp_path):
+    doc = {'drum_groups': [{'name': 'kick', 'track': 1, 'midi_pitch_set': [36], 'prob_pitch': [1.0]}],
+           'measures': {'0': {'pulse_times': [0, 0.5], 'prob_hit': [[1.0], [0.5]]}}}
+    config = dc.from_document(doc)
+    assert config.drum_groups[0].nudge == 0
+    # Compiled for the engine as it loads
+    assert config.group_table.pitches.tolist() == [[36]] and config.group_table.tracks.tolist() == [0]
+    assert config.measures[0][1][1, 0].tolist() == [0.5, 25, 100, 1]
+
+    doc['drum_groups'][0]['prob_pitch'] = [0.5, 0.5]
+    with pytest.raises(ValueError):
+        dc.from_document(doc)
+
+    # Probabilities are checked at load time
+    doc['drum_groups'][0]['prob_pitch'] = [0.9]
+    with pytest.raises(ValueError, match='add up to'):
+        dc.from_document(doc)
+
+
+def test_native_formats_skip_pandas(workbook, tmp_path):
+    import subprocess
+    import sys
+    dc.convert(workbook, str(tmp_path / 'drums.json'))
+    code = f'import drum_config, sys; drum_config.load_config({str(tmp_path / "drums.json")!r}); ' \
+           f'print("pandas" in sys.modules)'
+    assert subprocess.run([sys.executable, '-c', code], capture_output=True, text=True).stdout.strip() == 'False'
@@ -0,0 +1,159 @@
+import numpy as np
+import pytest
+
+import drum_engine as de
+from drum_config import DrumGroup
+from generation_context import GenerationContext
+
+
+@pytest.fixture
+def drum_groups():
+    return [DrumGroup('kick', 1, (36, 52), (0.5, 0.5), 1),
+            DrumGroup('snare', 1, (40,), (1.0,), 0),
+            DrumGroup('hat', 2, (44,), (1.0,), 3)]
+
+
+def test_compile_drum_groups(drum_groups):
+    table = de.compile_drum_groups(drum_groups)
+    assert table.tracks.tolist() == [0, 0, 1]
+    assert table.pitches.tolist() == [[36, 52], [40, 40], [44, 44]]
+    assert table.sizes.tolist() == [2, 1, 1]
+    assert table.keep_probs[0].tolist() == [1.0, 1.0]
+
+
+@pytest.mark.parametrize('probs', [(), (0.5, 0.6), (1.2, -0.2), (float('nan'), 1.0), (0.5,)])
+def test_alias_table_rejects(probs):
+    with pytest.raises(ValueError):
+        de.alias_table(probs, 'kick')
+
+
+def test_compile_drum_groups_rejects(drum_groups):
+    with pytest.raises(ValueError):
+        de.compile_drum_groups(drum_groups + [DrumGroup('tom', 1, (45, 47), (1.0,), 0)])
+
+
+def test_pitch_sampler():
+    sampler = de.PitchSampler([36, 38, 40, 42], [0.1, 0.2, 0.0, 0.7])
+    pitches = sampler.draw(np.random.default_rng(3), 100_000)
+    counts = np.bincount(pitches, minlength=43)[[36, 38, 40, 42]] / len(pitches)
+    assert counts[2] == 0
+    assert np.allclose(counts, [0.1, 0.2, 0.0, 0.7], atol=0.01)
+    assert sampler.sample(0.0) in (36, 38, 42) and sampler.sample(0.999999) in (36, 38, 42)
+
+
+def test_hit_array(drum_groups):
+    sheet = np.arange(16 * 12).reshape(16, 12)
+    hits = de.hit_array(sheet, len(drum_groups))
+    assert hits.shape == (16, 3, de.NUM_CHANCE_FIELDS)
+    assert hits[1, 2].tolist() == [20, 21, 22, 23]
+
+
+def test_generate_measure_events(drum_groups):
+    pulse_times = np.arange(16) / 4
+    hits = np.tile([1.0, 25, 100, 1], (16, 3, 1))
+    hits[:, 1, de.PROB_HIT] = 0
+    events = de.generate_measure_events(drum_groups, pulse_times, hits, 4, np.random.default_rng(1))
+
+    # Every pulse hits for kick and hat, never for the snare
+    assert len(events) == 32
+    assert set(events['pitch'][::2]) <= {36, 52}
+    assert set(events['pitch'][1::2]) == {44}
+    assert events['velocity'].min() >= 25 and events['velocity'].max() <= 100
+    assert (events['time'] >= 0).all()
+
+    # Nudges are whole hundredths within the group's range
+    nudge = np.round(events['time'][2::2] - pulse_times[1:], 2)
+    assert ((nudge >= -0.01) & (nudge < 0.01)).all()
+
+
+def test_generate_measure_events_seeded(drum_groups):
+    hits = np.tile([0.5, 25, 100, 1], (32, 3, 1))
+    a = de.generate_measure_events(drum_groups, np.arange(32) / 8, hits, 8, np.random.default_rng(7))
+    b = de.generate_measure_events(drum_groups, np.arange(32) / 8, hits, 8, np.random.default_rng(7))
+    assert a.tobytes() == b.tobytes()
+
+
+def test_stitch_measures():
+    measures = [np.zeros(2, dtype=de.EVENT_DTYPE), np.zeros(1, dtype=de.EVENT_DTYPE)]
+    measures[0]['time'] = [0, 1.5]
+    measures[1]['pitch'] = 44
+    events = de.stitch_measures(measures, [0, 1, 0], 4).to_array()
+    events.sort(order='time')
+    assert events['time'].tolist() == [0, 1.5, 4, 8, 9.5]
+    assert events['pitch'].tolist() == [0, 0, 44, 0, 0]
+    assert measures[0]['time'].tolist() == [0, 1.5]
+
+
+def test_bar_events(drum_groups):
+    from groove import Groove
+    measures = de.generate_measures(drum_groups, {i: (np.arange(16) / 4, np.tile([0.5, 25, 100, 1], (16, 3, 1)))
+                                                  for i in range(2)}, 4, GenerationContext(2))
+    pattern = [0, 1, 1, 0]
+    events = de.track_events(drum_groups, measures, pattern, 4)
+    # Bar after bar
+    assert (np.diff(events['time'] // 4) >= 0).all()
+    assert len(events) == sum(len(measures[p]) for p in pattern)
+
+    # Humanized a bar at a time, the jitter comes out the same as for the whole track
+    g = Groove(swing=0.6, humanize=1.0)
+    whole = de.track_events(drum_groups, measures, pattern, 4, g, np.random.default_rng(3))
+    bars = list(de.bar_events(drum_groups, measures, pattern, 4, g, np.random.default_rng(3)))
+    assert len(bars) == 4 and np.concatenate(bars).tobytes() == whole.tobytes()
+    assert de.track_events(drum_groups, measures, [], 4).dtype == de.EVENT_DTYPE
+
+
+def test_generate_measures_parallel(drum_groups):
+    measures = {i: (np.arange(16) / 4, np.tile([0.5, 25, 100, 1], (16, 3, 1))) for i in range(4)}
+    serial = de.generate_measures(drum_groups, measures, 4, GenerationContext(11))
+    parallel = de.generate_measures(drum_groups, measures, 4, GenerationContext(11), workers=2)
+    assert sorted(serial) == sorted(parallel) == [0, 1, 2, 3]
+    assert all(serial[i].tobytes() == parallel[i].tobytes() for i in serial)
+
+
+def test_group_streams_independent(drum_groups):
+    ctx = GenerationContext(5)
+    hits = np.tile([0.5, 25, 100, 1], (16, 3, 1))
+    a = de.generate_measure_events(drum_groups, np.arange(16) / 4, hits, 4, ctx.group_rngs(0, 3))
+    hits[:, 2, de.PROB_HIT] = 1
+    b = de.generate_measure_events(drum_groups, np.arange(16) / 4, hits, 4, ctx.group_rngs(0, 3))
+
+    # Changing the hat's sheet leaves the kick and snare untouched
+    assert a[a['track'] == 0].tobytes() == b[b['track'] == 0].tobytes()
+    assert (b['track'] == 1).sum() == 16
+
+
+def test_incremental_renderer(drum_groups):
+    import instrumentation
+    measures = {i: (np.arange(16) / 4, np.tile([0.5, 25, 100, 1], (16, 3, 1))) for i in range(3)}
+    pattern = [0, 1, 2, 1]
+    renderer = de.IncrementalRenderer(4, 4, GenerationContext(3))
+
+    def render():
+        instrumentation.reset()
+        instrumentation.enable()
+        try:
+            content = renderer.render(drum_groups, measures, pattern)
+        finally:
+            instrumentation.disable()
+        assert content == de.render_track(drum_groups, measures, pattern, 4, 4, GenerationContext(3))
+        return instrumentation.report()['counters'].get('groups drawn', 0)
+
+    assert render() == 9
+    assert render() == 0
+
+    # One cell of one measure, then one drum group row
+    measures[1][1][5, 2, de.PROB_HIT] = 1
+    assert render() == 1
+    drum_groups[0] = drum_groups[0]._replace(nudge=2)
+    assert render() == 3
+
+
+def test_compiled_table_reused(drum_groups, monkeypatch):
+    measures = {i: (np.arange(16) / 4, np.tile([0.5, 25, 100, 1], (16, 3, 1))) for i in range(2)}
+    expected = de.render_track(drum_groups, measures, [0, 1, 0], 4, 4, GenerationContext(3))
+    table = de.compile_drum_groups(drum_groups)
+
+    # Given the table, no render compiles the groups again
+    monkeypatch.setattr(de, 'compile_drum_groups', None)
+    assert de.render_track(table, measures, [0, 1, 0], 4, 4, GenerationContext(3)) == expected
+    assert de.IncrementalRenderer(4, 4, GenerationContext(3)).render(table, measures, [0, 1, 0]) == expected
@@ -0,0 +1,138 @@
+import asyncio
+import io
+from itertools import cycle, islice
+
+import numpy as np
+import pytest
+
+import drum_engine as de
+import drum_stream as ds
+import smf
+from drum_config import DrumGroup
+from generation_context import GenerationContext
+from testing_helpers import read_tracks
+
+
+@pytest.fixture
+def drum_groups():
+    return [DrumGroup('kick', 1, (36, 52), (0.5, 0.5), 1),
+            DrumGroup('hat', 2, (44,), (1.0,), 3)]
+
+
+@pytest.fixture
+def measures():
+    hits = np.tile([0.6, 25, 100, 3], (16, 2, 1))
+    return {0: (np.arange(16) / 4, hits), 1: (np.arange(16) / 4, hits * [0.5, 1, 1, 1])}
+
+
+def stream(drum_groups, measures, pattern, sink, **kw):
+    return asyncio.run(ds.stream_drum_track(drum_groups, measures, pattern, sink, 4, 4, GenerationContext(5), **kw))
+
+
+def test_stream_matches_render(drum_groups, measures):
+    pattern = [0, 1, 1, 0, 1]
+    sink = ds.MemorySink()
+    stats = stream(drum_groups, measures, pattern, sink, lookahead=2)
+    assert sink.closed and stats.bars == len(sink.blocks) == 5
+
+    times = np.concatenate([b.times for b in sink.blocks])
+    messages = np.concatenate([b.messages for b in sink.blocks])
+    assert stats.messages == len(messages)
+    assert (np.diff(times) >= 0).all()
+
+    # Blocks cut at bar lines; overhanging NoteOffs move into the next block
+    for b in sink.blocks[:-1]:
+        assert (b.times >= b.start).all() and (b.times < b.start + 4).all()
+
+    # Same notes as the whole track rendered in one go
+    events = de.generate_measures(drum_groups, measures, 4, GenerationContext(5))
+    notes = de.stitch_measures(events, pattern, 4).to_array()
+    on = messages[:, 0] == smf.NOTE_ON
+    assert sorted(zip(times[on], messages[on, 1])) == sorted(zip(notes['time'], notes['pitch']))
+
+
+def test_stream_endless_pattern(drum_groups, measures):
+    class StopAfter(ds.MemorySink):
+        async def write(self, block):
+            await super().write(block)
+            if block.bar == 9:
+                raise KeyboardInterrupt
+
+    sink = StopAfter()
+    with pytest.raises(KeyboardInterrupt):
+        stream(drum_groups, measures, cycle([0, 1]), sink)
+    assert len(sink.blocks) == 10 and sink.closed
+
+
+def test_stream_producer_finished(drum_groups, measures):
+    class Failing(ds.MemorySink):
+        async def write(self, block):
+            raise OSError('device gone')
+
+    async def run():
+        with pytest.raises(OSError):
+            await ds.stream_drum_track(drum_groups, measures, cycle([0, 1]), Failing(), 4, 4, GenerationContext(5))
+        # The cancelled generator is waited for rather than left pending
+        return asyncio.all_tasks() - {asyncio.current_task()}
+
+    assert not asyncio.run(run())
+
+
+def test_bar_messages_zero_length():
+    events = np.zeros(2, dtype=de.EVENT_DTYPE)
+    events['pitch'], events['velocity'], events['time'] = 40, 90, [0, 1]
+    times, messages = ds.bar_messages(events, 4)
+    order = np.lexsort((messages[:, 0], times))
+    # Each note is switched on before it is switched off
+    assert messages[order, 0].tolist() == [smf.NOTE_ON, smf.NOTE_OFF] * 2
+    assert times[order].tolist() == [4, 4 + 1 / smf.TICKS_PER_QUARTER, 5, 5 + 1 / smf.TICKS_PER_QUARTER]
+
+
+def test_stream_lookahead_bounded(drum_groups, measures):
+    read = []
+
+    def pattern():
+        for bar in range(8):
+            read.append(bar)
+            yield 0
+
+    class Slow(ds.MemorySink):
+        async def write(self, block):
+            await asyncio.sleep(0.01)
+            # Queued bars, the bar waiting to be queued and the peeked measure id are all that is read ahead
+            assert len(read) - 1 - block.bar <= 2 + 2
+            await super().write(block)
+
+    stream(drum_groups, measures, pattern(), Slow(), lookahead=2)
+
+
+def test_stream_errors(drum_groups, measures):
+    with pytest.raises(KeyError):
+        stream(drum_groups, measures, [0, 3], ds.MemorySink())
+    with pytest.raises(ValueError):
+        stream(drum_groups, measures, [0], ds.MemorySink(), lookahead=0)
+
+
+def test_midi_byte_sink(drum_groups, measures):
+    memory, raw = ds.MemorySink(), io.BytesIO()
+    stream(drum_groups, measures, [0, 1], memory)
+    stream(drum_groups, measures, [0, 1], ds.MidiByteSink(raw))
+    assert raw.getvalue() == b''.join(b.messages.tobytes() for b in memory.blocks)
+
+    # Real time pacing: two bars at a very fast tempo
+    paced = io.BytesIO()
+    sink = ds.MidiByteSink(paced, tempo=6000)
+    stream(drum_groups, measures, [0, 1], sink)
+    assert paced.getvalue() == raw.getvalue()
+    assert sink.max_lateness < 0.5
+
+
+def test_smf_file_sink(drum_groups, measures, tmp_path):
+    path = tmp_path / 'stream.mid'
+    stats = stream(drum_groups, measures, list(islice(cycle([0, 1]), 8)), ds.SmfFileSink(str(path)))
+    content = path.read_bytes()
+    assert content[8:10] == (0).to_bytes(2, 'big')
+
+    tracks = read_tracks(content)
+    assert len(tracks) == 1 and tracks[0].endswith(b'\x00\xff\x2f\x00')
+    assert tracks[0].count(bytes([smf.NOTE_ON])) >= stats.messages // 2
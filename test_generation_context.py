@@ -0,0 +1,25 @@
+import numpy as np
+
+from generation_context import GenerationContext
+
+
+def test_reproducible():
+    a, b = GenerationContext(42), GenerationContext(42)
+    assert a.measure_rng(3).random() == b.measure_rng(3).random()
+    assert a.voice_rng(0).random() == b.voice_rng(0).random()
+    assert GenerationContext().seed != GenerationContext().seed
+
+
+def test_independent_streams():
+    ctx = GenerationContext(42)
+    draws = [ctx.measure_rng(0).random(), ctx.measure_rng(1).random(), ctx.voice_rng(0).random(),
+             ctx.item_rng(0).random()] + [g.random() for g in ctx.group_rngs(0, 3)]
+    assert len(set(draws)) == len(draws)
+
+
+def test_matches_spawn_tree():
+    measures, voices, _ = np.random.SeedSequence(7).spawn(3)
+    ctx = GenerationContext(7)
+    assert ctx.voice_rng(2).random() == np.random.default_rng(voices.spawn(3)[2]).random()
+    group = measures.spawn(2)[1].spawn(4)[3]
+    assert ctx.group_rngs(1, 4)[3].random() == np.random.default_rng(group).random()
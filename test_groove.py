@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+import drum_engine as de
+import groove
+from drum_config import DrumGroup
+from generation_context import GenerationContext
+
+
+@pytest.fixture
+def drum_groups():
+    return [DrumGroup('kick', 1, (36,), (1.0,), 2),
+            DrumGroup('hat', 2, (44,), (1.0,), 4)]
+
+
+def grid_events(num_bars=2, num_groups=2):
+    """A note on every eighth for each group, each lasting a sixteenth"""
+    times = np.arange(num_bars * 8) / 2
+    events = np.zeros(len(times) * num_groups, dtype=de.EVENT_DTYPE)
+    events['time'] = np.repeat(times, num_groups)
+    events['group'] = np.tile(np.arange(num_groups), len(times))
+    events['duration'] = 0.25
+    events['velocity'] = 100
+    return events
+
+
+def test_swing_times():
+    times = np.array([0, 0.25, 0.5, 0.75, 1, 1.5, 3.5])
+    assert np.allclose(groove.swing_times(times, 0.5), times)
+    assert np.allclose(groove.swing_times(times, 2 / 3), [0, 1 / 3, 2 / 3, 5 / 6, 1, 5 / 3, 11 / 3])
+    # Continuous and order preserving
+    fine = np.linspace(0, 4, 1001)
+    assert (np.diff(groove.swing_times(fine, 0.7)) > 0).all()
+    with pytest.raises(ValueError):
+        groove.swing_times(times, 1.0)
+
+
+def test_apply_groove_timing(drum_groups):
+    events = grid_events()
+    swung = groove.apply_groove(events, drum_groups, groove.Groove(swing=0.6, feel=[0, 1]), 4)
+    assert events['time'][1] == 0 and events['time'][3] == 0.5
+
+    kick, hat = swung[swung['group'] == 0], swung[swung['group'] == 1]
+    assert np.allclose(kick['time'][:4], [0, 0.6, 1, 1.6])
+    # The hat lays back by its nudge (4 hundredths); the whole note moves
+    assert np.allclose(hat['time'][:2], [0.04, 0.64])
+    assert np.allclose(hat['duration'], kick['duration'])
+    assert np.allclose(kick['duration'][:2], [0.3, 0.2])
+
+
+def test_apply_groove_templates_and_accents(drum_groups):
+    events = grid_events()
+    g = groove.Groove(templates=[[0, 0.01, -0.01, 0.02], [0, 0, 0, 0]], accents=[1.2, 0.5])
+    out = groove.apply_groove(events, drum_groups, g, 4)
+
+    kick = out[out['group'] == 0]
+    # Four template slots per bar (one per beat); eighths round to the nearest one
+    assert np.allclose(kick['time'][:8:2] - np.arange(4), [0, 0.01, -0.01, 0.02])
+    assert np.allclose(kick['time'][8::2] - np.arange(4, 8), [0, 0.01, -0.01, 0.02])
+    assert (out[out['group'] == 1]['time'] == events[events['group'] == 1]['time']).all()
+    # Two accent slots a bar, shared by every group: beats 4 and 1 lean on the downbeat, 2 and 3 on the half bar
+    beat = np.mod(events['time'], 4)
+    assert (out['velocity'][(beat < 1) | (beat >= 3)] == 120).all()
+    assert (out['velocity'][(beat >= 1) & (beat < 3)] == 50).all()
+
+    with pytest.raises(ValueError):
+        groove.apply_groove(events, drum_groups, groove.Groove(accents=np.ones((3, 4))), 4)
+
+
+def test_apply_groove_humanize(drum_groups):
+    events = grid_events(64)
+    g = groove.Groove(humanize=1.0)
+    a = groove.apply_groove(events, drum_groups, g, 4, np.random.default_rng(1))
+    b = groove.apply_groove(events, drum_groups, g, 4, np.random.default_rng(1))
+    assert a.tobytes() == b.tobytes()
+
+    jitter = a['time'] - events['time']
+    limits = np.where(events['group'] == 0, 0.02, 0.04)
+    assert (np.abs(jitter[events['time'] > 0]) <= limits[events['time'] > 0]).all()
+    # Every bar gets its own jitter, even though the grid repeats
+    assert not np.allclose(jitter[:16], jitter[16:32])
+
+
+def test_render_track_groove(drum_groups):
+    measures = {0: (np.arange(8) / 2, np.tile([1.0, 25, 100, 2], (8, 2, 1)))}
+    plain = de.render_track(drum_groups, measures, [0, 0], 2, 4, GenerationContext(2))
+    same = de.render_track(drum_groups, measures, [0, 0], 2, 4, GenerationContext(2), groove=groove.Groove())
+    swung = de.render_track(drum_groups, measures, [0, 0], 2, 4, GenerationContext(2),
+                            groove=groove.Groove(swing=0.6, humanize=1))
+    assert same == plain and swung != plain
+    assert swung == de.render_track(drum_groups, measures, [0, 0], 2, 4, GenerationContext(2),
+                                    groove=groove.Groove(swing=0.6, humanize=1))
@@ -0,0 +1,58 @@
+import json
+import pstats
+
+import pytest
+
+import countpoint_generator as cg
+import counterpoint_search as cs
+from instrumentation import Instrumentation, instruments
+
+
+@pytest.fixture
+def instr():
+    instr = Instrumentation()
+    yield instr
+    instr.disable()
+
+
+def test_disabled_is_a_no_op(instr):
+    with instr.stage('encode'):
+        instr.count('events emitted', 10)
+    assert instr.report() == {'stages': {}, 'counters': {}}
+
+
+def test_stages_and_counters(instr, tmp_path):
+    instr.enable()
+    for _ in range(3):
+        with instr.stage('encode'):
+            instr.count('events emitted', 10)
+    report = instr.report()
+    assert report['stages']['encode']['calls'] == 3
+    assert report['counters'] == {'events emitted': 30}
+
+    instr.dump_json(str(tmp_path / 'run.json'))
+    assert json.loads((tmp_path / 'run.json').read_text()) == report
+
+
+def test_profile(instr, tmp_path):
+    with pytest.raises(ValueError):
+        instr.dump_stats(str(tmp_path / 'run.prof'))
+    instr.enable(profile=True)
+    sum(range(1000))
+    instr.disable()
+    instr.dump_stats(str(tmp_path / 'run.prof'))
+    assert pstats.Stats(str(tmp_path / 'run.prof')).total_calls > 0
+
+
+def test_counterpoint_counters():
+    scale = cg.ScaleManager().build_scale()
+    tune = cg.Tune(scale, ['C1', 'D1', 'F1', 'E1', 'F1', 'G1', 'A1', 'G1', 'E1', 'D1', 'C1'])
+    instruments.reset()
+    instruments.enable()
+    try:
+        result = cs.search(scale, tune)
+    finally:
+        instruments.disable()
+    assert instruments.counters['candidates tried'] == result.nodes
+    assert instruments.counters['backtracks'] > 0
+    assert instruments.calls['counterpoint search'] == 1
@@ -0,0 +1,53 @@
+import json
+
+import numpy as np
+
+import midi_corpus
+import smf
+
+
+def write_midi(path, tracks):
+    """One track per list of MIDI pitches, a quarter note each"""
+    notes = np.zeros(sum(len(t) for t in tracks), dtype=smf.NOTE_DTYPE)
+    notes['track'] = np.repeat(np.arange(len(tracks)), [len(t) for t in tracks])
+    notes['tick'] = np.concatenate([np.arange(len(t)) * smf.TICKS_PER_QUARTER for t in tracks])
+    notes['pitch'] = np.concatenate(tracks)
+    notes['velocity'] = 100
+    notes['duration'] = smf.TICKS_PER_QUARTER
+    with open(path, 'wb') as f:
+        f.write(smf.encode(notes, len(tracks)))
+
+
+def test_melody_lines():
+    notes = np.zeros(5, dtype=smf.NOTE_DTYPE)
+    notes['tick'] = [0, 0, 10, 20, 30]
+    notes['pitch'] = [60, 64, 62, 60, 59]
+    notes['track'][4] = 1
+    lines = midi_corpus.melody_lines(notes)
+    assert [(t, p.tolist()) for t, p in lines] == [(0, [64, 62, 60]), (1, [59])]
+
+
+def test_read_tunes(tmp_path):
+    (tmp_path / 'sub').mkdir()
+    write_midi(tmp_path / 'sub' / 'a.mid', [[60, 62, 64, 65, 67, 69, 71, 72], [40, 41]])
+    write_midi(tmp_path / 'b.MID', [[57, 59, 60, 62, 64, 65, 68, 57]])
+    (tmp_path / 'broken.mid').write_bytes(b'MThd')
+    (tmp_path / 'notes.txt').write_text('not midi')
+
+    lines = list(midi_corpus.read_tunes(str(tmp_path), min_notes=4))
+    assert [(line.path.endswith(name), line.track) for line, name in zip(lines, ['b.MID', 'a.mid'])] == \
+        [(True, 1), (True, 1)]
+    assert lines[0].tune.scale.name == 'A_Minor'
+    # G sharp isn't in A minor; it snaps to the nearest note that is
+    assert lines[0].tune.sps == ['A2', 'B2', 'C3', 'D3', 'E3', 'F3', 'G3', 'A2']
+    assert lines[1].tune.scale.name == 'C_Major'
+    assert lines[1].tune.mps.tolist() == [60, 62, 64, 65, 67, 69, 71, 72]
+
+
+def test_main(tmp_path):
+    write_midi(tmp_path / 'a.mid', [[60, 62, 64, 65, 67, 69, 71, 72]])
+    out = tmp_path / 'cf.jsonl'
+    midi_corpus.main([str(tmp_path), '-o', str(out), '--max-notes', '4', '--min-notes', '4'])
+    items = [json.loads(line) for line in out.read_text().splitlines()]
+    assert [item['sps'] for item in items] == [['C3', 'D3', 'E3', 'F3'], ['G3', 'A3', 'B3', 'C4']]
+    assert items[0]['root'] == 'C' and items[0]['scale_type'] == 'Major'
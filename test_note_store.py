@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from note_store import NoteStore, NOTE_DTYPE
+
+
+@pytest.fixture
+def measure():
+    return NoteStore.from_records([(0, 0, 36, 0.0, 0.25, 100),
+                                   (1, 0, 44, 0.5, 0.25, 80)])
+
+
+def test_from_records(measure):
+    notes = measure.to_array()
+    assert notes.dtype == NOTE_DTYPE
+    assert notes['pitch'].tolist() == [36, 44]
+    assert len(measure) == 2
+
+
+def test_repeat_and_shift(measure):
+    phrase = measure.repeat(3, 4).shift(8)
+    assert len(phrase) == 6
+    assert phrase.to_array()['time'].tolist() == [8, 8.5, 12, 12.5, 16, 16.5]
+    assert measure.to_array()['time'].tolist() == [0, 0.5]
+
+
+def test_shares_notes(measure):
+    # Repeats are offsets over the same block of notes, which is read only
+    song = measure.repeat(100, 4) + measure.shift(400)
+    assert len({id(notes.base) for notes, _ in song._segments}) == 1
+    with pytest.raises(ValueError):
+        song._segments[0][0]['pitch'] = 0
+
+
+def test_concat():
+    empty = NoteStore.from_records([])
+    assert len(empty) == 0
+    assert len(NoteStore()) == 0 and len(NoteStore().to_array()) == 0
+
+    other = NoteStore(np.zeros(1, dtype=NOTE_DTYPE), offsets=[1, 2])
+    assert NoteStore.concat([empty, other]).to_array()['time'].tolist() == [1, 2]
+
+
+def test_empty_keeps_dtype(measure):
+    import drum_engine
+    dtype = np.dtype([('time', np.float64), ('pitch', np.uint8)])
+    assert NoteStore(dtype=dtype).to_array().dtype == dtype
+    assert NoteStore(np.zeros(0, dtype=dtype)).repeat(3, 4).to_array().dtype == dtype
+    assert NoteStore.concat([], dtype=dtype).to_array().dtype == dtype
+    assert NoteStore.concat([NoteStore(dtype=dtype), measure]).to_array().dtype == NOTE_DTYPE
+
+    events = drum_engine.stitch_measures({0: np.zeros(2, dtype=drum_engine.EVENT_DTYPE)}, [], 4).to_array()
+    assert len(events) == 0 and events.dtype == drum_engine.EVENT_DTYPE
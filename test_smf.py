@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+import drum_engine
+import smf
+from testing_helpers import read_tracks
+
+
+@pytest.fixture
+def notes():
+    n = np.zeros(4, dtype=smf.NOTE_DTYPE)
+    n['track'] = [1, 0, 0, 1]
+    n['tick'] = [0, 480, 0, 200000]
+    n['pitch'] = [36, 40, 40, 44]
+    n['velocity'] = [100, 90, 80, 70]
+    n['duration'] = [240, 240, 480, 240]
+    return n
+
+
+def test_encode_header(notes):
+    content = smf.encode(notes, 2)
+    assert content[:14] == b'MThd\x00\x00\x00\x06\x00\x01\x00\x03\x03\xc0'
+    assert len(read_tracks(content)) == 3
+
+
+def test_encode_events(notes):
+    tempo, first, second = read_tracks(smf.encode(notes, 2, track_names=['kick']))
+    assert tempo == b'\x00\xff\x51\x03\x07\xa1\x20\x00\xff\x2f\x00'
+    assert first == (b'\x00\xff\x03\x04kick'
+                     b'\x00\x90\x28\x50'          # on at 0
+                     b'\x83\x60\x80\x28\x00'      # off at 480, before the next on at the same tick
+                     b'\x00\x90\x28\x5a'
+                     b'\x81\x70\x80\x28\x00'
+                     b'\x00\xff\x2f\x00')
+    # 199760 ticks needs a three byte delta
+    assert second[4:13] == b'\x81\x70\x80\x24\x00\x8c\x98\x50\x90'
+
+
+def test_encode_zero_length():
+    # Its NoteOff comes a tick after its NoteOn rather than ahead of it, which would leave the note sounding
+    n = np.zeros(1, dtype=smf.NOTE_DTYPE)
+    n['pitch'], n['velocity'] = 40, 90
+    _, track = read_tracks(smf.encode(n, 1))
+    assert track == b'\x00\x90\x28\x5a\x01\x80\x28\x00\x00\xff\x2f\x00'
+
+
+def test_encode_delta_too_long(notes):
+    # The previous event on the track is the NoteOff at tick 240
+    notes['tick'][3] = 240 + (1 << 28)
+    with pytest.raises(ValueError, match='Delta time'):
+        smf.encode(notes, 2)
+    with pytest.raises(ValueError):
+        smf.encode_messages([1 << 28], [[0x90, 36, 100]])
+
+
+def test_encode_into_buffer(notes):
+    content = smf.encode(notes, 2)
+    buffer = bytearray(len(content) + 10)
+    assert smf.encode(notes, 2, buffer=buffer) == len(content)
+    assert bytes(buffer[:len(content)]) == content
+
+
+def test_to_ticks():
+    events = np.zeros(2, dtype=drum_engine.EVENT_DTYPE)
+    events['time'] = [0.25, 1.01]
+    events['duration'] = [0.25, -0.01]
+    notes = smf.to_ticks(events)
+    assert notes['tick'].tolist() == [240, 970]
+    assert notes['duration'].tolist() == [240, 0]
+
+
+def test_read_round_trip(notes):
+    read, ticks_per_quarter = smf.read(smf.encode(notes, 2, track_names=['a', 'b']))
+    assert ticks_per_quarter == smf.TICKS_PER_QUARTER
+    # Chunk 0 of an encoded file is the tempo track
+    read['track'] -= 1
+    order = ['track', 'tick', 'pitch']
+    assert np.sort(read, order=order).tolist() == np.sort(notes, order=order).tolist()
+
+
+def test_read_running_status():
+    track = bytes([0x00, 0xC0, 0x05,              # program change
+                   0x00, 0x90, 60, 100,           # NoteOn
+                   0x60, 62, 90,                  # running status NoteOn
+                   0x60, 60, 0,                   # running status NoteOn, velocity 0 ends the first note
+                   0x00, 0x99, 36, 100,           # percussion, skipped
+                   0x00, 0xFF, 0x2F, 0x00])       # end of track; the second note is still sounding
+    data = b'MThd' + bytes([0, 0, 0, 6, 0, 0, 0, 1, 0, 96]) + b'MTrk' + len(track).to_bytes(4, 'big') + track
+    read, ticks_per_quarter = smf.read(data)
+    assert ticks_per_quarter == 96
+    assert read[['tick', 'pitch', 'velocity', 'duration']].tolist() == [(0, 60, 100, 192), (96, 62, 90, 96)]
+    with pytest.raises(ValueError):
+        smf.read(b'RIFF' + data[4:])
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+import countpoint_generator as cg
+from tune_collection import TuneCollection
+
+TUNES = [['C1', 'D1', 'F1', 'E1', 'F1', 'G1', 'A1', 'G1', 'E1', 'D1', 'C1'],
+         ['G2'],
+         ['E1', 'E1', 'C2', 'B1', 'B1', 'D2']]
+
+
+@pytest.fixture
+def scale():
+    return cg.ScaleManager().build_scale()
+
+
+@pytest.fixture
+def tunes(scale):
+    return TuneCollection.from_sps(scale, TUNES)
+
+
+def test_layout(scale, tunes):
+    assert len(tunes) == 3
+    assert tunes.lengths.tolist() == [11, 1, 6]
+    assert [t.sps for t in tunes] == TUNES
+    assert tunes[2].mps.tolist() == cg.Tune(scale, TUNES[2]).mps.tolist()
+    with pytest.raises(ValueError):
+        TuneCollection(scale, [1, 2], [0, 2, 2])
+
+
+def test_stats_match_tunes(scale, tunes):
+    singles = [cg.Tune(scale, sps) for sps in TUNES]
+    assert tunes.peak_sps() == [t.peak_sp() for t in singles]
+    assert tunes.trough_sps() == [t.trough_sp() for t in singles]
+    assert tunes.lowest().tolist() == [t.positions.min() for t in singles]
+    assert tunes.highest().tolist() == [t.positions.max() for t in singles]
+    assert tunes.ranges().tolist() == [9, 0, 10]
+
+    histograms = tunes.step_histograms(max_step=3)
+    assert histograms.sum(axis=1).tolist() == [10, 0, 5]
+    assert histograms[2].tolist() == [0, 0, 1, 2, 0, 1, 1]
+    assert tunes.direction_changes().tolist() == [3, 0, 2]
+    for counts, t in zip(tunes.interval_counts(), singles):
+        assert counts.tolist() == np.bincount(t.intervals() - 1, minlength=7).tolist()
+
+
+def test_save_load(scale, tunes, tmp_path):
+    path = str(tmp_path / 'tunes.npz')
+    tunes.save(path)
+    loaded = TuneCollection.load(path)
+    assert loaded.scale.name == scale.name
+    assert loaded.positions.tolist() == tunes.positions.tolist()
+    assert loaded.offsets.tolist() == tunes.offsets.tolist()
+
+
+def test_save_load_rootless(tmp_path):
+    sm = cg.ScaleManager()
+    scale = sm.build_scale(None, 'Chromatic')
+    tunes = TuneCollection.from_sps(scale, [['C1', 'Cs1', 'Fs2'], ['B0']])
+    path = str(tmp_path / 'chromatic.npz')
+    tunes.save(path)
+
+    loaded = TuneCollection.load(path, sm)
+    assert loaded.scale is scale and loaded.scale.root_note is None
+    assert [t.sps for t in loaded] == [['C1', 'Cs1', 'Fs2'], ['B0']]
+    assert TuneCollection.load(path).scale.name == 'Chromatic'
+    with pytest.raises(ValueError, match='no root'):
+        sm.build_scale('', 'Major')
+
+
+def test_transforms_match_tunes(scale, tunes):
+    sm = cg.ScaleManager()
+    singles = [cg.Tune(scale, sps) for sps in TUNES]
+    cases = [(tunes.transpose([1, -2, 3]), [t.transpose(s) for t, s in zip(singles, [1, -2, 3])]),
+             (tunes.invert(), [t.invert() for t in singles]),
+             (tunes.retrograde(), [t.retrograde() for t in singles]),
+             (tunes.transpose_chromatic(-3, sm), [t.transpose_chromatic(-3, sm) for t in singles]),
+             (tunes.remap(sm.build_scale('E', 'Minor')), [t.remap(sm.build_scale('E', 'Minor')) for t in singles])]
+    for batch, expected in cases:
+        assert [t.sps for t in batch] == [t.sps for t in expected]
+    with pytest.raises(ValueError):
+        tunes.transpose(-20)
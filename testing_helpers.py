@@ -0,0 +1,55 @@
+# Helpers shared by the test modules, kept out of any one of them so every test file runs on its own.  Not a test
+# module itself: pytest only collects test_*.py.
+import wave
+
+import numpy as np
+
+import drum_engine
+
+# Frame rate of the WAV files written for tests
+RATE = 8000
+
+
+def write_wav(path, data, rate=RATE):
+    """16 bit PCM; data is (frames) or (frames x channels) in [-1, 1]"""
+    data = np.asarray(data, dtype=np.float64).reshape(len(data), -1)
+    with wave.open(str(path), 'wb') as f:
+        f.setnchannels(data.shape[1])
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(np.rint(data * 32767).astype('<i2').tobytes())
+
+
+def write_float_wav(path, data, rate=RATE):
+    """Mono 32 bit float in a WAVE_FORMAT_EXTENSIBLE file, with an extra chunk ahead of the data"""
+    data = np.asarray(data, dtype='<f4').tobytes()
+    fmt = (0xFFFE).to_bytes(2, 'little') + (1).to_bytes(2, 'little') + rate.to_bytes(4, 'little') + \
+        (4 * rate).to_bytes(4, 'little') + (4).to_bytes(2, 'little') + (32).to_bytes(2, 'little') + \
+        (22).to_bytes(2, 'little') + bytes(6) + (3).to_bytes(2, 'little') + bytes(14)
+    body = b'WAVE' + b'fmt ' + len(fmt).to_bytes(4, 'little') + fmt + b'LIST' + (3).to_bytes(4, 'little') + \
+        b'abc\x00' + b'data' + len(data).to_bytes(4, 'little') + data
+    path.write_bytes(b'RIFF' + len(body).to_bytes(4, 'little') + body)
+
+
+def read_output(path):
+    with wave.open(str(path), 'rb') as f:
+        assert f.getnchannels() == 2 and f.getsampwidth() == 2
+        return np.frombuffer(f.readframes(f.getnframes()), dtype='<i2').reshape(-1, 2) / 32767
+
+
+def read_tracks(content):
+    """Splits an SMF into its track chunks"""
+    tracks, pos = [], 14
+    while pos < len(content):
+        assert content[pos:pos + 4] == b'MTrk'
+        size = int.from_bytes(content[pos + 4:pos + 8], 'big')
+        tracks.append(content[pos + 8:pos + 8 + size])
+        pos += 8 + size
+    return tracks
+
+
+def events(times, pitches, velocities, groups):
+    """drum_engine events from columns of fields"""
+    e = np.zeros(len(times), dtype=drum_engine.EVENT_DTYPE)
+    e['time'], e['pitch'], e['velocity'], e['group'] = times, pitches, velocities, groups
+    return e
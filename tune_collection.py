@@ -0,0 +1,175 @@
+from itertools import chain
+
+import numpy as np
+
+import countpoint_generator as cg
+
+# Many tunes over one scale held as a single flat array of scale positions plus offsets (tune i is
+# positions[offsets[i]:offsets[i + 1]]).  Per-tune statistics are worked out for the whole collection at once with
+# reduceat / bincount over the flat array, and the collection saves to an .npz holding little more than one byte
+# per note.
+
+_FORMAT_VERSION = 1
+
+
+class TuneCollection:
+
+    def __init__(self, scale, positions, offsets):
+        """
+        :param positions: Scale positions of every note, tune after tune
+        :param offsets: Start of each tune in positions, plus the end of the last one
+        """
+        self.scale = scale
+        self.positions = np.asarray(positions, dtype=np.int16)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        if len(self.offsets) == 0 or self.offsets[0] != 0 or self.offsets[-1] != len(self.positions):
+            raise ValueError('offsets must run from 0 to the number of notes')
+        if (np.diff(self.offsets) <= 0).any():
+            raise ValueError('Every tune needs at least one note')
+        self._mps = None
+
+    @classmethod
+    def from_positions(cls, scale, tunes):
+        """From a sequence of position arrays, one per tune"""
+        lengths = [len(t) for t in tunes]
+        positions = np.concatenate(tunes) if tunes else np.empty(0, dtype=np.int16)
+        return cls(scale, positions, np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)]))
+
+    @classmethod
+    def from_sps(cls, scale, tunes):
+        """From a sequence of tunes given as scientific pitches (or Tunes)"""
+        lengths = [len(t) for t in tunes]
+        positions = scale.sps_to_positions(list(chain.from_iterable(
+            t.sps if isinstance(t, cg.Tune) else t for t in tunes)))
+        return cls(scale, positions, np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)]))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return cg.Tune.from_positions(self.scale, self.positions[self.offsets[i]:self.offsets[i + 1]])
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    @property
+    def mps(self):
+        """MIDI pitch of every note, laid out like positions"""
+        if self._mps is None:
+            self._mps = self.scale.positions_to_mps(self.positions)
+        return self._mps
+
+    def _tune_ids(self, length=None):
+        return np.repeat(np.arange(len(self)), self.lengths if length is None else length)
+
+    def _steps(self):
+        """Steps between consecutive notes of the same tune, and the tune each step belongs to"""
+        steps = np.diff(self.positions.astype(np.int64))
+        within = np.ones(len(steps), dtype=bool)
+        within[self.offsets[1:-1] - 1] = False
+        return steps[within], self._tune_ids(self.lengths - 1)
+
+    def lowest(self):
+        """Lowest scale position of each tune"""
+        return np.minimum.reduceat(self.positions, self.offsets[:-1])
+
+    def highest(self):
+        """Highest scale position of each tune"""
+        return np.maximum.reduceat(self.positions, self.offsets[:-1])
+
+    def ranges(self):
+        """Span of each tune in semitones"""
+        return np.maximum.reduceat(self.mps, self.offsets[:-1]) - np.minimum.reduceat(self.mps, self.offsets[:-1])
+
+    def _extreme_idxs(self, sign):
+        # First note of each tune when ordered by tune, then by (signed) MIDI pitch; same pick as argmin/argmax
+        order = np.lexsort((sign * self.mps, self._tune_ids()))
+        return order[self.offsets[:-1]]
+
+    def peak_sps(self):
+        """Same as Tune.peak_sp for every tune"""
+        return self.scale.positions_to_sps(self.positions[self._extreme_idxs(1)])
+
+    def trough_sps(self):
+        """Same as Tune.trough_sp for every tune"""
+        return self.scale.positions_to_sps(self.positions[self._extreme_idxs(-1)])
+
+    def step_histograms(self, max_step: int = 7):
+        """
+        (tunes x (2 * max_step + 1)) counts of each step, from -max_step to max_step.  Larger steps are counted
+        in the outermost columns.
+        """
+        steps, ids = self._steps()
+        width = 2 * max_step + 1
+        bins = ids * width + np.clip(steps, -max_step, max_step) + max_step
+        return np.bincount(bins, minlength=len(self) * width).reshape(len(self), width)
+
+    def direction_changes(self):
+        """Number of times each tune turns around, up to down or down to up; repeated notes don't count"""
+        steps, ids = self._steps()
+        moving = steps != 0
+        directions, ids = np.sign(steps[moving]), ids[moving]
+        turns = (directions[1:] != directions[:-1]) & (ids[1:] == ids[:-1])
+        return np.bincount(ids[1:][turns], minlength=len(self))
+
+    def interval_counts(self):
+        """(tunes x notes in the scale) counts of the rotating interval (see Scale.interval) of each step"""
+        steps, ids = self._steps()
+        num_notes = len(self.scale.notes)
+        bins = ids * num_notes + steps % num_notes
+        return np.bincount(bins, minlength=len(self) * num_notes).reshape(len(self), num_notes)
+
+    # Batched versions of the Tune transforms.  Amounts and axes are either one value for every tune or one per tune
+
+    def _per_note(self, values):
+        return np.repeat(np.broadcast_to(np.asarray(values, dtype=np.int64), len(self)), self.lengths)
+
+    def _with(self, scale, positions):
+        return TuneCollection(scale, scale.check_positions(positions), self.offsets)
+
+    def transpose(self, steps):
+        return self._with(self.scale, self.positions + self._per_note(steps))
+
+    def transpose_chromatic(self, semitones: int, scale_manager):
+        scale = scale_manager.transposed(self.scale, semitones)
+        return self._with(scale, scale.mps_to_positions(self.mps + semitones))
+
+    def remap(self, scale, nearest: bool = False):
+        if nearest:
+            return self._with(scale, scale.nearest_positions(self.mps))
+        if len(scale.notes) != len(self.scale.notes):
+            raise ValueError(f'{self.scale.name} and {scale.name} have different numbers of notes')
+        return self._with(scale, self.positions)
+
+    def invert(self, axis=None):
+        """Mirrors each tune about its axis position; the tune's starting note by default"""
+        axis = self.positions[self.offsets[:-1]] if axis is None else axis
+        return self._with(self.scale, 2 * self._per_note(axis) - self.positions)
+
+    def retrograde(self):
+        ids = self._tune_ids()
+        # Note k of a tune swaps with note (length - 1 - k)
+        reverse = self.offsets[ids + 1] - 1 - (np.arange(len(ids)) - self.offsets[ids])
+        return self._with(self.scale, self.positions[reverse])
+
+    def save(self, path: str, compress: bool = False):
+        """Writes the collection to an .npz; positions are stored one byte per note, a rootless scale's root as ''"""
+        save = np.savez_compressed if compress else np.savez
+        with open(path, 'wb') as f:
+            save(f, version=np.array(_FORMAT_VERSION), root=np.array(self.scale.root_note or ''),
+                 scale_type=np.array(self.scale.scale_type), positions=self.positions.astype(np.uint8),
+                 lengths=self.lengths.astype(np.uint32))
+
+    @classmethod
+    def load(cls, path: str, scale_manager=None):
+        """Reads a collection written by save; the scale comes from scale_manager (a new ScaleManager by default)"""
+        with np.load(path, allow_pickle=False) as arrays:
+            if int(arrays['version']) != _FORMAT_VERSION:
+                raise ValueError(f'{path} is version {int(arrays["version"])}; expected {_FORMAT_VERSION}')
+            scale = (scale_manager or cg.ScaleManager()).build_scale(str(arrays['root']), str(arrays['scale_type']))
+            lengths = arrays['lengths'].astype(np.int64)
+            return cls(scale, arrays['positions'], np.concatenate([[0], np.cumsum(lengths)]))